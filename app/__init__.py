@@ -12,8 +12,6 @@ from .config import config_by_name
 from datetime import timedelta
 from flask.sessions import SecureCookieSessionInterface
 import os.path
-import sentry_sdk
-from sentry_sdk.integrations.flask import FlaskIntegration
 
 # Initialize Sentry
 def init_sentry(app):
@@ -21,22 +19,25 @@ def init_sentry(app):
     environment = app.config.get('FLASK_ENV', 'development')
     
     if sentry_dsn:
+        # Imported only when configured; sentry_utils is a no-op otherwise
+        import sentry_sdk
+        from sentry_sdk.integrations.flask import FlaskIntegration
+        from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
+        from .sentry_utils import sentry_sampling_options
         sentry_sdk.init(
             dsn=sentry_dsn,
-            integrations=[FlaskIntegration()],
+            # SQLAlchemy adds a span per statement to recorded transactions
+            integrations=[FlaskIntegration(), SqlalchemyIntegration()],
             environment=environment,
             
-            # Set traces_sample_rate to 1.0 to capture 100% of transactions for performance monitoring
-            # We recommend adjusting this value in production
-            traces_sample_rate=1.0,
+            # Record most requests but only send slow, failed and a sample of the
+            # remaining transactions (see sentry_utils.sentry_sampling_options)
+            **sentry_sampling_options(app),
             
             # By default the SDK will try to use the SENTRY_RELEASE
             # environment variable, or infer a git commit
             # release=os.environ.get("SENTRY_RELEASE"),
             
-            # Enable performance monitoring
-            enable_tracing=True,
-            
             # Send IP address with errors
             send_default_pii=True,
         )
@@ -50,35 +51,21 @@ class CustomSessionInterface(SecureCookieSessionInterface):
         # Use SameSite=Strict in production if possible, else Lax
         return 'Strict' if app.config.get('SESSION_COOKIE_SECURE') else 'Lax'
 
-# Configure logging to save errors to flask_error.log
-logging.basicConfig(
-    filename='flask_error.log',
-    level=logging.INFO,  # Change from ERROR to INFO to capture more detailed logs
-    format='%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-)
-
-# Create a console handler to also show logs in the terminal
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-console.setFormatter(formatter)
-logging.getLogger('').addHandler(console)
-
 db = SQLAlchemy()
 login_manager = LoginManager()
 mail = Mail()
 migrate = Migrate()
+# Storage and strategy come from RATELIMIT_STORAGE_URI / RATELIMIT_STRATEGY in config
+from . import limiter_storage  # Registers the shared "sqlite://" storage scheme
 limiter = Limiter(
     key_func=get_remote_address,
-    default_limits=["1000 per day", "200 per hour"],
-    storage_uri="memory://",
-    strategy="fixed-window"
+    default_limits=["1000 per day", "200 per hour"]
 )
 
 @login_manager.user_loader
 def load_user(user_id):
-    from .models import User
-    return User.query.get(int(user_id))
+    from .identity import get_user
+    return get_user(user_id)
 
 # Add custom unauthorized handler for API requests
 @login_manager.unauthorized_handler
@@ -106,12 +93,66 @@ def nl2br_filter(text):
         return ""
     return text.replace('\n', '<br>')
 
+def load_mail_settings(app):
+    """Apply the SMTP settings stored in the database to the app's mail config
+    
+    Args:
+        app: Flask application
+    """
+    with app.app_context():
+        try:
+            from .models import Settings
+            settings = Settings.get_settings()
+            
+            # Only apply if all required settings are present
+            if (settings.smtp_server and settings.smtp_port and 
+                settings.smtp_username and settings.smtp_password):
+                
+                # Apply settings to app configuration
+                app.config['MAIL_SERVER'] = settings.smtp_server
+                app.config['MAIL_PORT'] = settings.smtp_port
+                app.config['MAIL_USERNAME'] = settings.smtp_username
+                app.config['MAIL_PASSWORD'] = settings.smtp_password
+                app.config['MAIL_USE_TLS'] = settings.smtp_use_tls
+                
+                # Set default sender if available
+                if settings.smtp_from_email:
+                    if settings.smtp_from_name:
+                        sender = f"{settings.smtp_from_name} <{settings.smtp_from_email}>"
+                    else:
+                        sender = settings.smtp_from_email
+                    app.config['MAIL_DEFAULT_SENDER'] = sender
+                
+                # Reinitialize mail with the new configuration
+                mail.init_app(app)
+                
+                app.logger.info(f"SMTP settings loaded from database: {settings.smtp_server}:{settings.smtp_port}")
+            else:
+                missing = []
+                if not settings.smtp_server:
+                    missing.append("SMTP Server")
+                if not settings.smtp_port:
+                    missing.append("SMTP Port")
+                if not settings.smtp_username:
+                    missing.append("SMTP Username")
+                if not settings.smtp_password:
+                    missing.append("SMTP Password")
+                
+                app.logger.warning(f"Could not load SMTP settings from database - missing: {', '.join(missing)}")
+                app.logger.warning("Using default mail settings. Test emails may fail.")
+        except Exception as e:
+            app.logger.error(f"Error loading SMTP settings from database: {str(e)}")
+
 def create_app(config_name=None):
     if config_name is None:
         config_name = os.getenv('FLASK_ENV', 'default')
         
     app = Flask(__name__)
     app.config.from_object(config_by_name[config_name])
+
+    # Queue-based logging to flask_error.log (JSON, rotated) and the console
+    from .logging_pipeline import init_logging
+    init_logging(app)
     
     # Ensure secret key is set
     if not app.config.get('SECRET_KEY'):
@@ -121,6 +162,10 @@ def create_app(config_name=None):
             app.logger.warning("Using default development SECRET_KEY. Set a proper SECRET_KEY environment variable.")
             app.config['SECRET_KEY'] = 'dev-key-please-change-in-production'
 
+    # Fail fast on settings that would block gevent workers
+    from .concurrency import check_worker_mode
+    check_worker_mode(app)
+
     # Initialize Sentry
     init_sentry(app)
 
@@ -131,6 +176,10 @@ def create_app(config_name=None):
     # Use custom session interface
     app.session_interface = CustomSessionInterface()
     
+    # Size the connection pool from the global connection budget
+    from .db_pool import apply_connection_budget
+    apply_connection_budget(app)
+
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
@@ -192,6 +241,32 @@ def create_app(config_name=None):
         # Let Flask handle other exceptions normally
         return e
 
+    # Password hashing overload (see password_hashing.run_bounded)
+    from .password_hashing import PasswordHashingBusyError, busy_response, configure_password_hasher
+    app.register_error_handler(PasswordHashingBusyError, busy_response)
+
+    # Calibrated Argon2 parameters (flask calibrate-hash)
+    configure_password_hasher(app)
+
+    from .cli import register_commands
+    register_commands(app)
+
+    # Periodic cleanup tasks (session purge, ...)
+    from .maintenance import init_maintenance
+    init_maintenance(app)
+
+    # Request counts and latency histograms (/metrics)
+    from .metrics import init_metrics
+    init_metrics(app)
+
+    # Per-request query counts, DB time and N+1 warnings
+    from .query_stats import init_query_stats
+    init_query_stats(app)
+
+    # Admin-triggered profiling of single requests
+    from .request_profiler import init_request_profiler
+    init_request_profiler(app)
+
     # Conditional CORS Setup
     if app.config['DEBUG']:
         # Development CORS (more permissive)
@@ -227,7 +302,7 @@ def create_app(config_name=None):
                     response.headers['Access-Control-Allow-Origin'] = origin
                     response.headers['Access-Control-Allow-Credentials'] = 'true'
                     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS, PATCH'
-                    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With, Accept, X-CSRF-TOKEN, X-CSRFToken, x-csrf-token, Expires, Cache-Control, Pragma'
+                    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With, Accept, X-CSRF-TOKEN, X-CSRFToken, x-csrf-token, Expires, Cache-Control, Pragma, Idempotency-Key'
                     response.headers['Vary'] = 'Origin'
             
             return response
@@ -260,7 +335,7 @@ def create_app(config_name=None):
                     response.headers['Access-Control-Allow-Origin'] = origin
                     response.headers['Access-Control-Allow-Credentials'] = 'true'
                     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS, PATCH'
-                    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With, Accept, X-CSRF-TOKEN, X-CSRFToken, x-csrf-token, Expires, Cache-Control, Pragma'
+                    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-Requested-With, Accept, X-CSRF-TOKEN, X-CSRFToken, x-csrf-token, Expires, Cache-Control, Pragma, Idempotency-Key'
                     response.headers['Vary'] = 'Origin'
             
             return response
@@ -271,6 +346,7 @@ def create_app(config_name=None):
     from .routes import bp as main_blueprint
     from .admin_routes import admin_bp as admin_blueprint
     from .violation_routes import violation_bp as violations_blueprint
+    from .upload_routes import upload_bp as uploads_blueprint
     from .user_routes import user_api as users_blueprint
     from .dashboard_routes import dashboard as dashboard_blueprint
     from .unit_routes import unit_bp as unit_blueprint
@@ -280,54 +356,18 @@ def create_app(config_name=None):
     app.register_blueprint(main_blueprint)
     app.register_blueprint(admin_blueprint)
     app.register_blueprint(violations_blueprint)
+    app.register_blueprint(uploads_blueprint)
     app.register_blueprint(users_blueprint)
     app.register_blueprint(dashboard_blueprint)
     app.register_blueprint(unit_blueprint)
     app.register_blueprint(test_jwt_blueprint)
+
+    from .upload_routes import check_upload_limits
+    check_upload_limits(app)
     
-    # Load SMTP settings from database when the app is fully initialized
-    with app.app_context():
-        try:
-            from .models import Settings
-            settings = Settings.get_settings()
-            
-            # Only apply if all required settings are present
-            if (settings.smtp_server and settings.smtp_port and 
-                settings.smtp_username and settings.smtp_password):
-                
-                # Apply settings to app configuration
-                app.config['MAIL_SERVER'] = settings.smtp_server
-                app.config['MAIL_PORT'] = settings.smtp_port
-                app.config['MAIL_USERNAME'] = settings.smtp_username
-                app.config['MAIL_PASSWORD'] = settings.smtp_password
-                app.config['MAIL_USE_TLS'] = settings.smtp_use_tls
-                
-                # Set default sender if available
-                if settings.smtp_from_email:
-                    if settings.smtp_from_name:
-                        sender = f"{settings.smtp_from_name} <{settings.smtp_from_email}>"
-                    else:
-                        sender = settings.smtp_from_email
-                    app.config['MAIL_DEFAULT_SENDER'] = sender
-                
-                # Reinitialize mail with the new configuration
-                mail.init_app(app)
-                
-                app.logger.info(f"SMTP settings loaded from database: {settings.smtp_server}:{settings.smtp_port}")
-            else:
-                missing = []
-                if not settings.smtp_server:
-                    missing.append("SMTP Server")
-                if not settings.smtp_port:
-                    missing.append("SMTP Port")
-                if not settings.smtp_username:
-                    missing.append("SMTP Username")
-                if not settings.smtp_password:
-                    missing.append("SMTP Password")
-                
-                app.logger.warning(f"Could not load SMTP settings from database - missing: {', '.join(missing)}")
-                app.logger.warning("Using default mail settings. Test emails may fail.")
-        except Exception as e:
-            app.logger.error(f"Error loading SMTP settings from database: {str(e)}")
+    # SMTP settings come from the database. A preloading gunicorn master must not
+    # connect to it, so there each worker loads them in the post_fork hook instead
+    if not app.config['MAIL_SETTINGS_DEFERRED']:
+        load_mail_settings(app)
 
     return app
@@ -0,0 +1,138 @@
+"""
+Buffered Violation Access Log
+
+Page views of secure violation links are recorded off the request path: each event
+is put on an in-process queue and a background thread writes them to
+violation_access_logs in multi-row INSERTs, every ACCESS_LOG_FLUSH_SIZE events or
+ACCESS_LOG_FLUSH_MS milliseconds, whichever comes first. Pending events are written
+when the worker exits.
+
+If the queue is full (the database is down or far behind) new events are dropped
+with a warning rather than slowing down page views.
+"""
+
+import os
+import time
+import queue
+import atexit
+import threading
+import logging
+from datetime import datetime
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+class AccessLogWriter:
+    """Background writer for ViolationAccess rows"""
+
+    def __init__(self, app):
+        self.app = app
+        self.flush_size = app.config.get('ACCESS_LOG_FLUSH_SIZE', 100)
+        self.flush_interval = app.config.get('ACCESS_LOG_FLUSH_MS', 500) / 1000.0
+        self.queue = queue.Queue(maxsize=app.config.get('ACCESS_LOG_QUEUE_SIZE', 10000))
+        self.stopping = threading.Event()
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Access log queue full; {self.dropped} events dropped so far")
+
+    def _take_batch(self):
+        """Block for the first event, then collect more until the batch is full or the interval ends"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        from . import db
+        from .models import ViolationAccess
+
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    # executemany on a single INSERT becomes a multi-row INSERT on MySQL
+                    connection.execute(ViolationAccess.__table__.insert(), batch)
+        except Exception as e:
+            logger.error(f"Could not write {len(batch)} violation access events: {str(e)}")
+
+    def _run(self):
+        while not self.stopping.is_set():
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+
+    def close(self):
+        """Stop the thread and write everything still queued"""
+        self.stopping.set()
+        self.thread.join(timeout=self.flush_interval * 2)
+        pending = []
+        while True:
+            try:
+                pending.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for start in range(0, len(pending), self.flush_size):
+            self._write(pending[start:start + self.flush_size])
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+def _get_writer():
+    global _writer, _writer_pid
+    # Threads do not survive fork, so each worker process gets its own writer
+    if _writer is None or _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer_pid != os.getpid():
+                _writer = AccessLogWriter(current_app._get_current_object())
+                _writer_pid = os.getpid()
+    return _writer
+
+def record_access(violation_id, ip_address, user_agent, token):
+    """
+    Queue a violation access event for the background writer
+
+    Args:
+        violation_id: ID of the violation
+        ip_address: Client IP address
+        user_agent: Client user agent string
+        token: Access token used
+    """
+    event = {
+        'violation_id': violation_id,
+        'ip_address': ip_address,
+        'user_agent': (user_agent or '')[:255],
+        'accessed_at': datetime.utcnow(),
+        'token': token,
+    }
+    if not current_app.config.get('ACCESS_LOG_BUFFERED', True):
+        from . import db
+        from .models import ViolationAccess
+        db.session.add(ViolationAccess(**event))
+        db.session.commit()
+        return
+    _get_writer().put(event)
+
+def flush_access_log():
+    """Write all queued events now (called at exit)"""
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.close()
+
+atexit.register(flush_access_log)
@@ -1,10 +1,11 @@
-from flask import Blueprint, redirect, url_for, flash, request, jsonify, current_app
+from flask import Blueprint, redirect, url_for, flash, request, jsonify, current_app, Response
 from flask_jwt_extended import get_jwt, get_jwt_identity
 from app.jwt_auth import jwt_required_api
 from .models import User, FieldDefinition, Settings
 from . import db
 from werkzeug.security import generate_password_hash
 import json
+import hmac
 from .utils import clear_field_cache
 
 admin_bp = Blueprint('admin', __name__)
@@ -122,6 +123,66 @@ def reorder_fields():
     
     return jsonify({'message': 'Fields reordered'})
 
+@admin_bp.route('/api/admin/hashing-stats', methods=['GET'])
+@jwt_required_api
+@admin_required
+def get_hashing_stats():
+    """Password hashing latency and queue metrics for the worker serving this request"""
+    from .password_hashing import get_hashing_stats as collect_hashing_stats
+    return jsonify(collect_hashing_stats())
+
+@admin_bp.route('/api/admin/db-pool-stats', methods=['GET'])
+@jwt_required_api
+@admin_required
+def get_db_pool_stats():
+    """Connection pool checkout wait and saturation metrics for the worker serving this request"""
+    from .db_pool import get_pool_stats
+    return jsonify(get_pool_stats())
+
+@jwt_required_api
+@admin_required
+def _admin_metrics():
+    from .metrics import render
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+@admin_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics summed over all workers (admin session or METRICS_TOKEN bearer token)"""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        from .metrics import render
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+    return _admin_metrics()
+
+@admin_bp.route('/api/admin/profiles/token', methods=['POST'])
+@jwt_required_api
+@admin_required
+def create_profile_token():
+    """Single-use token that profiles the one request sending it in the X-Profile header"""
+    from .request_profiler import generate_profile_token, HEADER
+    return jsonify({
+        'token': generate_profile_token(get_jwt_identity()),
+        'header': HEADER,
+        'expires_in': current_app.config.get('PROFILE_TOKEN_MAX_AGE', 900),
+    })
+
+@admin_bp.route('/api/admin/profiles', methods=['GET'])
+@jwt_required_api
+@admin_required
+def get_profiles():
+    """Saved request profiles, newest first"""
+    from .request_profiler import list_profiles
+    return jsonify(list_profiles())
+
+@admin_bp.route('/api/admin/profiles/<path:name>', methods=['GET'])
+@jwt_required_api
+@admin_required
+def download_profile(name):
+    """Download a saved profile"""
+    from flask import send_from_directory
+    from .request_profiler import profiles_dir
+    return send_from_directory(profiles_dir(), name, as_attachment=True)
+
 @admin_bp.route('/api/admin/settings', methods=['GET'])
 @admin_required
 def get_settings():
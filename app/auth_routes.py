@@ -1,11 +1,13 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, make_response, session, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from .models import User, AccountLockedError, UserSession
+from .password_hashing import PasswordHashingBusyError, busy_response
 from werkzeug.security import check_password_hash, generate_password_hash
 from . import db
 from functools import wraps
 from datetime import datetime, timedelta
 import logging
+import time
 # --- Added for Password Reset --- 
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadTimeSignature
 from flask import url_for
@@ -21,12 +23,14 @@ from flask_jwt_extended import (
     set_access_cookies,
     set_refresh_cookies,
     unset_jwt_cookies,
-    verify_jwt_in_request
+    verify_jwt_in_request,
+    decode_token
 )
 from .jwt_config import get_jwt_identity_claims, get_token_expiration, JWT_REFRESH_TOKEN_EXPIRES, JWT_EXTENDED_REFRESH_TOKEN_EXPIRES
 from .jwt_auth import jwt_required_api
+from .token_revocation import revoke_token, revoke_user_tokens
 from .sentry_utils import set_sentry_user, capture_exception, add_sentry_tag, with_sentry_transaction
-import sentry_sdk
+from .logging_pipeline import lazy
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -225,9 +229,7 @@ def login():
                 # Print debug info about cookies being set
                 logger.info(f"Setting session_token cookie: {user_session.token[:10]}... (truncated)")
                 logger.info(f"Cookie parameters: domain=None, path=/, secure=False, samesite=Lax, httponly=True")
-                logger.info(f"Response headers: {dict(response.headers)}")
-                # Print debug info
-                logger.debug("Response headers: %s", dict(response.headers))
+                logger.debug("Response headers: %s", lazy(lambda: dict(response.headers)))
                 # Update login time and last activity
                 session['login_time'] = datetime.utcnow().isoformat()
                 session['last_activity'] = datetime.utcnow().isoformat()
@@ -253,6 +255,9 @@ def login():
         except AccountLockedError as e:
             logger.warning(f"Login attempt on locked account: {email}. {str(e)}")
             return jsonify({'error': 'Account temporarily locked due to too many failed attempts. Please try again later.'}), 423
+        except PasswordHashingBusyError as e:
+            logger.warning(f"Login for {email} rejected: password hashing queue is full")
+            return busy_response(e)
             
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
@@ -529,6 +534,43 @@ def active_sessions():
         logger.error(f"Error retrieving active sessions: {str(e)}")
         return jsonify({'error': 'Failed to retrieve sessions'}), 500
 
+def _current_refresh_token():
+    """Decode the request's refresh token cookie, if there is a valid one"""
+    encoded = request.cookies.get(current_app.config.get('JWT_REFRESH_COOKIE_NAME', 'refresh_token_cookie'))
+    if not encoded:
+        return None
+    try:
+        return decode_token(encoded)
+    except Exception:
+        return None
+
+def _reissue_jwt_cookies(response):
+    """Replace the current JWT cookies with new tokens that keep the same expiry
+    
+    Args:
+        response: Response to set the cookies on
+    """
+    claims = get_jwt()
+    identity = get_jwt_identity()
+    additional_claims = {key: claims.get(key) for key in ('role', 'is_admin', 'email')}
+    now = int(time.time())
+    
+    access_token = create_access_token(
+        identity=identity,
+        additional_claims=additional_claims,
+        expires_delta=timedelta(seconds=max(claims.get('exp', now) - now, 1))
+    )
+    set_access_cookies(response, access_token)
+    
+    refresh_claims = _current_refresh_token()
+    if refresh_claims:
+        refresh_token = create_refresh_token(
+            identity=identity,
+            additional_claims=additional_claims,
+            expires_delta=timedelta(seconds=max(refresh_claims.get('exp', now) - now, 1))
+        )
+        set_refresh_cookies(response, refresh_token)
+
 @auth.route('/api/auth/terminate-sessions', methods=['POST', 'OPTIONS'])
 @cors_preflight
 @jwt_required_api
@@ -550,11 +592,16 @@ def terminate_sessions():
         # Terminate all other sessions
         count = current_user.terminate_other_sessions(current_session.id)
         
+        # Revoke every JWT issued so far, then give this session fresh tokens
+        revoke_user_tokens(get_jwt_identity())
+        
         logger.info(f"User {get_jwt().get('email')} terminated {count} other sessions")
-        return jsonify({
+        response = make_response(jsonify({
             'message': f'Successfully terminated {count} other sessions',
             'count': count
-        })
+        }))
+        _reissue_jwt_cookies(response)
+        return response
     except Exception as e:
         logger.error(f"Error terminating sessions: {str(e)}")
         return jsonify({'error': 'Failed to terminate sessions'}), 500
@@ -669,8 +716,15 @@ def register_api():
         return jsonify({'error': 'Registration failed'}), 500
 
 # --- SESSION TIMEOUT HANDLING ---
+# Paths that skip session timeout tracking entirely
+SESSION_EXEMPT_PREFIXES = ('/static/', '/favicon.ico', '/health')
+
 @auth.before_app_request
 def enforce_session_timeouts():
+    # Static files and health checks never touch the session
+    if request.endpoint == 'static' or request.path.startswith(SESSION_EXEMPT_PREFIXES):
+        return
+
     # First, safely check if a JWT token exists
     try:
         verify_jwt_in_request(optional=True)
@@ -713,8 +767,11 @@ def enforce_session_timeouts():
         logout_user()
         session.clear()
         return redirect(url_for('auth.login_page'))
-    # Update last activity
-    session['last_activity'] = now.isoformat()
+    # Update last activity, but only when it moved enough to matter; otherwise the
+    # session cookie would be re-signed and re-sent on every request
+    granularity = current_app.config.get('SESSION_ACTIVITY_GRANULARITY_SECONDS', 60)
+    if now - last_activity_dt >= timedelta(seconds=granularity):
+        session['last_activity'] = now.isoformat()
 
 # --- RE-AUTHENTICATION FOR SENSITIVE ACTIONS ---
 def require_recent_password(func):
@@ -897,8 +954,8 @@ def login_jwt():
 
     try:
         # Add Sentry tags directly instead of using the decorator
-        sentry_sdk.set_tag("transaction", "auth.login_jwt")
-        sentry_sdk.set_tag("operation", "auth")
+        add_sentry_tag("transaction", "auth.login_jwt")
+        add_sentry_tag("operation", "auth")
         
         # Debug output for CSRF tracking
         logger.info("=== login-jwt endpoint called ===")
@@ -907,10 +964,10 @@ def login_jwt():
         logger.info(f"JWT_COOKIE_SECURE: {current_app.config.get('JWT_COOKIE_SECURE')}")
         logger.info(f"JWT_COOKIE_DOMAIN: {current_app.config.get('JWT_COOKIE_DOMAIN')}")
         logger.info(f"JWT_COOKIE_CSRF_PROTECT: {current_app.config.get('JWT_COOKIE_CSRF_PROTECT')}")
-        logger.info(f"Request headers: {dict(request.headers)}")
-        logger.info(f"Request cookies: {dict(request.cookies)}")
-        logger.info(f"Request data: {request.data}")
-        logger.info(f"Request form: {request.form}")
+        logger.debug("Request headers: %s", lazy(lambda: dict(request.headers)))
+        logger.debug("Request cookies: %s", lazy(lambda: dict(request.cookies)))
+        logger.debug("Request data: %s", lazy(lambda: request.data))
+        logger.debug("Request form: %s", lazy(lambda: request.form))
         
         # Extract request data with explicit error handling
         try:
@@ -1016,7 +1073,7 @@ def login_jwt():
                     response.headers['Access-Control-Allow-Credentials'] = 'true'
                 
                 logger.info(f"JWT login successful for user {email}")
-                logger.info(f"Response headers: {dict(response.headers)}")
+                logger.debug("Response headers: %s", lazy(lambda: dict(response.headers)))
                 return response
             else:
                 # Record the failed login attempt
@@ -1039,6 +1096,9 @@ def login_jwt():
         except AccountLockedError as e:
             logger.warning(f"Login attempt on locked account: {email}. {str(e)}")
             return jsonify({'error': 'Account temporarily locked due to too many failed attempts. Please try again later.'}), 423
+        except PasswordHashingBusyError as e:
+            logger.warning(f"Login for {email} rejected: password hashing queue is full")
+            return busy_response(e)
             
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
@@ -1064,6 +1124,12 @@ def logout_jwt():
     if request.method == 'OPTIONS':
         return make_response()
     
+    # Revoke the access and refresh tokens so copies of the cookies stop working
+    revoke_token(get_jwt())
+    refresh_claims = _current_refresh_token()
+    if refresh_claims:
+        revoke_token(refresh_claims)
+    
     response = make_response(jsonify({'logout': True}))
     unset_jwt_cookies(response)
     
@@ -1159,8 +1225,8 @@ def status_jwt():
         return make_response()
     
     # Add Sentry tags directly instead of using the decorator
-    sentry_sdk.set_tag("transaction", "auth.status_jwt")
-    sentry_sdk.set_tag("operation", "auth")
+    add_sentry_tag("transaction", "auth.status_jwt")
+    add_sentry_tag("operation", "auth")
     
     # Get user claims from JWT
     claims = get_jwt()
@@ -1207,8 +1273,8 @@ def test_login():
     try:
         # Debug output
         logger.info("=== test-login endpoint called ===")
-        logger.info(f"Request headers: {dict(request.headers)}")
-        logger.info(f"Request cookies: {dict(request.cookies)}")
+        logger.debug("Request headers: %s", lazy(lambda: dict(request.headers)))
+        logger.debug("Request cookies: %s", lazy(lambda: dict(request.cookies)))
         
         # Get JSON data
         data = request.get_json()
@@ -1270,6 +1336,8 @@ def test_login():
             
         return response
             
+    except PasswordHashingBusyError as e:
+        return busy_response(e)
     except Exception as e:
         logger.error(f"Test login error: {str(e)}")
         return jsonify({'error': 'Authentication error occurred'}), 500
@@ -0,0 +1,165 @@
+"""
+Flask CLI commands
+
+Registered on the app in create_app(); run with `flask <command>` (FLASK_APP=run.py).
+"""
+
+import os
+import click
+
+
+def register_commands(app):
+    """Attach the application's CLI commands to the app"""
+
+    @app.cli.command('calibrate-hash')
+    @click.option('--target-ms', default=250, show_default=True, type=int,
+                  help='Target password verify latency in milliseconds.')
+    @click.option('--memory-budget-mb', default=512, show_default=True, type=int,
+                  help='Memory all concurrent password hashes may use together.')
+    @click.option('--workers', default=None, type=int,
+                  help='Gunicorn worker count (default: WEB_CONCURRENCY or 2 x CPUs + 1).')
+    @click.option('--dry-run', is_flag=True, help='Print the parameters without saving them.')
+    def calibrate_hash(target_ms, memory_budget_mb, workers, dry_run):
+        """Benchmark this host and store Argon2 parameters for password hashing.
+
+        Existing password hashes are upgraded to the new parameters when each
+        user next logs in.
+        """
+        from flask import current_app
+        from .password_hashing import calibrate_argon2, save_argon2_params, load_argon2_params
+
+        cpu_count = os.cpu_count() or 1
+        if workers is None:
+            workers = int(os.environ.get('WEB_CONCURRENCY') or cpu_count * 2 + 1)
+
+        # Hashes never run in more workers at once than the admission limit allows
+        concurrency = min(workers, current_app.config.get('HASHING_MAX_CONCURRENT', workers))
+
+        click.echo(f"Calibrating Argon2id: target {target_ms} ms, {memory_budget_mb} MB budget, "
+                   f"{workers} workers, {concurrency} concurrent hashes, {cpu_count} CPUs")
+        params = calibrate_argon2(target_ms, memory_budget_mb, concurrency, cpu_count=cpu_count)
+        params['workers'] = workers
+
+        click.echo(f"  time_cost={params['time_cost']} memory_cost={params['memory_cost']} KiB "
+                   f"parallelism={params['parallelism']} -> {params['measured_ms']} ms per verify")
+
+        path = current_app.config['ARGON2_PARAMS_FILE']
+        current = load_argon2_params(path)
+        if all(current[key] == params[key] for key in ('time_cost', 'memory_cost', 'parallelism')):
+            click.echo("Parameters unchanged.")
+            return
+
+        if dry_run:
+            click.echo("Dry run: parameters not saved.")
+            return
+
+        save_argon2_params(path, params)
+        click.echo(f"Saved to {path}. Restart the application to apply; "
+                   f"existing hashes are upgraded on next login.")
+
+    @app.cli.command('purge-sessions')
+    def purge_sessions():
+        """Delete expired and terminated user sessions in batches."""
+        from .maintenance import purge_stale_sessions
+        click.echo(purge_stale_sessions())
+
+    @app.cli.command('purge-idempotency-keys')
+    def purge_idempotency():
+        """Delete Idempotency-Key records past their TTL."""
+        from .idempotency import purge_idempotency_keys
+        click.echo(purge_idempotency_keys())
+
+    @app.cli.command('log-retention')
+    def log_retention():
+        """Roll up old access log events into daily counts and purge old status logs."""
+        from .log_retention import apply_log_retention
+        click.echo(apply_log_retention())
+
+    @app.cli.command('partition-access-logs')
+    @click.option('--undo', is_flag=True, help='Turn the partitioned table back into a plain one.')
+    def partition_access_logs(undo):
+        """Partition violation_access_logs by month (MySQL/MariaDB only).
+
+        Rebuilding the table copies every row; run it in a quiet period.
+        """
+        from flask import current_app
+        from . import db
+        from .log_retention import partition_access_log, unpartition_access_log
+
+        with db.engine.connect() as connection:
+            if connection.dialect.name != 'mysql':
+                raise click.ClickException('Partitioning needs MySQL/MariaDB')
+            if undo:
+                click.echo('Partitioning removed.' if unpartition_access_log(connection) else 'Table is not partitioned.')
+                return
+            created = partition_access_log(connection, current_app.config.get('ACCESS_LOG_PARTITIONS_AHEAD', 3))
+            click.echo(f"Created {created} partitions." if created else 'Table is already partitioned.')
+
+    @app.cli.command('bench-startup')
+    @click.option('--runs', default=5, show_default=True, type=int, help='Measurements per mode.')
+    def bench_startup(runs):
+        """Measure worker boot time: cold create_app() vs. fork of a preloaded app.
+
+        Cold runs start a fresh interpreter each time, like workers without
+        preload_app. Fork runs fork this (already loaded) process, reset the
+        connection pools as gunicorn's post_fork hook does and serve one request.
+        """
+        import json
+        import statistics
+        import subprocess
+        import sys
+        import time
+        from flask import current_app
+        from .concurrency import reset_after_fork
+
+        script = (
+            "import json, time; t0 = time.perf_counter(); "
+            "from app import create_app; t1 = time.perf_counter(); "
+            "create_app(); t2 = time.perf_counter(); "
+            "print(json.dumps({'import': t1 - t0, 'create_app': t2 - t1}))"
+        )
+        root = current_app.config['BASE_DIR']
+        cold = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True,
+                                    text=True, check=True).stdout.strip().splitlines()[-1]
+            timings = json.loads(output)
+            timings['total'] = time.perf_counter() - started
+            cold.append(timings)
+
+        app_object = current_app._get_current_object()
+        forked = []
+        for _ in range(runs):
+            read_fd, write_fd = os.pipe()
+            started = time.perf_counter()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                code = 0
+                try:
+                    reset_after_fork(app_object)
+                    status = app_object.test_client().get('/api/auth/test').status_code
+                    os.write(write_fd, json.dumps({'status': status, 'elapsed': time.perf_counter() - started}).encode())
+                except Exception:
+                    code = 1
+                finally:
+                    os._exit(code)
+            os.close(write_fd)
+            with os.fdopen(read_fd) as pipe:
+                result = pipe.read()
+            os.waitpid(pid, 0)
+            if result:
+                forked.append(json.loads(result)['elapsed'])
+
+        def summary(values):
+            return f"median {statistics.median(values) * 1000:.0f} ms, max {max(values) * 1000:.0f} ms"
+
+        click.echo(f"Cold start ({runs} runs, fresh interpreter):")
+        click.echo(f"  imports:    {summary([t['import'] for t in cold])}")
+        click.echo(f"  create_app: {summary([t['create_app'] for t in cold])}")
+        click.echo(f"  process:    {summary([t['total'] for t in cold])}")
+        if forked:
+            click.echo(f"Preloaded fork + first request ({len(forked)} runs): {summary(forked)}")
+        else:
+            click.echo("Preloaded fork: all runs failed")
@@ -0,0 +1,122 @@
+"""
+Cooperative Worker Support
+
+The app runs under gunicorn's sync workers (one request per process) or, with
+GUNICORN_WORKER_CLASS=gevent, under gevent workers where each process serves up
+to worker_connections requests as greenlets. Gunicorn monkey-patches the standard
+library before loading the app, so SMTP (smtplib), the clamd client, PyMySQL,
+time.sleep and the background threads all become cooperative.
+
+Two things do not yield on their own and are handled here:
+
+- C extensions doing their own I/O. mysqlclient (mysql:// URLs) blocks the whole
+  process, so check_worker_mode() refuses to start with it; use mysql+pymysql://.
+- CPU-bound work. run_cpu_bound() runs Argon2 and WeasyPrint on gevent's pool of
+  real OS threads (CPU_THREADPOOL_SIZE), so other greenlets keep being served.
+  Argon2 releases the GIL while hashing; WeasyPrint holds it but is preempted
+  every few milliseconds.
+
+Under sync workers run_cpu_bound() just calls the function.
+
+With preload_app the app is created once in the gunicorn master and workers
+inherit it copy-on-write. gunicorn.conf.py calls release_before_fork() in the
+master and reset_after_fork() in each worker, so no pooled database connection is
+ever shared between processes.
+"""
+
+import gc
+import logging
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+# Standard library modules that must be patched for cooperative I/O
+REQUIRED_PATCHES = ('socket', 'ssl', 'select', 'time', 'threading')
+
+# Database drivers implemented in C that block the event loop
+BLOCKING_DRIVERS = ('mysqldb',)
+
+def gevent_active():
+    """
+    Check whether this process runs under gevent's monkey-patching
+
+    Returns:
+        bool: True under gunicorn's gevent worker
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+def run_cpu_bound(fn, *args, **kwargs):
+    """
+    Run a CPU-heavy function without stalling other greenlets
+
+    The function runs without Flask's app or request context under gevent, so it
+    must only use its arguments.
+
+    Args:
+        fn: Function to call
+        *args, **kwargs: Arguments for fn
+
+    Returns:
+        The return value of fn (exceptions are re-raised in the caller)
+    """
+    if not gevent_active():
+        return fn(*args, **kwargs)
+    import gevent
+    return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+
+def check_worker_mode(app):
+    """
+    Validate and configure the process for the worker class it runs under
+
+    Args:
+        app: Flask application
+
+    Raises:
+        RuntimeError: If a blocking database driver is configured under gevent
+    """
+    if not gevent_active():
+        return
+
+    from gevent import get_hub, monkey
+
+    unpatched = [name for name in REQUIRED_PATCHES if not monkey.is_module_patched(name)]
+    if unpatched:
+        logger.warning(f"gevent worker without patched {', '.join(unpatched)}; those calls will block the worker")
+
+    driver = make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_driver_name()
+    if driver in BLOCKING_DRIVERS:
+        raise RuntimeError(
+            f"Database driver '{driver}' blocks gevent workers; use a mysql+pymysql:// DATABASE_URL"
+        )
+
+    get_hub().threadpool.maxsize = app.config.get('CPU_THREADPOOL_SIZE', 4)
+    logger.info(f"Running under gevent; CPU-bound work uses {get_hub().threadpool.maxsize} OS threads")
+
+def _dispose_engines(app, close):
+    from . import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+def release_before_fork(app):
+    """Close the master's pooled database connections before workers are forked"""
+    _dispose_engines(app, close=True)
+    # Move everything loaded so far out of the collector's reach, so garbage
+    # collection in workers does not touch (and un-share) the preloaded pages
+    gc.freeze()
+
+def reset_after_fork(app):
+    """
+    Give a freshly forked worker its own connection pools
+
+    Connections inherited from the master are dropped without being closed, since
+    closing them would also tear down the master's sockets.
+
+    Args:
+        app: Flask application inherited from the master
+    """
+    _dispose_engines(app, close=False)
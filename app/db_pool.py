@@ -0,0 +1,148 @@
+"""
+Database Connection Budget
+
+Every gunicorn worker has its own SQLAlchemy pool, so the number of connections
+the app can open is workers x (pool_size + max_overflow). With DB_CONNECTION_BUDGET
+set, the per-worker pool is derived from it instead:
+
+    per worker = (DB_CONNECTION_BUDGET - DB_CONNECTION_RESERVE) // workers
+
+but at least 1, so with more workers than budgeted connections the app can exceed
+the budget (a warning is logged at startup). Half of it goes to pool_size (kept
+open) and the rest to max_overflow (closed when returned). The worker count comes from GUNICORN_WORKERS, exported by
+gunicorn.conf.py, or WEB_CONCURRENCY. DB_CONNECTION_RESERVE is left for
+migrations, cron scripts and admin sessions.
+
+With DB_PROXY_URL set, the app connects through a local multiplexing proxy
+(ProxySQL, MaxScale) that all workers share, and keeps no pool of its own
+(NullPool): the proxy holds the few real server connections.
+
+Pools are created as InstrumentedQueuePool, which records how long checkouts wait
+and how close the pool is to saturation; see get_pool_stats().
+"""
+
+import os
+import time
+import threading
+import logging
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+from .metrics import DB_POOL_WAIT, DB_POOL_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+# Options that only apply to pooling engines
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'pool_use_lifo', 'pool_pre_ping')
+
+# Per-process metrics
+_stats_lock = threading.Lock()
+_stats = {
+    'checkouts': 0,
+    'waited': 0,
+    'timeouts': 0,
+    'wait_seconds_total': 0.0,
+    'wait_seconds_max': 0.0,
+    'checked_out_max': 0,
+}
+
+# A checkout slower than this had to wait for a connection (or open one)
+WAIT_THRESHOLD_SECONDS = 0.001
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records checkout wait time, timeouts and peak usage"""
+
+    # Log as QueuePool does; the default name would put pool debug output under the
+    # 'app' logger, which Flask sets to DEBUG in development
+    _sqla_logger_namespace = 'sqlalchemy.pool.impl.QueuePool'
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            DB_POOL_TIMEOUTS.inc()
+            with _stats_lock:
+                _stats['timeouts'] += 1
+            raise
+        waited = time.monotonic() - started
+        DB_POOL_WAIT.observe(waited)
+        checked_out = self.checkedout()
+        with _stats_lock:
+            _stats['checkouts'] += 1
+            _stats['wait_seconds_total'] += waited
+            _stats['wait_seconds_max'] = max(_stats['wait_seconds_max'], waited)
+            _stats['checked_out_max'] = max(_stats['checked_out_max'], checked_out)
+            if waited > WAIT_THRESHOLD_SECONDS:
+                _stats['waited'] += 1
+        return connection
+
+def worker_count():
+    """Number of gunicorn workers sharing the connection budget"""
+    return max(1, int(os.environ.get('GUNICORN_WORKERS') or os.environ.get('WEB_CONCURRENCY') or 1))
+
+def apply_connection_budget(app):
+    """
+    Set the engine's pool options from the connection budget or proxy settings
+
+    Must run before db.init_app(app), which creates the engine.
+
+    Args:
+        app: Flask application
+    """
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+
+    proxy_url = app.config.get('DB_PROXY_URL')
+    if proxy_url:
+        app.config['SQLALCHEMY_DATABASE_URI'] = proxy_url
+        for key in POOL_OPTIONS:
+            options.pop(key, None)
+        options['poolclass'] = NullPool
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+        logger.info("Database connections go through DB_PROXY_URL without a local pool")
+        return
+
+    budget = app.config.get('DB_CONNECTION_BUDGET', 0)
+    if budget:
+        workers = worker_count()
+        reserve = app.config.get('DB_CONNECTION_RESERVE', 2)
+        if workers > budget - reserve:
+            logger.warning(f"DB_CONNECTION_BUDGET {budget} (reserve {reserve}) is too small for {workers} workers; "
+                           f"each still gets 1 connection, so up to {workers + reserve} may be opened")
+        per_worker = max(1, (budget - reserve) // workers)
+        options['pool_size'] = max(1, (per_worker + 1) // 2)
+        options['max_overflow'] = per_worker - options['pool_size']
+        logger.info(f"Connection budget {budget} across {workers} workers: "
+                    f"pool_size={options['pool_size']} max_overflow={options['max_overflow']} per worker")
+
+    if 'pool_size' in options:
+        options['poolclass'] = InstrumentedQueuePool
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+def get_pool_stats():
+    """
+    Get connection pool metrics for this worker process
+
+    Returns:
+        dict: Checkout counts and wait times, current and peak usage, saturation
+    """
+    from . import db
+
+    with _stats_lock:
+        stats = dict(_stats)
+    pool = db.engine.pool
+    stats['pool_class'] = type(pool).__name__
+    stats['pid'] = os.getpid()
+    stats['workers'] = worker_count()
+    stats['wait_seconds_avg'] = stats['wait_seconds_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        stats.update({
+            'pool_size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'saturation': pool.checkedout() / capacity if capacity else 0.0,
+            'saturation_max': stats['checked_out_max'] / capacity if capacity else 0.0,
+        })
+    return stats
@@ -0,0 +1,362 @@
+"""
+Content-Addressed Evidence Store
+
+Uploaded evidence is stored once under saved_files/blobs/<aa>/<bb>/<sha256>, keyed by
+the SHA-256 of its content. Each violation gets a lightweight reference: a hard link
+at the usual saved_files/uploads/<subdir>/violation_<id>/<uuid>_<name> path plus an
+EvidenceReference row, so the existing path-based serving and permission checks keep
+working unchanged.
+
+Blobs are reference counted in evidence_blobs. Re-uploading content that is already in
+the store skips storage, and skips the virus scan when the client sends the expected
+SHA-256 up front. Deleting a violation releases its references and removes blobs
+nobody references any more.
+
+Whether content is already stored is decided under a lock on its evidence_blobs row,
+never from the disk alone: attach_upload() and the orphan removal in
+remove_evidence_files() both lock the row first, so a blob cannot be unlinked
+between one request deciding to reuse it and the link being created.
+
+Uploads are handled in two steps so the slow part can run outside the request thread:
+stage_upload() only does file I/O, attach_upload() records the reference in the
+current database session without committing.
+"""
+
+import os
+import re
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models import EvidenceBlob, EvidenceReference
+from .utils import stream_upload, scan_file, UploadRejectedError, ScanFailedError
+
+logger = logging.getLogger(__name__)
+
+_SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Shared pool for staging multi-file uploads; bounded so a large batch cannot
+# start an unbounded number of ClamAV connections
+_staging_executor = None
+_staging_executor_lock = threading.Lock()
+
+def _blob_root():
+    return os.path.join(current_app.config['BASE_DIR'], 'saved_files', 'blobs')
+
+def blob_path(sha256):
+    """
+    Get the absolute path of a blob
+
+    Args:
+        sha256: Hex digest of the blob content
+
+    Returns:
+        str: Absolute path of the blob file
+    """
+    return os.path.join(_blob_root(), sha256[:2], sha256[2:4], sha256)
+
+def normalize_sha256(value):
+    """
+    Validate a client-supplied SHA-256 hint
+
+    Args:
+        value: Hex digest from the client, or None
+
+    Returns:
+        str or None: Lowercase digest, or None if it is not 64 hex characters
+    """
+    value = (value or '').strip().lower()
+    return value if _SHA256_PATTERN.match(value) else None
+
+def stage_upload(stream, fallback_mimetype=None, expected_sha256=None):
+    """
+    Stream an upload into the staging area.
+
+    This does no database work, so it is safe to call from a worker thread. Whether
+    the content is a duplicate is decided later, by attach_upload().
+
+    Args:
+        stream: Readable binary file-like object
+        fallback_mimetype: MIME type to use if python-magic is not installed
+        expected_sha256: Optional client-supplied digest. If it names a blob that is
+            already stored, the virus scan is skipped while streaming.
+
+    Returns:
+        dict: Result of stream_upload()
+
+    Raises:
+        UploadRejectedError: If the file is empty, not allowed or infected
+        ScanFailedError: If the virus scan could not finish
+    """
+    # Only a well-formed digest may reach blob_path(); anything else is ignored
+    expected_sha256 = normalize_sha256(expected_sha256)
+    known = bool(expected_sha256) and os.path.exists(blob_path(expected_sha256))
+
+    staging_dir = os.path.join(_blob_root(), '.staging')
+    upload = stream_upload(stream, staging_dir, fallback_mimetype=fallback_mimetype, scan=not known)
+
+    if known and upload['sha256'] != expected_sha256:
+        # The client's digest was wrong, so the content was not scanned while streaming
+        is_clean, scan_result = scan_file(upload['temp_path'])
+        if not is_clean:
+            os.remove(upload['temp_path'])
+            if not scan_result.startswith('Infected'):
+                raise ScanFailedError(f"Virus scan failed: {scan_result}")
+            raise UploadRejectedError(f"Virus detected: {scan_result}")
+        upload['scan_result'] = scan_result
+
+    return upload
+
+def _get_staging_executor():
+    global _staging_executor
+    if _staging_executor is None:
+        with _staging_executor_lock:
+            if _staging_executor is None:
+                _staging_executor = ThreadPoolExecutor(
+                    max_workers=current_app.config.get('UPLOAD_PROCESSING_WORKERS', 4),
+                    thread_name_prefix='upload-staging'
+                )
+    return _staging_executor
+
+def stage_uploads(items):
+    """
+    Stage several uploads concurrently on the shared staging pool.
+
+    Args:
+        items: List of (stream, fallback_mimetype, expected_sha256) tuples
+
+    Returns:
+        list: (success, upload or error_message) tuples, in the same order as items
+    """
+    if len(items) <= 1:
+        # Not worth a thread hop for a single file
+        return [_stage_one(current_app._get_current_object(), *item) for item in items]
+
+    app = current_app._get_current_object()
+    executor = _get_staging_executor()
+    futures = [executor.submit(_stage_one, app, *item) for item in items]
+    return [future.result() for future in futures]
+
+def _stage_one(app, stream, fallback_mimetype, expected_sha256):
+    with app.app_context():
+        try:
+            return True, stage_upload(stream, fallback_mimetype=fallback_mimetype, expected_sha256=expected_sha256)
+        except UploadRejectedError as e:
+            return False, str(e)
+        except Exception as e:
+            logger.error(f"Error staging upload: {str(e)}")
+            return False, f"Error: {str(e)}"
+
+def _store_blob(upload):
+    """Move a staged upload into its content-addressed location"""
+    path = blob_path(upload['sha256'])
+    if upload.get('temp_path'):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            # Stored concurrently by another request
+            os.remove(upload['temp_path'])
+        else:
+            # Blobs are shared through hard links, so make them read-only
+            os.chmod(upload['temp_path'], 0o444)
+            os.replace(upload['temp_path'], path)
+        upload['temp_path'] = None
+    return path
+
+def _increment_blob(upload):
+    """Add one reference to a blob row, creating it if needed"""
+    updated = EvidenceBlob.query.filter_by(sha256=upload['sha256']).update(
+        {EvidenceBlob.ref_count: EvidenceBlob.ref_count + 1},
+        synchronize_session=False
+    )
+    if updated:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(EvidenceBlob(
+                sha256=upload['sha256'],
+                size=upload['size'],
+                mime_type=upload['mime_type'],
+                ref_count=1
+            ))
+    except IntegrityError:
+        # Row inserted concurrently; count this reference against it
+        EvidenceBlob.query.filter_by(sha256=upload['sha256']).update(
+            {EvidenceBlob.ref_count: EvidenceBlob.ref_count + 1},
+            synchronize_session=False
+        )
+
+def attach_upload(upload, violation_id, filename, subdir='fields'):
+    """
+    Reference a staged upload from a violation.
+
+    Stores the blob if it is new, creates the per-violation hard link and adds the
+    reference rows to the current session. The blob row stays locked until the
+    caller commits. What was created on disk is recorded in upload ('link_path',
+    and 'blob_path' when the blob is new) so revert_upload() can remove it if the
+    caller rolls back.
+
+    Args:
+        upload: Result of stage_upload()
+        violation_id: The violation ID
+        filename: Stored filename (already unique and secured)
+        subdir: Subdirectory within uploads (default: 'fields')
+
+    Returns:
+        str: Path of the reference relative to BASE_DIR
+    """
+    # Lock the blob row so a concurrent orphan removal cannot unlink the file we reuse
+    blob = EvidenceBlob.query.filter_by(sha256=upload['sha256']).with_for_update().first()
+    upload['duplicate'] = blob is not None and os.path.exists(blob_path(upload['sha256']))
+    if upload['duplicate']:
+        discard_upload(upload)
+        source = blob_path(upload['sha256'])
+    else:
+        source = upload['blob_path'] = _store_blob(upload)
+
+    relative_path = os.path.join('saved_files', 'uploads', subdir, f'violation_{violation_id}', filename)
+    link_path = os.path.join(current_app.config['BASE_DIR'], relative_path)
+    os.makedirs(os.path.dirname(link_path), exist_ok=True)
+
+    try:
+        os.link(source, link_path)
+    except OSError as e:
+        # Hard links need the same filesystem; fall back to a plain copy
+        logger.warning(f"Could not hard link evidence blob {upload['sha256'][:12]}: {str(e)}. Copying instead.")
+        shutil.copyfile(source, link_path)
+    upload['link_path'] = link_path
+
+    _increment_blob(upload)
+    db.session.add(EvidenceReference(
+        blob_sha256=upload['sha256'],
+        violation_id=violation_id,
+        path=relative_path,
+        original_filename=filename
+    ))
+
+    if upload['duplicate']:
+        logger.info(f"Deduplicated upload for violation {violation_id}: blob {upload['sha256'][:12]}")
+    return relative_path
+
+def discard_upload(upload):
+    """Remove the staged file of an upload that will not be attached"""
+    if upload and upload.get('temp_path'):
+        try:
+            os.remove(upload['temp_path'])
+        except OSError:
+            pass
+        upload['temp_path'] = None
+
+def revert_upload(upload):
+    """
+    Remove what an upload left on disk after its transaction was rolled back
+
+    Deletes the staged file, the link created by attach_upload() and, if that call
+    stored a new blob, the blob too unless another reference has been committed.
+    """
+    discard_upload(upload)
+    if not upload:
+        return
+    link_path = upload.pop('link_path', None)
+    if link_path:
+        try:
+            os.remove(link_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove evidence file {link_path}: {str(e)}")
+    if upload.pop('blob_path', None):
+        _remove_blob_if_orphaned(upload['sha256'])
+
+def release_violation_evidence(violation_id):
+    """
+    Release every evidence reference held by a violation.
+
+    Reference rows are deleted and blob counts decremented in the current session.
+    Nothing is removed from disk until the caller has committed and passed the
+    returned paths to remove_evidence_files().
+
+    Args:
+        violation_id: The violation ID
+
+    Returns:
+        list: Absolute paths of the links, and of blobs that may now be orphaned
+    """
+    refs = EvidenceReference.query.filter_by(violation_id=violation_id).all()
+    if not refs:
+        return []
+
+    base_dir = current_app.config['BASE_DIR']
+    paths = [os.path.join(base_dir, ref.path) for ref in refs]
+
+    counts = {}
+    for ref in refs:
+        counts[ref.blob_sha256] = counts.get(ref.blob_sha256, 0) + 1
+
+    EvidenceReference.query.filter_by(violation_id=violation_id).delete(synchronize_session=False)
+    for sha256, count in counts.items():
+        EvidenceBlob.query.filter_by(sha256=sha256).update(
+            {EvidenceBlob.ref_count: EvidenceBlob.ref_count - count},
+            synchronize_session=False
+        )
+
+    # The rows are kept; remove_evidence_files() re-checks them under a lock
+    orphaned = [
+        blob.sha256 for blob in EvidenceBlob.query.filter(
+            EvidenceBlob.sha256.in_(list(counts)),
+            EvidenceBlob.ref_count <= 0
+        ).all()
+    ]
+    paths.extend(blob_path(sha256) for sha256 in orphaned)
+
+    logger.info(f"Released {len(refs)} evidence references for violation {violation_id} ({len(orphaned)} blobs orphaned)")
+    return paths
+
+def _remove_blob_if_orphaned(sha256):
+    """
+    Delete a blob row and its file if nothing references it
+
+    Runs in its own transaction with the row locked, so an upload attaching the
+    same content either sees the row gone and stores the file again, or re-uses
+    it and keeps it alive.
+    """
+    try:
+        blob = EvidenceBlob.query.filter_by(sha256=sha256).with_for_update().first()
+        if blob is not None and blob.ref_count > 0:
+            # Referenced again since it was released
+            db.session.commit()
+            return False
+        if blob is not None:
+            db.session.delete(blob)
+        try:
+            os.remove(blob_path(sha256))
+        except FileNotFoundError:
+            pass
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Could not remove evidence blob {sha256[:12]}: {str(e)}")
+        return False
+
+def remove_evidence_files(paths):
+    """
+    Remove files returned by release_violation_evidence() once the release is committed
+
+    Links are unlinked directly. Blobs are only removed if their row still has no
+    references, checked under a row lock; each removal commits on its own.
+    """
+    blob_root = _blob_root() + os.sep
+    for path in paths:
+        if path.startswith(blob_root):
+            _remove_blob_if_orphaned(os.path.basename(path))
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove evidence file {path}: {str(e)}")
@@ -0,0 +1,221 @@
+"""
+Idempotency-Key Support
+
+Clients that retry a write after a timeout send the same Idempotency-Key header
+with every attempt. The first request claims the key by inserting a 'processing'
+row into idempotency_keys and runs the view; its response is stored on the row.
+A repeated request returns the stored response (marked Idempotent-Replayed: true)
+without running the view again, so a retried POST /api/violations does not create
+a second violation, render the HTML/PDF again or send the notification again.
+
+Duplicates that arrive while the original is still running wait for it, for up to
+IDEMPOTENCY_WAIT_SECONDS, and then replay its response. Waiters in the same worker
+are woken as soon as it finishes; others poll the row. If the original is still
+running after that, the duplicate gets 409 with Retry-After.
+
+- Keys are scoped to the user, method and path, and kept IDEMPOTENCY_KEY_TTL_HOURS.
+- Reusing a key with a different payload is rejected with 422.
+- 5xx responses and exceptions are not stored, so the request can be retried.
+- A processing row whose worker died is taken over after IDEMPOTENCY_LOCK_TIMEOUT_SECONDS.
+- Requests without the header are not affected.
+
+Expired keys are deleted by the 'purge-idempotency-keys' maintenance task.
+"""
+
+import time
+import hashlib
+import threading
+import logging
+from functools import wraps
+from datetime import datetime, timedelta
+from flask import current_app, request, jsonify, make_response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+POLL_SECONDS = 0.25  # Between checks for an original running in another worker
+
+_lock = threading.Lock()
+_inflight = {}  # key hash -> Event set when this worker finishes the original request
+
+def _hash(*parts):
+    return hashlib.sha256('\n'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+def _request_fingerprint():
+    """
+    Fingerprint of the payload, to detect a key reused for a different request
+
+    JSON bodies are hashed in full. For multipart uploads the form fields and the
+    name and size of each file are used, so large files are not read an extra time
+    (the total length differs between attempts because of the random boundary).
+    """
+    if request.is_json:
+        return _hash(request.query_string.decode('latin-1'), hashlib.sha256(request.get_data()).hexdigest())
+    files = sorted((name, file.filename or '', _file_size(file)) for name, file in request.files.items(multi=True))
+    form = sorted(request.form.items(multi=True))
+    return _hash(request.query_string.decode('latin-1'), form, files)
+
+def _file_size(file):
+    stream = file.stream
+    position = stream.tell()
+    size = stream.seek(0, 2)
+    stream.seek(position)
+    return size
+
+def _table():
+    return IdempotencyKey.__table__
+
+def _claim(key_hash, user_id, request_hash):
+    """Insert the processing row; returns its id, or None if the key already exists"""
+    from . import db
+
+    now = datetime.utcnow()
+    try:
+        with db.engine.begin() as connection:
+            result = connection.execute(_table().insert().values(
+                key_hash=key_hash,
+                user_id=int(user_id) if str(user_id).isdigit() else None,
+                method=request.method,
+                path=request.path[:255],
+                request_hash=request_hash,
+                status=IdempotencyKey.STATUS_PROCESSING,
+                created_at=now,
+                locked_until=now + timedelta(seconds=current_app.config.get('IDEMPOTENCY_LOCK_TIMEOUT_SECONDS', 300)),
+                expires_at=now + timedelta(hours=current_app.config.get('IDEMPOTENCY_KEY_TTL_HOURS', 24)),
+            ))
+        return result.inserted_primary_key[0]
+    except IntegrityError:
+        return None
+
+def _load(key_hash):
+    from . import db
+
+    table = _table()
+    with db.engine.connect() as connection:
+        return connection.execute(db.select(table).where(table.c.key_hash == key_hash)).first()
+
+def _delete(row_id):
+    from . import db
+
+    table = _table()
+    with db.engine.begin() as connection:
+        connection.execute(table.delete().where(table.c.id == row_id))
+
+def _store(row_id, response):
+    from . import db
+
+    table = _table()
+    with db.engine.begin() as connection:
+        connection.execute(table.update().where(table.c.id == row_id).values(
+            status=IdempotencyKey.STATUS_COMPLETED,
+            response_status=response.status_code,
+            response_body=response.get_data(as_text=True),
+            response_content_type=response.content_type,
+        ))
+
+def _replay(row):
+    response = make_response(row.response_body or '', row.response_status)
+    if row.response_content_type:
+        response.headers['Content-Type'] = row.response_content_type
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _run_original(key_hash, row_id, fn, args, kwargs):
+    """Run the view as the owner of the key and store its response"""
+    event = threading.Event()
+    with _lock:
+        _inflight[key_hash] = event
+    try:
+        try:
+            response = make_response(fn(*args, **kwargs))
+        except Exception:
+            _delete(row_id)
+            raise
+        if response.status_code >= 500 or response.direct_passthrough:
+            # Not stored: the client may retry (or the body is a stream)
+            _delete(row_id)
+        else:
+            try:
+                _store(row_id, response)
+            except Exception as e:
+                logger.error(f"Could not store idempotent response for {request.path}: {str(e)}")
+                _delete(row_id)
+        return response
+    finally:
+        with _lock:
+            _inflight.pop(key_hash, None)
+        event.set()
+
+def _wait(key_hash, remaining):
+    event = _inflight.get(key_hash)
+    if event is not None:
+        event.wait(remaining)  # Set the moment the original finishes in this worker
+    else:
+        time.sleep(min(POLL_SECONDS, remaining))
+
+def idempotent(fn):
+    """Decorator making a write endpoint honor the Idempotency-Key header
+
+    Goes below jwt_required_api, since keys are scoped to the user.
+
+    Args:
+        fn: The view function to decorate
+
+    Returns:
+        decorated function
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not current_app.config.get('IDEMPOTENCY_ENABLED', True):
+            return fn(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'}), 400
+
+        user_id = get_jwt_identity()
+        key_hash = _hash(user_id, request.method, request.path, key)
+        request_hash = _request_fingerprint()
+        wait_seconds = current_app.config.get('IDEMPOTENCY_WAIT_SECONDS', 30)
+        deadline = time.monotonic() + wait_seconds
+
+        while True:
+            row_id = _claim(key_hash, user_id, request_hash)
+            if row_id is not None:
+                return _run_original(key_hash, row_id, fn, args, kwargs)
+
+            row = _load(key_hash)
+            if row is None:
+                continue  # The original failed and released the key; claim it again
+            now = datetime.utcnow()
+            if row.expires_at <= now or (row.status == IdempotencyKey.STATUS_PROCESSING and row.locked_until <= now):
+                logger.warning(f"Taking over {'expired' if row.expires_at <= now else 'abandoned'} "
+                               f"idempotency key for {request.method} {request.path}")
+                _delete(row.id)
+                continue
+            if row.request_hash != request_hash:
+                return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+            if row.status == IdempotencyKey.STATUS_COMPLETED:
+                logger.info(f"Replaying response for repeated {request.method} {request.path}")
+                return _replay(row)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                response = jsonify({'error': 'A request with this Idempotency-Key is still being processed'})
+                response.status_code = 409
+                response.headers['Retry-After'] = str(max(1, int(wait_seconds)))
+                return response
+            _wait(key_hash, remaining)
+
+    return wrapper
+
+def purge_idempotency_keys():
+    """Delete idempotency keys past their TTL"""
+    from . import db
+
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+    db.session.commit()
+    return f"{deleted} expired idempotency keys deleted"
@@ -0,0 +1,121 @@
+"""
+User Identity Cache
+
+get_user() resolves a user at most once per request (cached on flask.g) and keeps
+recently used users in a small per-worker LRU with a short TTL, so Flask-Login's
+user_loader, the JWT user_lookup_loader and creator-email lookups need zero or one
+User query per request.
+
+Cached entries are detached User instances loaded in their own session. Every hit
+is merged into the request's session with load=False, which copies the cached
+state into a fresh instance without querying; the cached object itself is never
+handed out or modified.
+
+Entries are dropped whenever a User row is updated or deleted through the ORM
+(mapper events below), and again when that transaction commits. Other workers
+keep their copy until IDENTITY_CACHE_TTL_SECONDS passes, which bounds how long a
+role change or deactivation can go unnoticed.
+"""
+
+import time
+import threading
+import logging
+from collections import OrderedDict
+from flask import current_app, g, has_app_context, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from . import db
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # user id -> (expires at, detached User)
+
+def _config(key, default):
+    return current_app.config.get(key, default) if has_app_context() else default
+
+def _load_detached(user_id):
+    """Load a user in a short-lived session and detach it for caching"""
+    with Session(db.engine) as session:
+        user = session.get(User, user_id)
+        if user is not None:
+            session.expunge(user)
+        return user
+
+def get_user(user_id):
+    """
+    Get a user by ID through the request and LRU caches
+
+    Args:
+        user_id: User ID (int or numeric string)
+
+    Returns:
+        User: Instance bound to the current db.session, or None if not found
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    request_cache = None
+    if has_request_context():
+        request_cache = g.setdefault('_identity_users', {})
+        if user_id in request_cache:
+            return request_cache[user_id]
+
+    ttl = _config('IDENTITY_CACHE_TTL_SECONDS', 30)
+    now = time.monotonic()
+    cached = None
+    if ttl > 0:
+        with _lock:
+            entry = _cache.get(user_id)
+            if entry and entry[0] > now:
+                _cache.move_to_end(user_id)
+                cached = entry[1]
+            elif entry:
+                del _cache[user_id]
+
+    if cached is None:
+        cached = _load_detached(user_id)
+        if cached is not None and ttl > 0:
+            with _lock:
+                _cache[user_id] = (now + ttl, cached)
+                _cache.move_to_end(user_id)
+                while len(_cache) > _config('IDENTITY_CACHE_SIZE', 512):
+                    _cache.popitem(last=False)
+
+    user = db.session.merge(cached, load=False) if cached is not None else None
+    if request_cache is not None:
+        request_cache[user_id] = user
+    return user
+
+def invalidate_user(user_id):
+    """Drop a user from this worker's cache and the current request's cache"""
+    with _lock:
+        _cache.pop(user_id, None)
+    if has_request_context():
+        g.get('_identity_users', {}).pop(user_id, None)
+
+def clear_identity_cache():
+    """Drop every cached user in this worker"""
+    with _lock:
+        _cache.clear()
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+    # Invalidate again after commit, in case a concurrent request re-cached the old row
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('_identity_changed', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    for user_id in session.info.pop('_identity_changed', ()):
+        invalidate_user(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed(session):
+    session.info.pop('_identity_changed', None)
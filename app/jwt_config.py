@@ -80,9 +80,20 @@ def init_jwt(app):
         Returns:
             User: User object or None
         """
-        from .models import User
+        from .identity import get_user
         identity = jwt_data["sub"]
-        return User.query.get(identity)
+        return get_user(identity)
+    
+    @jwt.token_in_blocklist_loader
+    def check_if_token_revoked(_jwt_header, jwt_data):
+        """Reject tokens revoked by logout or session termination (in-memory check)"""
+        from .token_revocation import is_token_revoked
+        return is_token_revoked(jwt_data)
+    
+    @jwt.revoked_token_loader
+    def revoked_token_callback(_jwt_header, jwt_data):
+        app.logger.info(f"Revoked token used for user {jwt_data.get('sub')}")
+        return {'error': 'Token has been revoked'}, 401
     
     # Debug logging for the most common JWT errors
     @jwt.expired_token_loader
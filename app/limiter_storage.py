@@ -0,0 +1,167 @@
+"""
+SQLite Rate Limit Storage
+
+A `limits` storage backend that keeps rate limit state in a local SQLite database in
+WAL mode, so every gunicorn worker on the host shares the same counters and they
+survive restarts, without running Redis or memcached.
+
+Importing this module registers the "sqlite" storage scheme:
+
+    RATELIMIT_STORAGE_URI = "sqlite:////path/to/ratelimit.sqlite"
+
+Both the fixed-window counters and the moving-window strategy are supported. Each
+check is one short IMMEDIATE transaction on an indexed table, which serializes
+workers on the write lock for a few microseconds.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from urllib.parse import urlparse, unquote
+from limits.storage import Storage, MovingWindowSupport
+
+# Expired rows are deleted every this many writes (per process)
+CLEANUP_EVERY = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS window_entries (
+    key TEXT NOT NULL,
+    ts REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_window_entries_key_ts ON window_entries (key, ts);
+CREATE INDEX IF NOT EXISTS ix_window_entries_expires_at ON window_entries (expires_at);
+"""
+
+class SQLiteStorage(Storage, MovingWindowSupport):
+    """Rate limit storage shared by all processes through a SQLite WAL database"""
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, timeout=5.0, **options):
+        parsed = urlparse(uri)
+        # sqlite:////abs/path -> /abs/path, sqlite:///rel/path -> rel/path
+        self.path = unquote(parsed.path[1:] if parsed.path.startswith('//') else parsed.path.lstrip('/'))
+        self.timeout = float(timeout)
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+        super().__init__(uri, **options)
+
+    def _connection(self):
+        # One connection per thread, reopened after fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    class _Transaction:
+        def __init__(self, storage):
+            self.conn = storage._connection()
+
+        def __enter__(self):
+            self.conn.execute('BEGIN IMMEDIATE')
+            return self.conn
+
+        def __exit__(self, exc_type, exc, tb):
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+            return False
+
+    def _transaction(self):
+        return self._Transaction(self)
+
+    def _maybe_cleanup(self, conn, now):
+        self._writes += 1
+        if self._writes % CLEANUP_EVERY == 0:
+            conn.execute('DELETE FROM counters WHERE expires_at <= ?', (now,))
+            conn.execute('DELETE FROM window_entries WHERE expires_at <= ?', (now,))
+
+    # --- Fixed window counters ---
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT value, expires_at FROM counters WHERE key = ?', (key,)).fetchone()
+            if row is None or row[1] <= now:
+                value, expires_at = amount, now + expiry
+            else:
+                value = row[0] + amount
+                expires_at = now + expiry if elastic_expiry else row[1]
+            conn.execute(
+                'INSERT OR REPLACE INTO counters (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, value, expires_at)
+            )
+            self._maybe_cleanup(conn, now)
+        return value
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM counters WHERE key = ? AND expires_at > ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            'SELECT expires_at FROM counters WHERE key = ? AND expires_at > ?', (key, now)
+        ).fetchone()
+        return int(row[0] if row else now)
+
+    # --- Moving window ---
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        with self._transaction() as conn:
+            (acquired,) = conn.execute(
+                'SELECT COUNT(*) FROM window_entries WHERE key = ? AND ts >= ?', (key, now - expiry)
+            ).fetchone()
+            if acquired + amount > limit:
+                return False
+            conn.executemany(
+                'INSERT INTO window_entries (key, ts, expires_at) VALUES (?, ?, ?)',
+                [(key, now, now + expiry)] * amount
+            )
+            self._maybe_cleanup(conn, now)
+        return True
+
+    def get_moving_window(self, key, limit, expiry):
+        now = time.time()
+        start, acquired = self._connection().execute(
+            'SELECT MIN(ts), COUNT(*) FROM window_entries WHERE key = ? AND ts >= ?', (key, now - expiry)
+        ).fetchone()
+        return int(start if start is not None else now), acquired
+
+    # --- Housekeeping ---
+
+    def check(self):
+        try:
+            self._connection().execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._transaction() as conn:
+            counters = conn.execute('DELETE FROM counters').rowcount
+            entries = conn.execute('DELETE FROM window_entries').rowcount
+        return counters + entries
+
+    def clear(self, key):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM counters WHERE key = ?', (key,))
+            conn.execute('DELETE FROM window_entries WHERE key = ?', (key,))
@@ -0,0 +1,359 @@
+"""
+Access and Status Log Retention
+
+Every secure-link view adds a violation_access_logs row, so raw events are only
+kept for ACCESS_LOG_RETENTION_DAYS. Older events are rolled up into one
+violation_access_daily row per violation and day, and the raw rows are deleted in
+batches of LOG_RETENTION_BATCH_SIZE. Each batch adds its counts and deletes its rows
+in the same transaction, so an interrupted run never double counts.
+
+On MariaDB the access log can be partitioned by month with
+`flask partition-access-logs` (and unpartitioned with --undo). When it is, whole
+months past retention are rolled up with
+one GROUP BY and dropped with ALTER TABLE ... DROP PARTITION instead of row by row,
+and empty partitions are kept ACCESS_LOG_PARTITIONS_AHEAD months ahead of today.
+
+violation_status_log holds the status history shown on each violation, so it is
+kept forever unless STATUS_LOG_RETENTION_DAYS is set.
+"""
+
+from collections import Counter
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy import inspect, text
+
+ACCESS_LOG_TABLE = 'violation_access_logs'
+# Partitions rolled up but not dropped yet (created by partition_access_log())
+PARTITION_ROLLUP_TABLE = 'access_log_partition_rollups'
+
+# MySQL TO_DAYS() counts from year 0, Python ordinals from 0001-01-01
+_TO_DAYS_OFFSET = 365
+
+def _month_start(day):
+    return day.replace(day=1)
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1, day=1)
+
+def partition_name(month):
+    """Name of the partition holding the month starting at month"""
+    return f"p{month.year:04d}{month.month:02d}"
+
+def _increment_daily(connection, counts):
+    """Add access counts to violation_access_daily, keyed by (violation_id, day)"""
+    from .models import ViolationAccessDaily
+
+    if not counts:
+        return
+    table = ViolationAccessDaily.__table__
+    rows = [{'violation_id': vid, 'day': day, 'access_count': n} for (vid, day), n in counts.items()]
+    dialect = connection.dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table)
+        statement = statement.on_duplicate_key_update(
+            access_count=table.c.access_count + statement.inserted.access_count
+        )
+    elif dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.violation_id, table.c.day],
+            set_={'access_count': table.c.access_count + statement.excluded.access_count}
+        )
+    else:
+        for row in rows:
+            updated = connection.execute(
+                table.update()
+                .where(table.c.violation_id == row['violation_id'], table.c.day == row['day'])
+                .values(access_count=table.c.access_count + row['access_count'])
+            )
+            if not updated.rowcount:
+                connection.execute(table.insert(), row)
+        return
+
+    connection.execute(statement, rows)
+
+def rollup_access_logs(cutoff, batch_size=5000):
+    """
+    Roll access events before a cutoff into daily counts and delete them in batches
+
+    Args:
+        cutoff (datetime): Events accessed before this time are rolled up
+        batch_size (int): Rows rolled up and deleted per transaction
+
+    Returns:
+        int: Number of raw rows deleted
+    """
+    from . import db
+    from .models import Violation, ViolationAccess
+
+    table = ViolationAccess.__table__
+    violations = Violation.__table__
+    total = 0
+    while True:
+        with db.engine.begin() as connection:
+            # Events of deleted violations (possible once the table is partitioned and
+            # has no foreign key) are deleted without being counted
+            rows = connection.execute(
+                db.select(table.c.id, table.c.violation_id, table.c.accessed_at, violations.c.id.label('existing'))
+                .outerjoin(violations, violations.c.id == table.c.violation_id)
+                .where(table.c.accessed_at < cutoff)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            _increment_daily(connection, Counter(
+                (row.violation_id, row.accessed_at.date()) for row in rows if row.existing is not None
+            ))
+            connection.execute(table.delete().where(table.c.id.in_([row.id for row in rows])))
+        total += len(rows)
+        if len(rows) < batch_size:
+            break
+    return total
+
+def purge_status_logs(cutoff, batch_size=5000):
+    """
+    Delete status log entries recorded before a cutoff, in batches
+
+    Args:
+        cutoff (datetime): Entries before this time are deleted
+        batch_size (int): Rows deleted per transaction
+
+    Returns:
+        int: Number of rows deleted
+    """
+    from . import db
+    from .models import ViolationStatusLog
+
+    table = ViolationStatusLog.__table__
+    total = 0
+    while True:
+        with db.engine.begin() as connection:
+            ids = connection.execute(
+                db.select(table.c.id).where(table.c.timestamp < cutoff).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            connection.execute(table.delete().where(table.c.id.in_(ids)))
+        total += len(ids)
+        if len(ids) < batch_size:
+            break
+    return total
+
+# --- MariaDB partitions ---
+
+def get_partitions(connection):
+    """
+    List the access log's RANGE partitions
+
+    Args:
+        connection: SQLAlchemy connection
+
+    Returns:
+        list: (name, upper bound date or None for MAXVALUE) in order; empty if the
+              table is not partitioned or the database is not MySQL/MariaDB
+    """
+    if connection.dialect.name != 'mysql':
+        return []
+    rows = connection.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {'table': ACCESS_LOG_TABLE}).all()
+    partitions = []
+    for name, description in rows:
+        bound = None if description == 'MAXVALUE' else date.fromordinal(int(description) - _TO_DAYS_OFFSET)
+        partitions.append((name, bound))
+    return partitions
+
+def drop_expired_partitions(connection, cutoff_day):
+    """
+    Roll up and drop every partition that ends on or before cutoff_day
+
+    The rollup and a marker row commit together before the DROP, so a partition
+    whose drop failed is dropped on the next run without being counted twice.
+
+    Args:
+        connection: SQLAlchemy connection; work is committed as it goes
+        cutoff_day (date): Partitions holding only earlier days are dropped
+
+    Returns:
+        list: Names of the dropped partitions
+    """
+    dropped = []
+    for name, bound in get_partitions(connection):
+        if bound is None or bound > cutoff_day:
+            continue
+        done = connection.execute(
+            text(f"SELECT 1 FROM {PARTITION_ROLLUP_TABLE} WHERE partition_name = :name"), {'name': name}
+        ).first()
+        if not done:
+            connection.execute(text(
+                f"INSERT INTO violation_access_daily (violation_id, day, access_count) "
+                f"SELECT l.violation_id, DATE(l.accessed_at), COUNT(*) FROM {ACCESS_LOG_TABLE} PARTITION ({name}) l "
+                f"JOIN violations v ON v.id = l.violation_id "
+                f"GROUP BY l.violation_id, DATE(l.accessed_at) "
+                f"ON DUPLICATE KEY UPDATE access_count = access_count + VALUES(access_count)"
+            ))
+            connection.execute(
+                text(f"INSERT INTO {PARTITION_ROLLUP_TABLE} (partition_name, rolled_up_at) VALUES (:name, :now)"),
+                {'name': name, 'now': datetime.utcnow()}
+            )
+        connection.commit()
+        # DDL commits implicitly
+        connection.execute(text(f"ALTER TABLE {ACCESS_LOG_TABLE} DROP PARTITION {name}"))
+        connection.execute(
+            text(f"DELETE FROM {PARTITION_ROLLUP_TABLE} WHERE partition_name = :name"), {'name': name}
+        )
+        connection.commit()
+        dropped.append(name)
+    return dropped
+
+def ensure_future_partitions(connection, months_ahead, today=None):
+    """
+    Split the MAXVALUE partition so months up to months_ahead have their own partition
+
+    Args:
+        connection: SQLAlchemy connection; work is committed as it goes
+        months_ahead (int): Number of months after the current one to cover
+        today (date): Reference day (default: today, UTC)
+
+    Returns:
+        list: Names of the partitions added
+    """
+    partitions = get_partitions(connection)
+    if not partitions or partitions[-1][1] is not None:
+        return []
+    bounds = [bound for _, bound in partitions if bound is not None]
+    month = max(bounds) if bounds else _month_start(today or datetime.utcnow().date())
+    last = _add_months(_month_start(today or datetime.utcnow().date()), months_ahead + 1)
+
+    added = []
+    definitions = []
+    while month < last:
+        following = _add_months(month, 1)
+        added.append(partition_name(month))
+        definitions.append(f"PARTITION {partition_name(month)} VALUES LESS THAN (TO_DAYS('{following.isoformat()}'))")
+        month = following
+    if definitions:
+        maxvalue = partitions[-1][0]
+        connection.execute(text(
+            f"ALTER TABLE {ACCESS_LOG_TABLE} REORGANIZE PARTITION {maxvalue} INTO "
+            f"({', '.join(definitions)}, PARTITION {maxvalue} VALUES LESS THAN MAXVALUE)"
+        ))
+        connection.commit()
+    return added
+
+def partition_access_log(connection, months_ahead):
+    """
+    Rebuild the access log as monthly RANGE partitions
+
+    MariaDB requires the partitioning column in every unique key and does not allow
+    foreign keys on partitioned tables, so the primary key becomes (id, accessed_at)
+    and the violation_id foreign key is dropped. This copies every row, so it is run
+    by hand (`flask partition-access-logs`) rather than as a migration.
+
+    Args:
+        connection: SQLAlchemy connection to MySQL/MariaDB; DDL commits implicitly
+        months_ahead (int): Empty months to create after the current one
+
+    Returns:
+        int: Number of partitions created, or 0 if the table already is partitioned
+    """
+    if get_partitions(connection):
+        return 0
+
+    for fk in inspect(connection).get_foreign_keys(ACCESS_LOG_TABLE):
+        connection.execute(text(f"ALTER TABLE {ACCESS_LOG_TABLE} DROP FOREIGN KEY `{fk['name']}`"))
+    connection.execute(text(f"UPDATE {ACCESS_LOG_TABLE} SET accessed_at = UTC_TIMESTAMP() WHERE accessed_at IS NULL"))
+    connection.commit()
+    connection.execute(text(
+        f"ALTER TABLE {ACCESS_LOG_TABLE} "
+        f"MODIFY accessed_at DATETIME NOT NULL, "
+        f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, accessed_at)"
+    ))
+
+    oldest = connection.execute(text(f"SELECT MIN(accessed_at) FROM {ACCESS_LOG_TABLE}")).scalar()
+    month = _month_start((oldest or datetime.utcnow()).date())
+    last = _add_months(_month_start(datetime.utcnow().date()), months_ahead + 1)
+    definitions = []
+    while month < last:
+        following = _add_months(month, 1)
+        definitions.append(f"PARTITION {partition_name(month)} VALUES LESS THAN (TO_DAYS('{following.isoformat()}'))")
+        month = following
+    definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    connection.execute(text(
+        f"ALTER TABLE {ACCESS_LOG_TABLE} PARTITION BY RANGE (TO_DAYS(accessed_at)) ({', '.join(definitions)})"
+    ))
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {PARTITION_ROLLUP_TABLE} ("
+        f"partition_name VARCHAR(16) NOT NULL PRIMARY KEY, rolled_up_at DATETIME NOT NULL)"
+    ))
+    connection.commit()
+    return len(definitions)
+
+def unpartition_access_log(connection):
+    """
+    Undo partition_access_log(): plain table, single-column key, foreign key restored
+
+    Args:
+        connection: SQLAlchemy connection to MySQL/MariaDB; DDL commits implicitly
+
+    Returns:
+        bool: False if the table was not partitioned
+    """
+    if not get_partitions(connection):
+        return False
+    connection.execute(text(f"ALTER TABLE {ACCESS_LOG_TABLE} REMOVE PARTITIONING"))
+    connection.execute(text(
+        f"ALTER TABLE {ACCESS_LOG_TABLE} "
+        f"MODIFY accessed_at DATETIME NULL, "
+        f"DROP PRIMARY KEY, ADD PRIMARY KEY (id)"
+    ))
+    # Events of deleted violations may have been kept while the foreign key was gone
+    connection.execute(text(
+        f"DELETE l FROM {ACCESS_LOG_TABLE} l LEFT JOIN violations v ON v.id = l.violation_id WHERE v.id IS NULL"
+    ))
+    connection.commit()
+    connection.execute(text(
+        f"ALTER TABLE {ACCESS_LOG_TABLE} ADD FOREIGN KEY (violation_id) REFERENCES violations (id)"
+    ))
+    connection.execute(text(f"DROP TABLE IF EXISTS {PARTITION_ROLLUP_TABLE}"))
+    connection.commit()
+    return True
+
+# --- Maintenance task ---
+
+def apply_log_retention():
+    """Roll up and delete access events past retention and purge old status logs"""
+    from . import db
+
+    config = current_app.config
+    batch_size = config.get('LOG_RETENTION_BATCH_SIZE', 5000)
+    results = []
+
+    retention_days = config.get('ACCESS_LOG_RETENTION_DAYS', 90)
+    if retention_days:
+        cutoff_day = datetime.utcnow().date() - timedelta(days=retention_days)
+        with db.engine.connect() as connection:
+            if get_partitions(connection):
+                dropped = drop_expired_partitions(connection, cutoff_day)
+                added = ensure_future_partitions(connection, config.get('ACCESS_LOG_PARTITIONS_AHEAD', 3))
+                results.append(f"{len(dropped)} partitions dropped, {len(added)} added")
+        # Whatever is left before the cutoff (rows of a partly expired month, or an
+        # unpartitioned table) is rolled up row by row
+        cutoff = datetime.combine(cutoff_day, datetime.min.time())
+        results.append(f"{rollup_access_logs(cutoff, batch_size)} access events rolled up")
+
+    status_days = config.get('STATUS_LOG_RETENTION_DAYS', 0)
+    if status_days:
+        cutoff = datetime.utcnow() - timedelta(days=status_days)
+        results.append(f"{purge_status_logs(cutoff, batch_size)} status log entries deleted")
+
+    return ', '.join(results) or 'retention disabled'
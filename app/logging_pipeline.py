@@ -0,0 +1,241 @@
+"""
+Non-blocking Logging Pipeline
+
+Request threads only put log records on an in-process queue; a QueueListener
+thread formats them and does the disk and console I/O:
+
+- LOG_FILE gets one JSON object per line and is rotated at LOG_MAX_BYTES, keeping
+  LOG_BACKUP_COUNT old files. Processes cannot rotate a shared file safely, so when
+  several gunicorn workers write the same file (no {pid} in the name) it is opened
+  with a WatchedFileHandler instead and rotation is left to logrotate; put {pid} in
+  the name to keep built-in rotation with one file per process.
+- The console gets the familiar text format (LOG_FORMAT=json for JSON).
+
+Records below WARNING can be thinned per logger before they are queued:
+LOG_SAMPLE_RATES keeps a fraction of them ('app.auth_routes=0.1') and
+LOG_RATE_LIMITS caps them per second ('app.utils=20'); LOG_RATE_LIMIT_PER_SECOND
+applies to every other logger. The next record a logger is allowed to write
+carries the number dropped before it. When the queue is full, records are dropped
+rather than blocking the request.
+
+Expensive payloads should be passed as lazy arguments so they are only built when
+the level is enabled:
+
+    logger.debug("Received violation data: %s", lazy_json(data))
+    logger.debug("Response headers: %s", lazy(lambda: dict(response.headers)))
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import threading
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+# LogRecord attributes that are not extra fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_handler = None
+
+class lazy:
+    """Log argument computed only when the message is formatted"""
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        try:
+            return str(self.fn(*self.args, **self.kwargs))
+        except Exception as e:
+            return f"<unavailable: {e}>"
+
+def lazy_json(value):
+    """Log argument serialized to JSON only when the message is formatted"""
+    return lazy(json.dumps, value, default=str)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, including extra= fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, default=str)
+
+def _parse_rates(value):
+    """Parse 'app.auth_routes=0.1,app.utils=0.5' into [(logger prefix, number)], longest prefix first"""
+    rates = []
+    for item in (value or '').split(','):
+        name, _, rate = item.partition('=')
+        if name.strip() and rate.strip():
+            rates.append((name.strip(), float(rate)))
+    return sorted(rates, key=lambda pair: len(pair[0]), reverse=True)
+
+def _lookup(rates, name, default):
+    return next((rate for prefix, rate in rates if name == prefix or name.startswith(prefix + '.')), default)
+
+class ThinningFilter(logging.Filter):
+    """Sample and rate limit records below WARNING, per logger"""
+
+    def __init__(self, sample_rates, rate_limits, default_limit):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self.default_limit = default_limit
+        self.lock = threading.Lock()
+        self.buckets = {}  # logger name -> [tokens, last refill, dropped]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = _lookup(self.sample_rates, record.name, 1.0)
+        limit = _lookup(self.rate_limits, record.name, self.default_limit)
+        with self.lock:
+            bucket = self.buckets.get(record.name)
+            if bucket is None:
+                bucket = self.buckets[record.name] = [limit, time.monotonic(), 0]
+            if rate < 1.0 and random.random() >= rate:
+                bucket[2] += 1
+                return False
+            if limit:
+                now = time.monotonic()
+                bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    bucket[2] += 1
+                    return False
+                bucket[0] -= 1
+            if bucket[2]:
+                record.dropped = bucket[2]
+                bucket[2] = 0
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only the message is rendered here (lazy arguments run now, in the caller's
+        # context); JSON encoding and I/O happen on the listener thread
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        dropped, self.dropped = self.dropped, 0
+        if dropped:
+            record.queue_dropped = dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped = dropped + 1
+
+def _build_handlers(app):
+    handlers = []
+    log_file = app.config.get('LOG_FILE')
+    if log_file:
+        from .db_pool import worker_count
+        shared = '{pid}' not in log_file and worker_count() > 1
+        log_file = log_file.format(pid=os.getpid())
+        directory = os.path.dirname(os.path.abspath(log_file))
+        os.makedirs(directory, exist_ok=True)
+        if shared:
+            # Appends from several processes are safe; reopened after logrotate moves it
+            file_handler = logging.handlers.WatchedFileHandler(log_file, delay=True)
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+                backupCount=app.config.get('LOG_BACKUP_COUNT', 5),
+                delay=True,
+            )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    console = logging.StreamHandler()
+    if app.config.get('LOG_FORMAT') == 'json':
+        console.setFormatter(JsonFormatter())
+    else:
+        console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers.append(console)
+    return handlers
+
+def _start(app):
+    """Create the queue, handler and listener for this process"""
+    global _listener, _handler
+    log_queue = queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000))
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ThinningFilter(
+        _parse_rates(app.config.get('LOG_SAMPLE_RATES')),
+        _parse_rates(app.config.get('LOG_RATE_LIMITS')),
+        app.config.get('LOG_RATE_LIMIT_PER_SECOND', 0),
+    ))
+    listener = logging.handlers.QueueListener(log_queue, *_build_handlers(app), respect_handler_level=True)
+    listener.start()
+
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+    root.addHandler(handler)
+    _listener, _handler = listener, handler
+
+def _stop():
+    """Write out queued records (at exit)"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+def init_logging(app):
+    """
+    Route all logging through the queue pipeline
+
+    Runs once per process; forked gunicorn workers get their own queue and
+    listener thread, since threads do not survive fork.
+
+    Args:
+        app: Flask application
+    """
+    if _handler is not None:
+        return
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, str(app.config.get('LOG_LEVEL', 'INFO')).upper(), logging.INFO))
+    # Replace handlers installed by earlier configuration (e.g. basicConfig)
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+
+    _start(app)
+    atexit.register(_stop)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: _start(app))
@@ -0,0 +1,120 @@
+"""
+Periodic Maintenance
+
+A daemon thread in each worker wakes up every MAINTENANCE_TICK_SECONDS and runs the
+registered tasks that are due. Tasks are de-duplicated across all workers on the
+host: a task only runs while holding a flock() on its lock file, and the lock
+file's mtime records when it last ran, so each task runs once per interval no
+matter how many workers there are.
+
+The thread is started by the first request a worker handles, so scripts and CLI
+commands that call create_app() never start it. Every task can also be run from
+the command line (see cli.py) for cron-based setups.
+"""
+
+import os
+import time
+import fcntl
+import random
+import threading
+import logging
+from datetime import datetime, timedelta
+from flask import current_app
+from .log_retention import apply_log_retention
+from .token_revocation import purge_revoked_tokens
+from .idempotency import purge_idempotency_keys
+
+logger = logging.getLogger(__name__)
+
+# name -> (config key holding the interval in seconds, function)
+_tasks = {}
+
+_thread = None
+_thread_lock = threading.Lock()
+
+def register_task(name, interval_config_key, fn):
+    """
+    Register a maintenance task
+
+    Args:
+        name: Task name, also used for its lock file
+        interval_config_key: Config key with the interval in seconds (0 disables)
+        fn: Callable run inside an app context; returns a short result for the log
+    """
+    _tasks[name] = (interval_config_key, fn)
+
+def _lock_dir(app):
+    path = os.path.join(app.config['BASE_DIR'], 'saved_files', '.locks', 'maintenance')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _run_if_due(app, name, interval, fn):
+    path = os.path.join(_lock_dir(app), f'{name}.lock')
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # Another worker is running it
+        if time.time() - os.fstat(fd).st_mtime < interval:
+            return
+        os.utime(path)
+        with app.app_context():
+            started = time.monotonic()
+            try:
+                result = fn()
+                logger.info(f"Maintenance task {name} finished in {time.monotonic() - started:.2f}s: {result}")
+            except Exception as e:
+                logger.error(f"Maintenance task {name} failed: {str(e)}")
+    finally:
+        os.close(fd)
+
+def _loop(app):
+    tick = app.config.get('MAINTENANCE_TICK_SECONDS', 60)
+    # Spread workers out so they do not all wake at once
+    time.sleep(random.uniform(0, tick))
+    while True:
+        for name, (interval_key, fn) in list(_tasks.items()):
+            interval = app.config.get(interval_key, 0)
+            if interval:
+                _run_if_due(app, name, interval, fn)
+        time.sleep(tick)
+
+def start_maintenance(app):
+    """Start this worker's maintenance thread if it is not running yet"""
+    global _thread
+    if not app.config.get('MAINTENANCE_ENABLED', True):
+        return
+    with _thread_lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_loop, args=(app,), name='maintenance', daemon=True)
+        _thread.start()
+
+def init_maintenance(app):
+    """Start the maintenance thread lazily, on the first request of each worker"""
+    @app.before_request
+    def _ensure_maintenance_thread():
+        if _thread is None or not _thread.is_alive():
+            start_maintenance(app)
+
+# --- Tasks ---
+
+def purge_stale_sessions():
+    """Delete user sessions that expired or were terminated more than SESSION_PURGE_AFTER_HOURS ago"""
+    from .models import UserSession
+
+    cutoff = datetime.utcnow() - timedelta(hours=current_app.config.get('SESSION_PURGE_AFTER_HOURS', 24))
+    deleted = UserSession.purge_stale(cutoff, batch_size=current_app.config.get('SESSION_PURGE_BATCH_SIZE', 1000))
+    return f"{deleted} stale sessions deleted"
+
+def purge_upload_sessions():
+    """Delete expired and old finished upload sessions (see upload_routes.py)"""
+    from .upload_routes import purge_expired_upload_sessions
+    return f"{purge_expired_upload_sessions()} upload sessions deleted"
+
+register_task('purge-sessions', 'SESSION_PURGE_INTERVAL_SECONDS', purge_stale_sessions)
+register_task('log-retention', 'LOG_RETENTION_INTERVAL_SECONDS', apply_log_retention)
+register_task('purge-revoked-tokens', 'REVOKED_TOKEN_PURGE_INTERVAL_SECONDS', purge_revoked_tokens)
+register_task('purge-upload-sessions', 'UPLOAD_SESSION_PURGE_INTERVAL_SECONDS', purge_upload_sessions)
+register_task('purge-idempotency-keys', 'IDEMPOTENCY_PURGE_INTERVAL_SECONDS', purge_idempotency_keys)
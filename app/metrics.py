@@ -0,0 +1,248 @@
+"""
+Metrics Registry
+
+Counters and histograms for the operations that dominate latency, rendered in the
+Prometheus text format by the admin-only /metrics endpoint.
+
+Each gunicorn worker keeps its values in memory and writes them to
+METRICS_DIR/<pid>-<start>.json at most every METRICS_FLUSH_SECONDS (and when it
+serves /metrics or exits). A scrape sums the files of all workers, including
+workers that have since been recycled, so counters do not drop when one restarts.
+gunicorn.conf.py empties the directory when the server starts.
+
+Recording is a dict update under a lock; nothing is written per observation.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+import logging
+from contextlib import contextmanager
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers sub-millisecond pool checkouts up to slow PDF renders and SMTP sends
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_registry = {}
+_directory = None
+_flush_interval = 10
+_last_flush = 0.0
+_dirty = False
+_file_name = None
+_file_pid = None
+
+def _process_file():
+    """File name for this process (workers forked from a preloaded master get their own)"""
+    global _file_name, _file_pid
+    if _file_pid != os.getpid():
+        _file_pid = os.getpid()
+        _file_name = f"{_file_pid}-{int(time.time())}.json"
+    return os.path.join(_directory, _file_name)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _registry[name] = self
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        global _dirty
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            _dirty = True
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """Record one value (for timings, in seconds)"""
+        global _dirty
+        key = self._key(labels)
+        with _lock:
+            # Per-bucket counts (last one is +Inf), then sum
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            entry[index] += 1
+            entry[-1] += value
+            _dirty = True
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+# --- Metrics ---
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests served', ('blueprint', 'endpoint', 'method', 'status'))
+HTTP_DURATION = Histogram('http_request_duration_seconds', 'HTTP request handling time', ('blueprint', 'endpoint'))
+PDF_RENDER = Histogram('pdf_render_seconds', 'WeasyPrint HTML to PDF render time')
+SMTP_SEND = Histogram('smtp_send_seconds', 'Time to hand a message to the SMTP server', ('outcome',))
+CLAMAV_SCAN = Histogram('clamav_scan_seconds', 'ClamAV scan time (stream: wait for the verdict after the last chunk)', ('mode', 'outcome'))
+PASSWORD_VERIFY = Histogram('password_verify_seconds', 'Password hash verification time, excluding the wait for a hashing slot', ('algorithm',))
+PASSWORD_SLOT_WAIT = Histogram('password_hashing_slot_wait_seconds', 'Time a password hash/verify waited for a run slot')
+DB_POOL_WAIT = Histogram('db_pool_checkout_wait_seconds', 'Time to check a connection out of the pool')
+DB_POOL_TIMEOUTS = Counter('db_pool_checkout_timeouts_total', 'Pool checkouts that gave up after DB_POOL_TIMEOUT')
+
+# --- Multiprocess storage ---
+
+def _snapshot():
+    with _lock:
+        return {
+            name: {
+                'values': [[list(key), list(value) if isinstance(value, list) else value]
+                           for key, value in metric.values.items()],
+            }
+            for name, metric in _registry.items() if metric.values
+        }
+
+def flush(force=False):
+    """Write this process's values to the metrics directory"""
+    global _last_flush, _dirty
+    if _directory is None:
+        return
+    now = time.monotonic()
+    if not force and (not _dirty or now - _last_flush < _flush_interval):
+        return
+    _dirty = False
+    _last_flush = now
+    path = _process_file()
+    try:
+        os.makedirs(_directory, exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(_snapshot(), f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {path}: {str(e)}")
+
+def _merge(totals, snapshot):
+    for name, data in snapshot.items():
+        metric = _registry.get(name)
+        if metric is None:
+            continue
+        merged = totals.setdefault(name, {})
+        for key, value in data['values']:
+            key = tuple(key)
+            if metric.kind == 'histogram':
+                if len(value) != len(metric.buckets) + 2:
+                    continue  # Written with other buckets by an older release
+                current = merged.get(key)
+                merged[key] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+
+def collect():
+    """
+    Sum the values of all worker processes
+
+    Returns:
+        dict: Metric name -> {label values tuple: value}
+    """
+    flush(force=True)
+    totals = {}
+    if _directory is None:
+        _merge(totals, _snapshot())
+        return totals
+    try:
+        names = [name for name in os.listdir(_directory) if name.endswith('.json')]
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        try:
+            with open(os.path.join(_directory, name)) as f:
+                _merge(totals, json.load(f))
+        except (OSError, ValueError):
+            continue
+    return totals
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def render():
+    """
+    Render all metrics in the Prometheus text exposition format
+
+    Returns:
+        str: Exposition text (version 0.0.4)
+    """
+    totals = collect()
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in sorted(totals.get(name, {}).items()):
+            if metric.kind == 'counter':
+                lines.append(f"{name}{_labels(metric.labelnames, key)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(metric.labelnames, key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric.labelnames, key)} {value[-1]}")
+            lines.append(f"{name}_count{_labels(metric.labelnames, key)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+def init_metrics(app):
+    """
+    Configure the metrics directory and record every request
+
+    Args:
+        app: Flask application
+    """
+    global _directory, _flush_interval
+    _directory = app.config.get('METRICS_DIR')
+    _flush_interval = app.config.get('METRICS_FLUSH_SECONDS', 10)
+    atexit.register(flush, True)
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        blueprint = request.blueprint or 'app'
+        endpoint = request.endpoint or 'unmatched'
+        HTTP_DURATION.observe(time.perf_counter() - started, blueprint=blueprint, endpoint=endpoint)
+        HTTP_REQUESTS.inc(blueprint=blueprint, endpoint=endpoint, method=request.method, status=response.status_code)
+        flush()
+        return response
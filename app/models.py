@@ -5,17 +5,14 @@ import secrets
 from werkzeug.security import generate_password_hash, check_password_hash
 import argon2
 import uuid
+from .password_hashing import run_bounded, PasswordHashingBusyError, DEFAULT_ARGON2_PARAMS
+from .metrics import PASSWORD_VERIFY
 from sqlalchemy.dialects.mysql import JSON # If using MySQL for JSON storage
 from sqlalchemy.ext.mutable import MutableDict # For JSON mutation tracking
 
-# Create Argon2 password hasher
-ph = argon2.PasswordHasher(
-    time_cost=3,       # Number of iterations
-    memory_cost=65536, # Memory usage in kibibytes (64MB)
-    parallelism=4,     # Number of parallel threads
-    hash_len=32,       # Length of the hash in bytes
-    salt_len=16        # Length of the random salt in bytes
-)
+# Create Argon2 password hasher; replaced at startup with the calibrated parameters
+# from ARGON2_PARAMS_FILE (see password_hashing.configure_password_hasher)
+ph = argon2.PasswordHasher(**DEFAULT_ARGON2_PARAMS)
 
 class UserError(Exception):
     """Base exception for user-related errors"""
@@ -122,7 +119,7 @@ class User(UserMixin, db.Model):
         """
         temp_pass = self.generate_temp_password()
         if self.password_algorithm == 'argon2':
-            self.temp_password = ph.hash(temp_pass)
+            self.temp_password = run_bounded(ph.hash, temp_pass)
         else:
             self.temp_password = generate_password_hash(temp_pass)
         self.temp_password_expiry = datetime.utcnow() + timedelta(hours=expiry_hours)
@@ -149,9 +146,11 @@ class User(UserMixin, db.Model):
             
         try:
             if self.password_algorithm == 'argon2' and self.temp_password.startswith('$argon2'):
-                return ph.verify(self.temp_password, password)
+                return run_bounded(ph.verify, self.temp_password, password)
             else:
                 return check_password_hash(self.temp_password, password)
+        except PasswordHashingBusyError:
+            raise
         except Exception:
             return False
 
@@ -175,7 +174,7 @@ class User(UserMixin, db.Model):
             password (str): Plain text password to hash and store
         """
         if self.password_algorithm == 'argon2':
-            self.password_hash = ph.hash(password)
+            self.password_hash = run_bounded(ph.hash, password)
         else:
             self.password_hash = generate_password_hash(password)
         db.session.commit()
@@ -186,7 +185,7 @@ class User(UserMixin, db.Model):
         Args:
             password (str): Plain text password to rehash
         """
-        self.password_hash = ph.hash(password)
+        self.password_hash = run_bounded(ph.hash, password)
         self.password_algorithm = 'argon2'
         db.session.commit()
 
@@ -206,18 +205,24 @@ class User(UserMixin, db.Model):
         try:
             # If using Argon2id
             if self.password_algorithm == 'argon2' and self.password_hash.startswith('$argon2'):
-                is_valid = ph.verify(self.password_hash, password)
+                # Timed inside run_bounded, so the wait for a hashing slot is not included
+                is_valid = run_bounded(ph.verify, self.password_hash, password,
+                                       histogram=PASSWORD_VERIFY, labels={'algorithm': 'argon2'})
                 
                 # Check if hash needs rehashing (parameters changed, etc)
                 if ph.check_needs_rehash(self.password_hash):
-                    self.password_hash = ph.hash(password)
+                    self.password_hash = run_bounded(ph.hash, password)
                     db.session.commit()
                 
                 return is_valid
             else:
                 # Using Werkzeug's check_password_hash for older hashes
-                return check_password_hash(self.password_hash, password)
+                with PASSWORD_VERIFY.time(algorithm='werkzeug'):
+                    return check_password_hash(self.password_hash, password)
                 
+        except PasswordHashingBusyError:
+            # Not a failed attempt; the route answers 503
+            raise
         except argon2.exceptions.VerifyMismatchError:
             self.record_failed_login()
             return False
@@ -306,16 +311,11 @@ class User(UserMixin, db.Model):
         Returns:
             int: Number of sessions terminated
         """
-        sessions = UserSession.query.filter(
+        count = UserSession.query.filter(
             UserSession.user_id == self.id,
             UserSession.id != current_session_id,
             UserSession.is_active == True
-        ).all()
-        
-        count = 0
-        for session in sessions:
-            session.terminate()
-            count += 1
+        ).update({UserSession.is_active: False})
         
         db.session.commit()
         return count
@@ -326,38 +326,30 @@ class User(UserMixin, db.Model):
         Returns:
             int: Number of sessions terminated
         """
-        sessions = UserSession.query.filter_by(
-            user_id=self.id,
-            is_active=True
-        ).all()
-        
-        count = 0
-        for session in sessions:
-            session.terminate()
-            count += 1
+        count = UserSession.query.filter(
+            UserSession.user_id == self.id,
+            UserSession.is_active == True
+        ).update({UserSession.is_active: False})
         
         db.session.commit()
         return count
         
     def cleanup_expired_sessions(self):
         """Clean up expired sessions for this user"""
-        now = datetime.utcnow()
-        
-        # Find expired sessions
-        expired_sessions = UserSession.query.filter(
+        UserSession.query.filter(
             UserSession.user_id == self.id,
             UserSession.is_active == True,
-            UserSession.expires_at < now
-        ).all()
-        
-        # Mark them as inactive
-        for session in expired_sessions:
-            session.terminate()
+            UserSession.expires_at < datetime.utcnow()
+        ).update({UserSession.is_active: False})
             
         db.session.commit()
 
 class Violation(db.Model):
     __tablename__ = 'violations'
+    # Same name as mariadb_schema.sql and the add_violation_public_id_index migration
+    __table_args__ = (
+        db.Index('idx_violation_public_id', 'public_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     public_id = db.Column(db.String(36), default=lambda: str(uuid.uuid4()), nullable=True)
@@ -571,7 +563,7 @@ class UserSession(db.Model):
     token = db.Column(db.String(64), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_activity = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
     is_active = db.Column(db.Boolean, default=True)
     user_agent = db.Column(db.String(255))
     ip_address = db.Column(db.String(45))  # IPv6 can be up to 45 chars
@@ -585,9 +577,17 @@ class UserSession(db.Model):
             self.expires_at = datetime.utcnow() + timedelta(hours=24)
     
     def update_activity(self):
-        """Update the last activity timestamp and extend session if needed"""
+        """Update the last activity timestamp and extend session if needed
+        
+        Plain activity bumps are coalesced: nothing is written unless last_activity
+        moved by at least SESSION_ACTIVITY_GRANULARITY_SECONDS, and then the write is
+        queued and flushed in a batch (see session_activity). Extending the expiry is
+        written immediately because other requests check it.
+        """
+        from flask import current_app
+        from .session_activity import queue_activity
+        
         now = datetime.utcnow()
-        self.last_activity = now
         
         # If less than 30 minutes remain, extend by another 30 minutes
         # This implements the sliding window for idle timeout
@@ -596,8 +596,14 @@ class UserSession(db.Model):
             max_expiry = self.created_at + timedelta(hours=24)
             new_expiry = now + timedelta(minutes=30)
             self.expires_at = min(new_expiry, max_expiry)
-            
-        db.session.commit()
+            self.last_activity = now
+            db.session.commit()
+            return
+        
+        granularity = timedelta(seconds=current_app.config.get('SESSION_ACTIVITY_GRANULARITY_SECONDS', 60))
+        if self.last_activity and now - self.last_activity < granularity:
+            return
+        queue_activity(self.id, now)
     
     def is_expired(self):
         """Check if the session has expired
@@ -620,6 +626,38 @@ class UserSession(db.Model):
         """Terminate this session"""
         self.is_active = False
         db.session.commit()
+    
+    @classmethod
+    def purge_stale(cls, older_than, batch_size=1000):
+        """Delete sessions that ended before a cutoff, in batches
+        
+        A session has ended once it expired or was terminated; rows are only
+        deleted when that happened before older_than. Each batch is committed
+        separately so the table is never locked for long.
+        
+        Args:
+            older_than (datetime): Only purge sessions that ended before this time
+            batch_size (int): Rows deleted per statement
+            
+        Returns:
+            int: Number of rows deleted
+        """
+        stale = db.or_(
+            cls.expires_at < older_than,
+            db.and_(cls.is_active == False, cls.last_activity < older_than)
+        )
+        
+        total = 0
+        while True:
+            ids = [row.id for row in db.session.query(cls.id).filter(stale).limit(batch_size).all()]
+            if not ids:
+                break
+            cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            total += len(ids)
+            if len(ids) < batch_size:
+                break
+        return total
         
     def __repr__(self):
         return f'<UserSession id={self.id} user_id={self.user_id} active={self.is_active}>'
@@ -631,12 +669,23 @@ class ViolationAccess(db.Model):
     violation_id = db.Column(db.Integer, db.ForeignKey('violations.id'), nullable=False)
     ip_address = db.Column(db.String(50))
     user_agent = db.Column(db.String(255))
-    accessed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    accessed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     token = db.Column(db.String(255))
     
     # Relationship
     violation = db.relationship('Violation', backref=db.backref('access_logs', lazy='dynamic'))
 
+class ViolationAccessDaily(db.Model):
+    """Daily secure-link view counts, rolled up from violation_access_logs past retention"""
+    __tablename__ = 'violation_access_daily'
+
+    violation_id = db.Column(db.Integer, db.ForeignKey('violations.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    access_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ViolationAccessDaily violation={self.violation_id} day={self.day} count={self.access_count}>'
+
 class ViolationStatusLog(db.Model):
     __tablename__ = 'violation_status_log'
     id = db.Column(db.Integer, primary_key=True)
@@ -644,7 +693,120 @@ class ViolationStatusLog(db.Model):
     old_status = db.Column(db.String(64), nullable=False)
     new_status = db.Column(db.String(64), nullable=False)
     changed_by = db.Column(db.String(128), nullable=False)
-    timestamp = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
+    timestamp = db.Column(db.DateTime, server_default=db.func.now(), nullable=False, index=True)
+
+class EvidenceBlob(db.Model):
+    """Content-addressed evidence file, shared by every violation that references it"""
+    __tablename__ = 'evidence_blobs'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(255))
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<EvidenceBlob {self.sha256[:12]} refs={self.ref_count}>'
+
+class EvidenceReference(db.Model):
+    """Per-violation reference (a hard link under saved_files/uploads) to an evidence blob"""
+    __tablename__ = 'evidence_references'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('evidence_blobs.sha256'), nullable=False, index=True)
+    violation_id = db.Column(db.Integer, db.ForeignKey('violations.id'), nullable=False, index=True)
+    path = db.Column(db.String(512), nullable=False, unique=True)  # Relative to BASE_DIR
+    original_filename = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    blob = db.relationship('EvidenceBlob')
+    
+    def __repr__(self):
+        return f'<EvidenceReference violation_id={self.violation_id} blob={self.blob_sha256[:12]}>'
+
+class UploadSession(db.Model):
+    """Resumable chunked upload of a single evidence file"""
+    __tablename__ = 'upload_sessions'
+    
+    STATUS_OPEN = 'open'
+    STATUS_COMPLETING = 'completing'  # Claimed by one /complete request
+    STATUS_COMPLETED = 'completed'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    violation_id = db.Column(db.Integer, db.ForeignKey('violations.id', ondelete='CASCADE'), nullable=False, index=True)
+    field_name = db.Column(db.String(64), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64))  # Optional client-supplied digest
+    status = db.Column(db.String(20), default=STATUS_OPEN, nullable=False)
+    result_path = db.Column(db.String(512))
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    @property
+    def chunk_count(self):
+        """Number of chunks the file is split into"""
+        return max(1, -(-self.total_size // self.chunk_size))
+    
+    def chunk_length(self, index):
+        """Expected size in bytes of the chunk at index"""
+        if index < self.chunk_count - 1:
+            return self.chunk_size
+        return self.total_size - self.chunk_size * (self.chunk_count - 1)
+    
+    def is_expired(self):
+        """Check if the upload session has expired
+        
+        Returns:
+            bool: True if expired
+        """
+        return datetime.utcnow() > self.expires_at
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id} violation_id={self.violation_id} status={self.status}>'
+
+class RevokedToken(db.Model):
+    """Revoked JWT, or a cutoff revoking every JWT a user was issued before revoked_at
+
+    Rows are append-only and read by id as a high-water mark (see token_revocation.py);
+    they are deleted once expires_at passes, when no token they cover is still valid.
+    """
+    __tablename__ = 'revoked_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), unique=True)  # None for a user-wide cutoff
+    user_id = db.Column(db.Integer, index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<RevokedToken {self.jti or "user-wide"} user_id={self.user_id}>'
+
+class IdempotencyKey(db.Model):
+    """Idempotency-Key of a write request and the response it produced (see idempotency.py)"""
+    __tablename__ = 'idempotency_keys'
+
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    key_hash = db.Column(db.String(64), unique=True, nullable=False)  # SHA-256 of user, method, path and key
+    user_id = db.Column(db.Integer, index=True)
+    method = db.Column(db.String(10), nullable=False)
+    path = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)  # Fingerprint of the payload
+    status = db.Column(db.String(20), default=STATUS_PROCESSING, nullable=False)
+    response_status = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    response_content_type = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_until = db.Column(db.DateTime, nullable=False)  # A processing row older than this was abandoned
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.method} {self.path} status={self.status}>'
 
 class UnitProfile(db.Model):
     __tablename__ = 'unit_profiles'
@@ -0,0 +1,308 @@
+"""
+Bounded Password Hashing
+
+An Argon2 hash or verify needs tens of MB of memory (64 MB with the default
+parameters) and several CPU threads. To keep a burst of logins from exhausting the server, every
+hash/verify runs through run_bounded(), which limits how many run at once across
+all gunicorn workers on the host.
+
+Limits are enforced with flock()ed slot files, so they are shared between worker
+processes and released automatically if a worker dies:
+
+- HASHING_MAX_CONCURRENT run slots: a caller holding one may hash.
+- HASHING_MAX_QUEUE queue slots: a caller holding one waits for a run slot.
+
+If no queue slot is free, or the wait exceeds HASHING_QUEUE_TIMEOUT seconds, the
+call fails fast with PasswordHashingBusyError and the route answers 503 with a
+Retry-After header.
+
+The Argon2 cost parameters come from ARGON2_PARAMS_FILE, written by
+`flask calibrate-hash` (see calibrate_argon2). When they change, existing hashes
+are upgraded on the user's next login through ph.check_needs_rehash().
+"""
+
+import os
+import json
+import time
+import fcntl
+import statistics
+import threading
+import logging
+import argon2
+from flask import current_app, has_app_context, jsonify
+from .concurrency import run_cpu_bound
+from .metrics import PASSWORD_SLOT_WAIT
+
+logger = logging.getLogger(__name__)
+
+# How often a queued caller retries for a run slot (seconds)
+POLL_INTERVAL = 0.01
+
+class PasswordHashingBusyError(Exception):
+    """Raised when too many password hashes are running or queued"""
+    def __init__(self, retry_after):
+        super().__init__(f"Password hashing is busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+# Per-process metrics
+_stats_lock = threading.Lock()
+_stats = {
+    'calls': 0,
+    'rejected': 0,
+    'queued': 0,
+    'hash_seconds_total': 0.0,
+    'hash_seconds_max': 0.0,
+    'wait_seconds_total': 0.0,
+    'wait_seconds_max': 0.0,
+    'queue_depth': 0,
+    'queue_depth_max': 0,
+}
+
+def _slot_dir():
+    path = current_app.config.get('HASHING_SLOT_DIR') or \
+        os.path.join(current_app.config['BASE_DIR'], 'saved_files', '.locks', 'hashing')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _acquire_slot(directory, kind, count):
+    """
+    Try to lock one of count slot files without blocking
+
+    Returns:
+        tuple: (fd or None, number of slots found busy)
+    """
+    busy = 0
+    for index in range(count):
+        fd = os.open(os.path.join(directory, f'{kind}-{index}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd, busy
+        except BlockingIOError:
+            os.close(fd)
+            busy += 1
+    return None, busy
+
+def _release_slot(fd):
+    if fd is not None:
+        # Closing the descriptor drops the flock
+        os.close(fd)
+
+def _record(**values):
+    with _stats_lock:
+        if values.get('rejected'):
+            _stats['rejected'] += 1
+            return
+        if 'queue_depth' in values:
+            _stats['queued'] += 1
+            _stats['queue_depth'] = values['queue_depth']
+            _stats['queue_depth_max'] = max(_stats['queue_depth_max'], values['queue_depth'])
+            return
+        _stats['calls'] += 1
+        _stats['hash_seconds_total'] += values['hash_seconds']
+        _stats['hash_seconds_max'] = max(_stats['hash_seconds_max'], values['hash_seconds'])
+        _stats['wait_seconds_total'] += values['wait_seconds']
+        _stats['wait_seconds_max'] = max(_stats['wait_seconds_max'], values['wait_seconds'])
+
+def _reject(retry_after, reason):
+    _record(rejected=True)
+    logger.warning(f"Password hashing rejected ({reason}); asking client to retry after {retry_after}s")
+    raise PasswordHashingBusyError(retry_after)
+
+def run_bounded(fn, *args, histogram=None, labels=None):
+    """
+    Run a password hash/verify function under the host-wide concurrency limit
+
+    The wait for a run slot is recorded in PASSWORD_SLOT_WAIT; histogram, if given,
+    only gets the time spent in fn.
+
+    Args:
+        fn: Callable such as ph.verify or ph.hash
+        *args: Arguments for fn
+        histogram: Optional metrics Histogram for the duration of fn
+        labels: Labels for histogram
+
+    Returns:
+        The return value of fn
+
+    Raises:
+        PasswordHashingBusyError: If the queue is full or the wait timed out
+    """
+    if not has_app_context():
+        if histogram is None:
+            return fn(*args)
+        with histogram.time(**(labels or {})):
+            return fn(*args)
+
+    config = current_app.config
+    max_concurrent = config.get('HASHING_MAX_CONCURRENT', 2)
+    max_queue = config.get('HASHING_MAX_QUEUE', 8)
+    queue_timeout = config.get('HASHING_QUEUE_TIMEOUT', 5)
+    retry_after = config.get('HASHING_RETRY_AFTER', 2)
+
+    directory = _slot_dir()
+    started = time.monotonic()
+    run_fd, _ = _acquire_slot(directory, 'run', max_concurrent)
+    queue_fd = None
+
+    try:
+        if run_fd is None:
+            queue_fd, depth = _acquire_slot(directory, 'queue', max_queue)
+            if queue_fd is None:
+                _reject(retry_after, 'queue full')
+            _record(queue_depth=depth + 1)
+
+            deadline = started + queue_timeout
+            while run_fd is None:
+                if time.monotonic() > deadline:
+                    _reject(retry_after, 'queue wait timed out')
+                time.sleep(POLL_INTERVAL)
+                run_fd, _ = _acquire_slot(directory, 'run', max_concurrent)
+
+            _release_slot(queue_fd)
+            queue_fd = None
+
+        hash_started = time.monotonic()
+        PASSWORD_SLOT_WAIT.observe(hash_started - started)
+        try:
+            # On a real thread under gevent, so other requests keep running
+            return run_cpu_bound(fn, *args)
+        finally:
+            finished = time.monotonic()
+            _record(hash_seconds=finished - hash_started, wait_seconds=hash_started - started)
+            if histogram is not None:
+                histogram.observe(finished - hash_started, **(labels or {}))
+    finally:
+        _release_slot(queue_fd)
+        _release_slot(run_fd)
+
+def get_hashing_stats():
+    """
+    Get password hashing metrics for this worker process
+
+    Returns:
+        dict: Call counts, hash latency, queue wait and queue depth
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    calls = stats['calls']
+    stats['hash_seconds_avg'] = stats['hash_seconds_total'] / calls if calls else 0.0
+    stats['wait_seconds_avg'] = stats['wait_seconds_total'] / calls if calls else 0.0
+    stats['pid'] = os.getpid()
+    return stats
+
+def busy_response(error):
+    """Build the 503 response for a PasswordHashingBusyError"""
+    response = jsonify({'error': 'The server is busy processing logins. Please try again shortly.'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+# --- Argon2 parameters ---
+
+# Used when no calibration has been stored (matches the historical hard-coded values)
+DEFAULT_ARGON2_PARAMS = {
+    'time_cost': 3,
+    'memory_cost': 65536,  # KiB
+    'parallelism': 4,
+    'hash_len': 32,
+    'salt_len': 16,
+}
+
+# OWASP minimum for Argon2id
+MIN_MEMORY_COST = 19 * 1024  # KiB
+
+def load_argon2_params(path):
+    """
+    Load stored Argon2 parameters, falling back to the defaults
+
+    Args:
+        path: Path of the JSON parameters file
+
+    Returns:
+        dict: Keyword arguments for argon2.PasswordHasher
+    """
+    params = dict(DEFAULT_ARGON2_PARAMS)
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                stored = json.load(f)
+            params.update({key: int(stored[key]) for key in DEFAULT_ARGON2_PARAMS if key in stored})
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"Could not read Argon2 parameters from {path}: {str(e)}. Using defaults.")
+    return params
+
+def configure_password_hasher(app):
+    """Install the stored Argon2 parameters as the User model's password hasher"""
+    from . import models
+
+    params = load_argon2_params(app.config.get('ARGON2_PARAMS_FILE'))
+    app.config['ARGON2_PARAMS'] = params
+    models.ph = argon2.PasswordHasher(**params)
+    return params
+
+def _measure_verify(params, samples=3):
+    """Median seconds for one verify with the given parameters"""
+    hasher = argon2.PasswordHasher(**params)
+    encoded = hasher.hash('calibration-password')
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.verify(encoded, 'calibration-password')
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def calibrate_argon2(target_ms, memory_budget_mb, concurrency, cpu_count=None, max_time_cost=10):
+    """
+    Pick Argon2 parameters for this host
+
+    Memory per hash is the largest power of two that lets `concurrency` hashes fit
+    in the memory budget together. Parallelism shares the CPUs between concurrent
+    hashes. time_cost is then raised as far as it can go without the measured verify
+    latency exceeding the target; if even one pass is too slow, memory is halved.
+
+    Args:
+        target_ms: Target verify latency in milliseconds
+        memory_budget_mb: Memory available to password hashing on the whole host
+        concurrency: Maximum hashes running at the same time
+        cpu_count: CPUs available (defaults to os.cpu_count())
+        max_time_cost: Upper bound for time_cost
+
+    Returns:
+        dict: Chosen parameters plus 'measured_ms' and the calibration inputs
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    concurrency = max(1, concurrency)
+    target = target_ms / 1000.0
+
+    per_hash_kib = max(MIN_MEMORY_COST, (memory_budget_mb * 1024) // concurrency)
+    memory_cost = 1 << (per_hash_kib.bit_length() - 1)
+    memory_cost = max(memory_cost, MIN_MEMORY_COST)
+    parallelism = max(1, min(4, cpu_count // concurrency))
+
+    params = dict(DEFAULT_ARGON2_PARAMS, memory_cost=memory_cost, parallelism=parallelism, time_cost=1)
+    measured = _measure_verify(params)
+    while measured > target and params['memory_cost'] // 2 >= MIN_MEMORY_COST:
+        params['memory_cost'] //= 2
+        measured = _measure_verify(params)
+
+    while params['time_cost'] < max_time_cost:
+        candidate = dict(params, time_cost=params['time_cost'] + 1)
+        candidate_measured = _measure_verify(candidate)
+        if candidate_measured > target:
+            break
+        params, measured = candidate, candidate_measured
+
+    params['measured_ms'] = round(measured * 1000, 1)
+    params['target_ms'] = target_ms
+    params['memory_budget_mb'] = memory_budget_mb
+    params['concurrency'] = concurrency
+    params['cpu_count'] = cpu_count
+    return params
+
+def save_argon2_params(path, params):
+    """Write calibrated parameters atomically so workers never read a partial file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(params, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
@@ -0,0 +1,191 @@
+"""
+Per-Request Query Statistics
+
+SQLAlchemy cursor events count the statements each request executes, their total
+time and how often the same statement shape repeats. A statement fingerprint is
+the SQL with literals and IN lists collapsed, so the queries of an N+1 loop
+(one SELECT per row, differing only in the id) share a fingerprint.
+
+After each request:
+
+- QUERY_SERVER_TIMING (on in DevelopmentConfig) adds a Server-Timing header, shown in the
+  browser's network panel: db;dur=<ms>;desc="<n> queries"
+- A warning is logged when the request runs more than QUERY_COUNT_WARN_THRESHOLD
+  statements, spends more than QUERY_TIME_WARN_MS in the database, or repeats a
+  fingerprint more than QUERY_DUPLICATE_WARN_THRESHOLD times.
+
+assert_max_queries() gives tests the same counts:
+
+    with assert_max_queries(10):
+        client.get('/api/violations')
+"""
+
+import re
+import time
+import threading
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_DRIVER_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# Collectors receiving statements on this thread (or greenlet under gevent)
+_local = threading.local()
+_listening = False
+
+class QueryStats:
+    """Statements executed while the collector is active"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.statements = []
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.fingerprints[fingerprint(statement)] += 1
+        self.statements.append(statement)
+
+    def duplicates(self, threshold=1):
+        """Fingerprints executed more than threshold times, most repeated first"""
+        return [(fp, n) for fp, n in self.fingerprints.most_common() if n > threshold]
+
+def fingerprint(statement):
+    """
+    Reduce a SQL statement to its shape
+
+    Args:
+        statement (str): SQL as sent to the driver
+
+    Returns:
+        str: Statement with literals replaced by ? and IN lists collapsed
+    """
+    statement = _STRING_LITERAL.sub('?', statement)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    statement = _DRIVER_PLACEHOLDER.sub('?', statement)
+    statement = _PLACEHOLDER_LIST.sub('(?+)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+def _collectors():
+    stack = getattr(_local, 'collectors', None)
+    if stack is None:
+        stack = _local.collectors = []
+    return stack
+
+@contextmanager
+def collect_queries():
+    """
+    Record the statements executed on this thread inside the block
+
+    Yields:
+        QueryStats: Filled in as statements run
+    """
+    stats = QueryStats()
+    stack = _collectors()
+    stack.append(stats)
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+
+@contextmanager
+def assert_max_queries(max_count):
+    """
+    Fail if the block executes more than max_count statements
+
+    Args:
+        max_count (int): Highest acceptable number of statements
+
+    Raises:
+        AssertionError: Listing the statements and repeated fingerprints
+    """
+    with collect_queries() as stats:
+        yield stats
+    if stats.count > max_count:
+        repeated = ''.join(f"\n  {n}x {fp}" for fp, n in stats.duplicates())
+        statements = ''.join(f"\n  {s}" for s in stats.statements)
+        raise AssertionError(
+            f"Expected at most {max_count} queries, {stats.count} were executed"
+            f"{' - repeated:' + repeated if repeated else ''}\nStatements:{statements}"
+        )
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _collectors():
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    duration = time.perf_counter() - started.pop()
+    for stats in _collectors():
+        stats.record(statement, duration)
+
+def _listen():
+    global _listening
+    if not _listening:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listening = True
+
+def init_query_stats(app):
+    """
+    Collect query statistics for every request
+
+    Args:
+        app: Flask application
+    """
+    _listen()
+    if not app.config.get('QUERY_STATS_ENABLED', True):
+        return
+
+    @app.before_request
+    def _start_query_stats():
+        stats = QueryStats()
+        _collectors().append(stats)
+        g.query_stats = stats
+
+    @app.after_request
+    def _report_query_stats(response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        if app.config.get('QUERY_SERVER_TIMING'):
+            response.headers.add('Server-Timing', f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"')
+        return response
+
+    @app.teardown_request
+    def _finish_query_stats(exc):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return
+        stack = _collectors()
+        if stats in stack:
+            stack.remove(stats)
+        _warn(app, stats)
+
+def _warn(app, stats):
+    """Log requests whose query count, time or repetition exceeds the thresholds"""
+    from flask import request
+
+    problems = []
+    if stats.count > app.config.get('QUERY_COUNT_WARN_THRESHOLD', 30):
+        problems.append(f"{stats.count} queries")
+    if stats.duration * 1000 > app.config.get('QUERY_TIME_WARN_MS', 500):
+        problems.append(f"{stats.duration * 1000:.0f} ms in the database")
+    repeated = stats.duplicates(app.config.get('QUERY_DUPLICATE_WARN_THRESHOLD', 5))
+    if repeated:
+        problems.append('possible N+1: ' + '; '.join(f"{n}x {fp[:200]}" for fp, n in repeated[:3]))
+    if problems and has_request_context():
+        logger.warning(f"{request.method} {request.path}: {', '.join(problems)}")
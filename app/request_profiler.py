@@ -0,0 +1,259 @@
+"""
+Per-Request Profiler
+
+An admin requests a short-lived signed token (POST /api/admin/profiles/token) and
+sends it in the X-Profile header of the request to profile. There is no query
+parameter form, so the token does not end up in access logs or error reports.
+Tokens are single-use: each carries a nonce that is recorded under
+saved_files/.locks/profile-tokens the first time it is accepted, and a replayed
+token is ignored. That one request then runs under a profiler and its profile is
+written to saved_files/profiles/:
+
+- sample (default): a separate OS thread records the request thread's stack every
+  PROFILE_SAMPLE_INTERVAL_MS. The .folded file holds one "frame;frame;frame count"
+  line per stack, which flamegraph.pl, speedscope and inferno read directly.
+- cprofile (X-Profile-Mode: cprofile): deterministic
+  profiling with cProfile, saved as a .prof file (snakeviz, pstats, flameprof).
+
+The response carries the file name in X-Profile-Id; GET /api/admin/profiles lists
+the saved profiles. Requests without a token only pay for one header lookup. Under gevent the sampler sees whichever greenlet is running
+when it samples, so use cprofile there.
+"""
+
+import os
+import sys
+import time
+import secrets
+import cProfile
+import logging
+from collections import Counter
+from datetime import datetime
+from flask import current_app, g, request
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Profile'
+TOKEN_SALT = 'request-profile'
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+def _nonce_dir():
+    return os.path.join(current_app.config['BASE_DIR'], 'saved_files', '.locks', 'profile-tokens')
+
+def _prune_nonces(max_age):
+    """Forget used nonces whose tokens have expired anyway"""
+    directory = _nonce_dir()
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def _claim_nonce(nonce):
+    """Record a token's nonce; False if it was used before (by any worker on this host)"""
+    directory = _nonce_dir()
+    os.makedirs(directory, exist_ok=True)
+    try:
+        os.close(os.open(os.path.join(directory, nonce), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+    except FileExistsError:
+        return False
+    return True
+
+def generate_profile_token(user_id):
+    """
+    Create a single-use token that enables profiling for the request that carries it
+
+    Args:
+        user_id: ID of the admin requesting it
+
+    Returns:
+        str: Signed token, valid once within PROFILE_TOKEN_MAX_AGE seconds
+    """
+    _prune_nonces(current_app.config.get('PROFILE_TOKEN_MAX_AGE', 900))
+    return _serializer().dumps({'user_id': user_id, 'nonce': secrets.token_hex(16)})
+
+def _verify_token(token):
+    try:
+        claims = _serializer().loads(token, max_age=current_app.config.get('PROFILE_TOKEN_MAX_AGE', 900))
+    except (BadSignature, SignatureExpired):
+        return None
+    nonce = claims.get('nonce') if isinstance(claims, dict) else None
+    if not isinstance(nonce, str) or not nonce.isalnum():
+        return None
+    try:
+        if not _claim_nonce(nonce):
+            return None
+    except OSError as e:
+        logger.error(f"Could not record profile token use: {str(e)}")
+        return None
+    return claims
+
+def profiles_dir():
+    """Directory holding saved profiles"""
+    return os.path.join(current_app.config['BASE_DIR'], 'saved_files', 'profiles')
+
+def _thread_primitives():
+    """start_new_thread, allocate_lock, get_ident and sleep that use real OS threads, also under gevent"""
+    from .concurrency import gevent_active
+    if gevent_active():
+        from gevent import monkey
+        return tuple(monkey.get_original(module, name) for module, name in
+                     (('_thread', 'start_new_thread'), ('_thread', 'allocate_lock'),
+                      ('_thread', 'get_ident'), ('time', 'sleep')))
+    import _thread
+    return _thread.start_new_thread, _thread.allocate_lock, _thread.get_ident, time.sleep
+
+class StackSampler:
+    """Samples one thread's stack from a background thread into folded stacks"""
+
+    def __init__(self, interval, base_dir):
+        self.start_new_thread, allocate_lock, get_ident, self.sleep = _thread_primitives()
+        self.thread_id = get_ident()
+        self.interval = interval
+        self.base_dir = base_dir
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self.finished = allocate_lock()
+
+    def _frame_name(self, code):
+        filename = code.co_filename
+        if filename.startswith(self.base_dir):
+            filename = os.path.relpath(filename, self.base_dir)
+        else:
+            filename = os.path.basename(filename)
+        return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+    def _run(self):
+        try:
+            while self.running:
+                frame = sys._current_frames().get(self.thread_id)
+                names = []
+                while frame is not None:
+                    names.append(self._frame_name(frame.f_code))
+                    frame = frame.f_back
+                if names:
+                    self.stacks[';'.join(reversed(names))] += 1
+                    self.samples += 1
+                self.sleep(self.interval)
+        finally:
+            self.finished.release()
+
+    def start(self):
+        self.running = True
+        self.finished.acquire()
+        self.start_new_thread(self._run, ())
+
+    def stop(self):
+        self.running = False
+        # Wait for the last sample so the counter is no longer written to
+        self.finished.acquire()
+        self.finished.release()
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+def _prune(directory, keep):
+    """Delete the oldest profiles beyond the newest keep"""
+    names = sorted(os.listdir(directory), reverse=True)
+    for name in names[keep:]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+def list_profiles():
+    """
+    List saved profiles, newest first
+
+    Returns:
+        list: Dicts with name, size and created time
+    """
+    directory = profiles_dir()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        stat = os.stat(os.path.join(directory, name))
+        profiles.append({
+            'name': name,
+            'size': stat.st_size,
+            'created': datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+            'format': 'cprofile' if name.endswith('.prof') else 'folded',
+        })
+    return profiles
+
+def init_request_profiler(app):
+    """
+    Profile requests that carry a valid profile token
+
+    Args:
+        app: Flask application
+    """
+    if not app.config.get('PROFILING_ENABLED', True):
+        return
+
+    @app.before_request
+    def _start_profiler():
+        token = request.headers.get(HEADER)
+        if not token:
+            return
+        claims = _verify_token(token)
+        if claims is None:
+            logger.warning(f"Ignoring invalid, expired or reused profile token for {request.path}")
+            return
+        mode = request.headers.get('X-Profile-Mode') or 'sample'
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler(app.config.get('PROFILE_SAMPLE_INTERVAL_MS', 5) / 1000, app.config['BASE_DIR'])
+            profiler.start()
+        g.request_profile = (profiler, time.perf_counter(), claims.get('user_id'))
+
+    @app.after_request
+    def _save_profile(response):
+        active = g.pop('request_profile', None)
+        if active is None:
+            return response
+        profiler, started, user_id = active
+        duration_ms = int((time.perf_counter() - started) * 1000)
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        else:
+            profiler.stop()
+
+        directory = profiles_dir()
+        os.makedirs(directory, exist_ok=True)
+        endpoint = (request.endpoint or 'unmatched').replace('.', '-')
+        extension = 'prof' if isinstance(profiler, cProfile.Profile) else 'folded'
+        name = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}_{request.method}_{endpoint}_{duration_ms}ms.{extension}"
+        try:
+            if isinstance(profiler, cProfile.Profile):
+                profiler.dump_stats(os.path.join(directory, name))
+            else:
+                profiler.save(os.path.join(directory, name))
+            _prune(directory, app.config.get('PROFILE_MAX_FILES', 200))
+        except OSError as e:
+            logger.error(f"Could not save profile {name}: {str(e)}")
+            return response
+        logger.info(f"Saved profile {name} for user {user_id}")
+        response.headers['X-Profile-Id'] = name
+        return response
+
+    @app.teardown_request
+    def _stop_abandoned_profiler(exc):
+        # after_request does not run when the view raised
+        active = g.pop('request_profile', None)
+        if active is not None:
+            profiler = active[0]
+            profiler.disable() if isinstance(profiler, cProfile.Profile) else profiler.stop()
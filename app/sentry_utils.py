@@ -1,4 +1,7 @@
-import sentry_sdk
+import sys
+import random
+from datetime import datetime
+from contextlib import contextmanager
 from flask import current_app, request
 from flask_jwt_extended import get_jwt_identity, get_jwt
 import logging
@@ -6,6 +9,14 @@ import functools
 
 logger = logging.getLogger(__name__)
 
+def _sentry_sdk():
+    """The sentry_sdk module if init_sentry() loaded it, else None
+    
+    sentry_sdk is only imported when a DSN is configured, so without one every
+    helper here is a no-op and workers never pay for the import.
+    """
+    return sys.modules.get('sentry_sdk')
+
 def set_sentry_user():
     """Set user information for Sentry based on JWT token"""
     try:
@@ -17,6 +28,10 @@ def set_sentry_user():
         # Get claims from JWT
         claims = get_jwt()
         
+        sentry_sdk = _sentry_sdk()
+        if sentry_sdk is None:
+            return
+            
         # Set user data in Sentry
         sentry_sdk.set_user({
             'id': user_id,
@@ -35,6 +50,9 @@ def add_sentry_context(name, data):
         name: Context name
         data: Context data (dict)
     """
+    sentry_sdk = _sentry_sdk()
+    if sentry_sdk is None:
+        return
     try:
         sentry_sdk.set_context(name, data)
     except Exception as e:
@@ -47,6 +65,9 @@ def add_sentry_tag(key, value):
         key: Tag key
         value: Tag value
     """
+    sentry_sdk = _sentry_sdk()
+    if sentry_sdk is None:
+        return
     try:
         sentry_sdk.set_tag(key, value)
     except Exception as e:
@@ -59,6 +80,9 @@ def capture_exception(exception, **kwargs):
         exception: Exception to capture
         **kwargs: Additional context data
     """
+    sentry_sdk = _sentry_sdk()
+    if sentry_sdk is None:
+        return
     try:
         # Add any additional context
         for key, value in kwargs.items():
@@ -77,6 +101,9 @@ def capture_message(message, level='info', **kwargs):
         level: Error level (info, warning, error)
         **kwargs: Additional context data
     """
+    sentry_sdk = _sentry_sdk()
+    if sentry_sdk is None:
+        return
     try:
         # Add any additional context
         for key, value in kwargs.items():
@@ -88,33 +115,120 @@ def capture_message(message, level='info', **kwargs):
         logger.warning(f"Failed to capture message in Sentry: {str(e)}")
 
 def with_sentry_transaction(name=None, operation=None):
-    """Decorator to create a Sentry transaction for function execution
+    """Decorator to trace a function as a Sentry span
+    
+    Inside a request the function becomes a child span of the request's
+    transaction; elsewhere (CLI, maintenance thread) it starts its own
+    transaction, which the traces sampler then decides on.
     
     Args:
-        name: Transaction name (defaults to function name)
-        operation: Operation type
+        name: Span or transaction name (defaults to function name)
+        operation: Operation type (defaults to 'function')
     """
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            # Set the function name as the transaction name if not provided
             transaction_name = name or f"{func.__module__}.{func.__name__}"
-            
-            try:
-                # Set transaction name as a tag instead of trying to use transactions API
-                sentry_sdk.set_tag("transaction", transaction_name)
-                
-                # Add the operation type as a tag if provided
-                if operation:
-                    sentry_sdk.set_tag("operation", operation)
-                
-                # Execute the function
+            sentry_sdk = _sentry_sdk()
+            if sentry_sdk is None:
                 return func(*args, **kwargs)
-            except Exception as e:
-                # Capture the exception with transaction info
-                sentry_sdk.set_tag("error", "true")
-                sentry_sdk.capture_exception(e)
-                raise
+            
+            op = operation or 'function'
+            if sentry_sdk.get_current_span() is None:
+                scope = sentry_sdk.start_transaction(name=transaction_name, op=op)
+            else:
+                scope = sentry_sdk.start_span(op=op, name=transaction_name)
+            with scope:
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    sentry_sdk.set_tag("error", "true")
+                    sentry_sdk.capture_exception(e)
+                    raise
                 
         return wrapper
-    return decorator 
\ No newline at end of file
+    return decorator
+
+@contextmanager
+def sentry_span(op, name=None):
+    """Time a block as a child span of the current transaction
+    
+    Without Sentry, or outside a transaction, this does nothing.
+    
+    Args:
+        op: Span operation, e.g. 'smtp.send'
+        name: Span description
+    """
+    sentry_sdk = _sentry_sdk()
+    if sentry_sdk is None or sentry_sdk.get_current_span() is None:
+        yield None
+        return
+    with sentry_sdk.start_span(op=op, name=name) as span:
+        yield span
+
+# --- Sampling ---
+#
+# Head sampling (traces_sampler) cannot know how a request will end, so
+# transactions are recorded for SENTRY_TRACES_RECORD_RATE of the requests (static
+# and monitoring paths never) and the decision to send is made when they finish
+# (before_send_transaction): slow and failed transactions are always sent, the
+# rest at SENTRY_TRACES_SAMPLE_RATE or the rate configured for their route.
+
+def _parse_route_rates(value):
+    """Parse 'auth.login=0.5,violations.=0.1' into [(endpoint prefix, rate)], longest prefix first"""
+    rates = []
+    for item in (value or '').split(','):
+        prefix, _, rate = item.partition('=')
+        if prefix.strip() and rate.strip():
+            rates.append((prefix.strip(), float(rate)))
+    return sorted(rates, key=lambda pair: len(pair[0]), reverse=True)
+
+def _as_epoch(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    return value
+
+def sentry_sampling_options(app):
+    """Build the traces_sampler and before_send_transaction options for sentry_sdk.init
+    
+    Args:
+        app: Flask application
+        
+    Returns:
+        dict: Keyword arguments for sentry_sdk.init
+    """
+    record_rate = app.config.get('SENTRY_TRACES_RECORD_RATE', 1.0)
+    sample_rate = app.config.get('SENTRY_TRACES_SAMPLE_RATE', 0.05)
+    slow_seconds = app.config.get('SENTRY_SLOW_TRANSACTION_MS', 1000) / 1000
+    ignored_paths = tuple(app.config.get('SENTRY_IGNORED_PATHS', ()))
+    route_rates = _parse_route_rates(app.config.get('SENTRY_TRACES_ROUTE_RATES'))
+    
+    def traces_sampler(sampling_context):
+        environ = sampling_context.get('wsgi_environ')
+        if environ is not None and environ.get('PATH_INFO', '').startswith(ignored_paths):
+            return 0
+        parent_sampled = sampling_context.get('parent_sampled')
+        if parent_sampled is not None:
+            return float(parent_sampled)
+        return record_rate
+    
+    def before_send_transaction(event, hint):
+        try:
+            trace = event.get('contexts', {}).get('trace', {})
+            if trace.get('status') not in (None, 'ok'):
+                return event
+            duration = _as_epoch(event['timestamp']) - _as_epoch(event['start_timestamp'])
+            if duration >= slow_seconds:
+                return event
+        except (KeyError, TypeError, ValueError):
+            return event
+        transaction = event.get('transaction') or ''
+        rate = next((r for prefix, r in route_rates if transaction.startswith(prefix)), sample_rate)
+        return event if random.random() < rate else None
+    
+    return {
+        'traces_sampler': traces_sampler,
+        'before_send_transaction': before_send_transaction,
+    }
@@ -0,0 +1,96 @@
+"""
+Coalesced Session Activity
+
+UserSession.last_activity only needs minute-level accuracy, so instead of an
+UPDATE + commit on every request, activity timestamps are queued here and written
+in one executemany UPDATE per batch. A batch is flushed when
+SESSION_ACTIVITY_FLUSH_SIZE sessions are pending, when the oldest pending timestamp
+is SESSION_ACTIVITY_FLUSH_SECONDS old (a daemon timer started with the batch, so a
+worker that goes quiet still writes it), and when the worker exits.
+
+The flush uses its own connection and transaction, so it never commits (or rolls
+back) the request's session.
+"""
+
+import time
+import atexit
+import threading
+import logging
+from flask import current_app
+from sqlalchemy import bindparam
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending = {}  # session id -> latest activity timestamp
+_oldest = None  # monotonic time the oldest pending entry was queued
+_timer = None  # Flushes the pending batch once it is SESSION_ACTIVITY_FLUSH_SECONDS old
+_app = None
+
+def queue_activity(session_id, timestamp):
+    """
+    Queue a last_activity update for a user session
+
+    Args:
+        session_id: UserSession ID
+        timestamp: Activity time (naive UTC datetime)
+    """
+    global _oldest, _app, _timer
+    config = current_app.config
+    flush_seconds = config.get('SESSION_ACTIVITY_FLUSH_SECONDS', 30)
+    with _lock:
+        if _app is None:
+            _app = current_app._get_current_object()
+        previous = _pending.get(session_id)
+        if previous is None or timestamp > previous:
+            _pending[session_id] = timestamp
+        if _oldest is None:
+            _oldest = time.monotonic()
+        if _timer is None:
+            _timer = threading.Timer(flush_seconds, flush_activity)
+            _timer.daemon = True
+            _timer.start()
+        due = (len(_pending) >= config.get('SESSION_ACTIVITY_FLUSH_SIZE', 100) or
+               time.monotonic() - _oldest >= flush_seconds)
+    if due:
+        flush_activity()
+
+def flush_activity():
+    """
+    Write all queued activity timestamps in one batch
+
+    Returns:
+        int: Number of sessions updated
+    """
+    global _oldest, _timer
+    with _lock:
+        timer, _timer = _timer, None
+        if timer is not None and timer is not threading.current_thread():
+            timer.cancel()
+        if not _pending:
+            return 0
+        batch = [{'session_id': sid, 'activity': ts} for sid, ts in _pending.items()]
+        _pending.clear()
+        _oldest = None
+        app = _app
+
+    from . import db
+    from .models import UserSession
+
+    table = UserSession.__table__
+    statement = table.update().where(
+        table.c.id == bindparam('session_id'),
+        table.c.last_activity < bindparam('activity')
+    ).values(last_activity=bindparam('activity'))
+
+    try:
+        with app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(statement, batch)
+    except Exception as e:
+        # Losing a batch only makes last_activity a little stale
+        logger.warning(f"Could not flush activity for {len(batch)} sessions: {str(e)}")
+        return 0
+    return len(batch)
+
+atexit.register(flush_activity)
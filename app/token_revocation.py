@@ -0,0 +1,190 @@
+"""
+JWT Revocation
+
+Revoked tokens are stored in the revoked_tokens table and mirrored in each
+worker's memory, so flask_jwt_extended's blocklist check is a dict lookup:
+
+- A revoked JTI is kept until the token's own exp.
+- A user-wide cutoff revokes every token of that user issued (iat) before it;
+  it is kept for the longest refresh token lifetime.
+
+Each worker reads new rows by id high-water mark. It refreshes when the stamp file
+under saved_files/.locks changes (touched after every revocation on this host) or
+every JWT_REVOCATION_REFRESH_SECONDS, which bounds how long a revocation made on
+another host can go unnoticed. Expired entries are dropped from memory on refresh
+and from the table by the 'purge-revoked-tokens' maintenance task.
+"""
+
+import os
+import time
+import calendar
+import threading
+import logging
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+# Rows committed out of id order are picked up by re-reading this many seconds back
+REFRESH_OVERLAP_SECONDS = 60
+
+_lock = threading.Lock()
+_revoked = {}  # jti -> exp (epoch seconds)
+_user_cutoffs = {}  # user id -> (cutoff iat, entry expiry), both epoch seconds
+_high_water = 0
+_last_refresh = 0.0
+_last_stamp = None
+
+def _epoch(value):
+    return calendar.timegm(value.utctimetuple())
+
+def _stamp_path():
+    path = os.path.join(current_app.config['BASE_DIR'], 'saved_files', '.locks')
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, 'revoked_tokens.stamp')
+
+def _read_stamp():
+    try:
+        return os.stat(_stamp_path()).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _touch_stamp():
+    path = _stamp_path()
+    with open(path, 'a'):
+        os.utime(path)
+
+def _apply(jti, user_id, revoked_at, expires_at):
+    """Add one revoked_tokens row to the in-memory state (caller holds _lock)"""
+    if jti:
+        _revoked[jti] = expires_at
+    elif user_id is not None:
+        cutoff, _ = _user_cutoffs.get(user_id, (0, 0))
+        if revoked_at >= cutoff:
+            _user_cutoffs[user_id] = (revoked_at, expires_at)
+
+def _prune(now):
+    """Drop entries whose tokens have all expired (caller holds _lock)"""
+    for jti in [jti for jti, exp in _revoked.items() if exp <= now]:
+        del _revoked[jti]
+    for user_id in [uid for uid, (_, exp) in _user_cutoffs.items() if exp <= now]:
+        del _user_cutoffs[user_id]
+
+def refresh_revocations(force=False):
+    """
+    Load revocations added since the last refresh
+
+    Args:
+        force (bool): Refresh even if nothing signalled a change
+    """
+    global _high_water, _last_refresh, _last_stamp
+    from . import db
+    from .models import RevokedToken
+
+    now = time.time()
+    stamp = _read_stamp()
+    interval = current_app.config.get('JWT_REVOCATION_REFRESH_SECONDS', 30)
+    if not force and stamp == _last_stamp and now - _last_refresh < interval:
+        return
+
+    with _lock:
+        if not force and stamp == _last_stamp and now - _last_refresh < interval:
+            return
+        table = RevokedToken.__table__
+        recent = datetime.utcfromtimestamp(_last_refresh - REFRESH_OVERLAP_SECONDS) if _last_refresh else None
+        query = db.select(table.c.id, table.c.jti, table.c.user_id, table.c.revoked_at, table.c.expires_at) \
+            .where(table.c.expires_at > datetime.utcfromtimestamp(now))
+        if _high_water:
+            query = query.where(or_(table.c.id > _high_water, table.c.revoked_at >= recent))
+        try:
+            with db.engine.connect() as connection:
+                rows = connection.execute(query).all()
+        except Exception as e:
+            # Keep the current state and try again after the next interval
+            logger.warning(f"Could not refresh revoked tokens: {str(e)}")
+            _last_refresh = now
+            return
+        for row in rows:
+            _apply(row.jti, row.user_id, _epoch(row.revoked_at), _epoch(row.expires_at))
+            _high_water = max(_high_water, row.id)
+        _prune(now)
+        _last_refresh = now
+        _last_stamp = stamp
+
+def is_token_revoked(jwt_payload):
+    """
+    Check a decoded JWT against the revocation state
+
+    Args:
+        jwt_payload (dict): Decoded token claims
+
+    Returns:
+        bool: True if the token was revoked
+    """
+    refresh_revocations()
+    jti = jwt_payload.get('jti')
+    if jti and jti in _revoked:
+        return True
+    try:
+        user_id = int(jwt_payload.get('sub'))
+    except (TypeError, ValueError):
+        return False
+    cutoff = _user_cutoffs.get(user_id)
+    return cutoff is not None and jwt_payload.get('iat', 0) < cutoff[0]
+
+def _store(jti, user_id, revoked_at, expires_at):
+    from . import db
+    from .models import RevokedToken
+
+    try:
+        db.session.add(RevokedToken(jti=jti, user_id=user_id, revoked_at=revoked_at, expires_at=expires_at))
+        db.session.commit()
+    except IntegrityError:
+        # Already revoked
+        db.session.rollback()
+    with _lock:
+        _apply(jti, user_id, _epoch(revoked_at), _epoch(expires_at))
+    _touch_stamp()
+
+def revoke_token(jwt_payload):
+    """
+    Revoke a single token until it expires
+
+    Args:
+        jwt_payload (dict): Decoded token claims (needs jti and exp)
+    """
+    jti = jwt_payload.get('jti')
+    if not jti:
+        return
+    try:
+        user_id = int(jwt_payload.get('sub'))
+    except (TypeError, ValueError):
+        user_id = None
+    expires_at = datetime.utcfromtimestamp(jwt_payload.get('exp') or time.time())
+    _store(jti, user_id, datetime.utcnow(), expires_at)
+
+def revoke_user_tokens(user_id):
+    """
+    Revoke every token issued to a user before now
+
+    Tokens issued later in the same second stay valid, so a session can be given
+    fresh tokens right after its other sessions are revoked.
+
+    Args:
+        user_id: User ID
+    """
+    from .jwt_config import JWT_EXTENDED_REFRESH_TOKEN_EXPIRES
+
+    revoked_at = datetime.utcfromtimestamp(int(time.time()))
+    _store(None, int(user_id), revoked_at, revoked_at + JWT_EXTENDED_REFRESH_TOKEN_EXPIRES)
+
+def purge_revoked_tokens():
+    """Delete revocations whose tokens have all expired"""
+    from . import db
+    from .models import RevokedToken
+
+    deleted = RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+    db.session.commit()
+    return f"{deleted} expired token revocations deleted"
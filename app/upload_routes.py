@@ -0,0 +1,350 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from werkzeug.utils import secure_filename
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+import mimetypes
+import os
+import uuid
+from . import db, limiter
+from .models import Violation, FieldDefinition, UploadSession
+from .jwt_auth import jwt_required_api
+from .utils import create_violation_html, generate_violation_pdf, append_field_value_files, UploadRejectedError, ScanFailedError
+from .evidence_store import stage_upload, attach_upload, revert_upload, normalize_sha256
+from .violation_routes import allowed_file
+
+upload_bp = Blueprint('uploads', __name__)
+
+# --- Resumable chunked uploads ---
+#
+# 1. POST   /api/violations/<vid>/upload-sessions?field=<name>  {filename, size, sha256?}
+# 2. PUT    /api/upload-sessions/<id>/chunks/<n>                 raw chunk bytes
+# 3. GET    /api/upload-sessions/<id>                            progress / missing chunks (resume)
+# 4. POST   /api/upload-sessions/<id>/complete                   validate, scan and attach
+#
+# Chunks are written into a sparse file at their offset, and a one-byte-per-chunk
+# map records which chunks have arrived, so chunks may be sent in any order,
+# retried, or sent in parallel. Each request only holds a worker for one chunk.
+
+def _session_dir():
+    return os.path.join(current_app.config['BASE_DIR'], 'saved_files', 'upload_sessions')
+
+def _data_path(upload_session):
+    return os.path.join(_session_dir(), f'{upload_session.id}.part')
+
+def _map_path(upload_session):
+    return os.path.join(_session_dir(), f'{upload_session.id}.chunks')
+
+def _received_map(upload_session):
+    """One byte per chunk (non-zero once received), or None if the session's files are gone"""
+    try:
+        with open(_map_path(upload_session), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _files_gone_error():
+    return jsonify({'error': 'Upload data is no longer available; start a new upload session'}), 410
+
+def _remove_session_files(upload_session):
+    for path in (_data_path(upload_session), _map_path(upload_session)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def max_session_size(app=None):
+    """Largest file a session accepts: UPLOAD_SESSION_MAX_SIZE, capped at what clamd will scan"""
+    config = (app or current_app).config
+    return min(config['UPLOAD_SESSION_MAX_SIZE'], config['CLAMD_STREAM_MAX_LENGTH'])
+
+def check_upload_limits(app):
+    """Warn at startup when resumable uploads are configured larger than clamd accepts"""
+    if app.config['UPLOAD_SESSION_MAX_SIZE'] > app.config['CLAMD_STREAM_MAX_LENGTH']:
+        app.logger.warning(
+            f"UPLOAD_SESSION_MAX_SIZE ({app.config['UPLOAD_SESSION_MAX_SIZE']} bytes) exceeds "
+            f"CLAMD_STREAM_MAX_LENGTH ({app.config['CLAMD_STREAM_MAX_LENGTH']} bytes); resumable uploads are "
+            f"capped at {max_session_size(app)} bytes. Raise StreamMaxLength in clamd.conf and "
+            f"CLAMD_STREAM_MAX_LENGTH to accept larger files."
+        )
+
+def _can_modify(violation):
+    claims = get_jwt(); is_admin = claims.get('is_admin'); user_id = get_jwt_identity()
+    return is_admin or str(violation.created_by) == str(user_id)
+
+def _get_open_session(session_id):
+    """Load an upload session the current user may write to, or return an error response"""
+    upload_session = UploadSession.query.get(session_id)
+    if not upload_session:
+        return None, (jsonify({'error': 'Upload session not found'}), 404)
+    claims = get_jwt()
+    if not (claims.get('is_admin') or str(upload_session.created_by) == str(get_jwt_identity())):
+        return None, (jsonify({'error': 'Forbidden'}), 403)
+    if upload_session.status == UploadSession.STATUS_COMPLETING:
+        return None, (jsonify({'error': 'Upload session is being completed'}), 409)
+    if upload_session.status != UploadSession.STATUS_OPEN:
+        return None, (jsonify({'error': 'Upload session is already completed'}), 409)
+    if upload_session.is_expired():
+        return None, (jsonify({'error': 'Upload session has expired'}), 410)
+    return upload_session, None
+
+def purge_expired_upload_sessions():
+    """Delete expired open upload sessions, and finished ones past UPLOAD_SESSION_RETENTION_HOURS, with their temp files"""
+    now = datetime.utcnow()
+    retained_since = now - timedelta(hours=current_app.config.get('UPLOAD_SESSION_RETENTION_HOURS', 168))
+    expired = UploadSession.query.filter(or_(
+        and_(UploadSession.status.in_([UploadSession.STATUS_OPEN, UploadSession.STATUS_COMPLETING]),
+             UploadSession.expires_at < now),
+        and_(UploadSession.status == UploadSession.STATUS_COMPLETED, UploadSession.created_at < retained_since)
+    )).all()
+    for upload_session in expired:
+        _remove_session_files(upload_session)
+        db.session.delete(upload_session)
+    if expired:
+        db.session.commit()
+        current_app.logger.info(f"Purged {len(expired)} expired upload sessions")
+    return len(expired)
+
+def delete_violation_upload_sessions(violation_id):
+    """
+    Delete every upload session of a violation that is being deleted
+
+    The rows are deleted in the current session (the caller commits); temp files
+    are removed right away.
+
+    Args:
+        violation_id: The violation ID
+
+    Returns:
+        int: Number of sessions deleted
+    """
+    upload_sessions = UploadSession.query.filter_by(violation_id=violation_id).all()
+    for upload_session in upload_sessions:
+        _remove_session_files(upload_session)
+        db.session.delete(upload_session)
+    return len(upload_sessions)
+
+def _session_status(upload_session):
+    received = _received_map(upload_session) if upload_session.status == UploadSession.STATUS_OPEN else None
+    missing = [i for i, flag in enumerate(received) if not flag] if received is not None else []
+    return {
+        'id': upload_session.id,
+        'violation_id': upload_session.violation_id,
+        'field': upload_session.field_name,
+        'filename': upload_session.filename,
+        'size': upload_session.total_size,
+        'chunk_size': upload_session.chunk_size,
+        'chunk_count': upload_session.chunk_count,
+        'missing_chunks': missing,
+        'status': upload_session.status,
+        'file': upload_session.result_path,
+        'expires_at': upload_session.expires_at.isoformat()
+    }
+
+@upload_bp.route('/api/violations/<int:vid>/upload-sessions', methods=['POST'])
+@jwt_required_api
+def create_upload_session(vid):
+    """Start a resumable upload for a single file"""
+    violation = Violation.query.get_or_404(vid)
+    if not _can_modify(violation):
+        return jsonify({'error': 'Forbidden'}), 403
+
+    field_name = request.args.get('field')
+    if not field_name:
+        return jsonify({'error': 'No field name provided'}), 400
+    if not FieldDefinition.query.filter_by(name=field_name).first():
+        return jsonify({'error': f'Field definition not found for {field_name}'}), 404
+
+    data = request.json or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': f"File {data.get('filename')} has an invalid file type"}), 400
+
+    try:
+        total_size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'File size is required'}), 400
+    max_size = max_session_size()
+    if total_size < 1 or total_size > max_size:
+        return jsonify({'error': f'File size must be between 1 and {max_size} bytes'}), 400
+
+    purge_expired_upload_sessions()
+
+    upload_session = UploadSession(
+        id=str(uuid.uuid4()),
+        violation_id=vid,
+        field_name=field_name,
+        filename=filename,
+        total_size=total_size,
+        chunk_size=current_app.config['UPLOAD_SESSION_CHUNK_SIZE'],
+        sha256=normalize_sha256(data.get('sha256')),
+        created_by=int(get_jwt_identity()),
+        expires_at=datetime.utcnow() + timedelta(hours=current_app.config['UPLOAD_SESSION_TTL_HOURS'])
+    )
+
+    # Sparse files: no disk is used until chunks arrive
+    os.makedirs(_session_dir(), exist_ok=True)
+    with open(_data_path(upload_session), 'wb') as f:
+        f.truncate(total_size)
+    with open(_map_path(upload_session), 'wb') as f:
+        f.truncate(upload_session.chunk_count)
+
+    db.session.add(upload_session)
+    db.session.commit()
+    current_app.logger.info(f"Created upload session {upload_session.id} for violation {vid} ({total_size} bytes, {upload_session.chunk_count} chunks)")
+
+    return jsonify(_session_status(upload_session)), 201
+
+@upload_bp.route('/api/upload-sessions/<session_id>', methods=['GET'])
+@jwt_required_api
+def get_upload_session(session_id):
+    """Report upload progress so an interrupted client can resume"""
+    upload_session = UploadSession.query.get_or_404(session_id)
+    claims = get_jwt()
+    if not (claims.get('is_admin') or str(upload_session.created_by) == str(get_jwt_identity())):
+        return jsonify({'error': 'Forbidden'}), 403
+    if upload_session.status == UploadSession.STATUS_OPEN and _received_map(upload_session) is None:
+        return _files_gone_error()
+    return jsonify(_session_status(upload_session))
+
+@upload_bp.route('/api/upload-sessions/<session_id>/chunks/<int:index>', methods=['PUT'])
+@limiter.exempt  # A single large file is many chunk requests
+@jwt_required_api
+def put_upload_chunk(session_id, index):
+    """Write one chunk at its offset in the session's sparse file"""
+    upload_session, error = _get_open_session(session_id)
+    if error:
+        return error
+    if index < 0 or index >= upload_session.chunk_count:
+        return jsonify({'error': f'Chunk index must be between 0 and {upload_session.chunk_count - 1}'}), 400
+
+    expected = upload_session.chunk_length(index)
+    offset = index * upload_session.chunk_size
+    written = 0
+
+    try:
+        fd = os.open(_data_path(upload_session), os.O_WRONLY)
+    except FileNotFoundError:
+        return _files_gone_error()
+    try:
+        while written < expected:
+            data = request.stream.read(min(64 * 1024, expected - written))
+            if not data:
+                break
+            os.pwrite(fd, data, offset + written)
+            written += len(data)
+        extra = request.stream.read(1)
+        if written != expected or extra:
+            return jsonify({'error': f'Chunk {index} must be exactly {expected} bytes'}), 400
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    # Mark the chunk as received only once its data is on disk
+    map_fd = os.open(_map_path(upload_session), os.O_WRONLY)
+    try:
+        os.pwrite(map_fd, b'\x01', index)
+    finally:
+        os.close(map_fd)
+
+    return jsonify({'chunk': index, 'size': written})
+
+def _release_claim(session_id):
+    """Reopen a claimed session after a failure the client can retry"""
+    UploadSession.query.filter_by(id=session_id, status=UploadSession.STATUS_COMPLETING).update(
+        {UploadSession.status: UploadSession.STATUS_OPEN}, synchronize_session=False
+    )
+    db.session.commit()
+
+@upload_bp.route('/api/upload-sessions/<session_id>/complete', methods=['POST'])
+@jwt_required_api
+def complete_upload_session(session_id):
+    """Validate, scan and attach the assembled file to the violation"""
+    upload_session, error = _get_open_session(session_id)
+    if error:
+        return error
+
+    received = _received_map(upload_session)
+    if received is None or not os.path.exists(_data_path(upload_session)):
+        return _files_gone_error()
+    missing = [i for i, flag in enumerate(received) if not flag]
+    if missing:
+        return jsonify({'error': 'Upload is incomplete', 'missing_chunks': missing}), 409
+
+    field_def = FieldDefinition.query.filter_by(name=upload_session.field_name).first()
+    if not field_def:
+        return jsonify({'error': f'Field definition not found for {upload_session.field_name}'}), 404
+
+    # Claim the session so a concurrent /complete cannot attach the file a second time
+    claimed = UploadSession.query.filter_by(id=session_id, status=UploadSession.STATUS_OPEN).update(
+        {UploadSession.status: UploadSession.STATUS_COMPLETING}, synchronize_session=False
+    )
+    db.session.commit()
+    if not claimed:
+        return jsonify({'error': 'Upload session is being completed'}), 409
+
+    # Run the assembled file through the same MIME/virus validation as direct uploads
+    upload = None
+    try:
+        with open(_data_path(upload_session), 'rb') as f:
+            upload = stage_upload(
+                f,
+                fallback_mimetype=mimetypes.guess_type(upload_session.filename)[0],
+                expected_sha256=upload_session.sha256
+            )
+    except (ScanFailedError, OSError) as e:
+        # clamd unreachable, timed out or refused the stream: keep the session so /complete can be retried
+        current_app.logger.error(f"Could not scan upload session {session_id}: {str(e)}")
+        response = jsonify({'error': f'Virus scan unavailable for {upload_session.filename}, please retry later',
+                            'detail': str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        _release_claim(session_id)
+        return response
+    except UploadRejectedError as e:
+        _remove_session_files(upload_session)
+        db.session.delete(upload_session)
+        db.session.commit()
+        return jsonify({'error': f'Error with {upload_session.filename}: {str(e)}'}), 400
+
+    try:
+        unique_filename = f"{uuid.uuid4()}_{upload_session.filename}"
+        relative_path = attach_upload(upload, upload_session.violation_id, unique_filename)
+        append_field_value_files(upload_session.violation_id, field_def.id, [relative_path])
+        upload_session.status = UploadSession.STATUS_COMPLETED
+        upload_session.result_path = relative_path
+        db.session.commit()
+    except Exception as e:
+        current_app.logger.error(f"Database error completing upload session {session_id}: {str(e)}")
+        db.session.rollback()
+        revert_upload(upload)
+        _release_claim(session_id)
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+    _remove_session_files(upload_session)
+    current_app.logger.info(f"Completed upload session {session_id}: {relative_path}")
+
+    # Regenerate the HTML and PDF after adding the file
+    try:
+        violation = Violation.query.get(upload_session.violation_id)
+        html_path, html_content = create_violation_html(violation)
+        generate_violation_pdf(violation, html_content)
+    except Exception as e:
+        current_app.logger.error(f"Error updating violation files after upload: {str(e)}")
+
+    return jsonify({
+        'message': 'File uploaded successfully',
+        'files': [relative_path]
+    })
+
+@upload_bp.route('/api/upload-sessions/<session_id>', methods=['DELETE'])
+@jwt_required_api
+def abort_upload_session(session_id):
+    """Abandon an upload and free its temp files"""
+    upload_session, error = _get_open_session(session_id)
+    if error:
+        return error
+    _remove_session_files(upload_session)
+    db.session.delete(upload_session)
+    db.session.commit()
+    return jsonify({'success': True})
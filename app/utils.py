@@ -1,6 +1,10 @@
 import os
 import uuid
 import socket
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from flask import current_app, render_template, url_for, g
 from werkzeug.utils import secure_filename
@@ -13,6 +17,8 @@ import logging
 from .models import Settings
 import tempfile
 from itsdangerous import URLSafeTimedSerializer
+from .metrics import PDF_RENDER, SMTP_SEND, CLAMAV_SCAN
+from .sentry_utils import sentry_span
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -80,15 +86,25 @@ def save_uploaded_file(file_storage, folder):
     file_storage.save(path)
     return os.path.relpath(path, current_app.root_path)
 
+def _write_pdf(file_path, **source):
+    """Render HTML (string= or filename=) to a PDF file with WeasyPrint"""
+    from weasyprint import HTML
+    with PDF_RENDER.time():
+        HTML(**source).write_pdf(file_path)
+
+def _render_pdf(file_path, **source):
+    """Run _write_pdf off the event loop, traced as a span of the current request"""
+    from .concurrency import run_cpu_bound
+    with sentry_span('render.pdf', os.path.basename(file_path)):
+        run_cpu_bound(_write_pdf, file_path, **source)
+
 def generate_pdf_from_html(html_content, pdf_path):
     """
     Generate a PDF file from HTML content (WeasyPrint 61+ API)
     """
     try:
-        from weasyprint import HTML
         current_app.logger.info(f"Generating PDF at {pdf_path} using WeasyPrint 61+ API")
-        html = HTML(string=html_content)
-        html.write_pdf(pdf_path)  # WeasyPrint 61+ API
+        _render_pdf(pdf_path, string=html_content)  # WeasyPrint 61+ API
         current_app.logger.info(f"Successfully generated PDF ({os.path.getsize(pdf_path)} bytes)")
         return pdf_path
     except Exception as e:
@@ -105,7 +121,8 @@ def send_email(subject, recipients, body, attachments=None, cc=None, html=None):
     
     # Log the intent to send an email with settings details
     current_app.logger.info(f"Preparing to send email: subject='{subject}', to={recipients}")
-    current_app.logger.info(f"SMTP Settings: server={settings.smtp_server}, port={settings.smtp_port}, user={settings.smtp_username}, TLS={settings.smtp_use_tls}")
+    current_app.logger.debug("SMTP settings: server=%s, port=%s, user=%s, TLS=%s", settings.smtp_server,
+                             settings.smtp_port, settings.smtp_username, settings.smtp_use_tls)
     
     try:
         # Only apply database settings if they're properly configured
@@ -142,9 +159,8 @@ def send_email(subject, recipients, body, attachments=None, cc=None, html=None):
             current_app.config['MAIL_DEFAULT_SENDER'] = config.get('MAIL_DEFAULT_SENDER', original_sender)
             
             # Debug logging - show what we're using (masking password)
-            current_app.logger.info(f"Using SMTP: {config['MAIL_SERVER']}:{config['MAIL_PORT']} " +
-                              f"with user={config['MAIL_USERNAME']}, " +
-                              f"TLS={config['MAIL_USE_TLS']}")
+            current_app.logger.debug("Using SMTP: %s:%s with user=%s, TLS=%s", config['MAIL_SERVER'],
+                                     config['MAIL_PORT'], config['MAIL_USERNAME'], config['MAIL_USE_TLS'])
             
             try:
                 # Import mail from app
@@ -172,7 +188,14 @@ def send_email(subject, recipients, body, attachments=None, cc=None, html=None):
                         msg.attach(os.path.basename(att), 'application/pdf', f.read())
                 
                 # Send with mail instance from app context
-                mail.send(msg)
+                send_started = time.perf_counter()
+                try:
+                    with sentry_span('smtp.send', config['MAIL_SERVER']):
+                        mail.send(msg)
+                except Exception:
+                    SMTP_SEND.observe(time.perf_counter() - send_started, outcome='error')
+                    raise
+                SMTP_SEND.observe(time.perf_counter() - send_started, outcome='sent')
                 current_app.logger.info("Email sent successfully")
             except Exception as e:
                 current_app.logger.error(f"Error sending email with custom SMTP settings: {str(e)}")
@@ -252,7 +275,8 @@ def create_violation_html(violation, field_defs=None):
     # Get creator info
     creator = None
     if violation.created_by:
-        creator = User.query.get(violation.created_by)
+        from .identity import get_user
+        creator = get_user(violation.created_by)
     
     # Parse attached evidence if it exists and is valid JSON
     evidence_list = []
@@ -281,17 +305,18 @@ def create_violation_html(violation, field_defs=None):
     file_path = os.path.join(secure_dir, filename)
     
     # Render the HTML template, passing the parsed evidence list
-    html_content = render_template(
-        'violations/detail.html',
-        violation=violation,
-        dynamic_fields=dynamic_fields,
-        field_images=field_images,
-        has_images=bool(field_images),
-        evidence_list=evidence_list,
-        field_defs=field_defs,
-        replies=replies,
-        creator=creator
-    )
+    with sentry_span('render.template', 'violations/detail.html'):
+        html_content = render_template(
+            'violations/detail.html',
+            violation=violation,
+            dynamic_fields=dynamic_fields,
+            field_images=field_images,
+            has_images=bool(field_images),
+            evidence_list=evidence_list,
+            field_defs=field_defs,
+            replies=replies,
+            creator=creator
+        )
     
     # Write the HTML to file
     with open(file_path, 'w', encoding='utf-8') as f:
@@ -312,7 +337,6 @@ def generate_violation_pdf(violation, html_content=None):
     try:
         import uuid, os, tempfile
         from flask import current_app
-        from weasyprint import HTML
         unique_id = str(uuid.uuid4())
         filename = f"{unique_id}_{violation.id}.pdf"
         secure_dir = os.path.join(current_app.config['BASE_DIR'], 'saved_files', 'pdf')
@@ -325,7 +349,7 @@ def generate_violation_pdf(violation, html_content=None):
             else:
                 _, html_content = create_violation_html(violation)
         try:
-            HTML(string=html_content).write_pdf(file_path)
+            _render_pdf(file_path, string=html_content)
             current_app.logger.info(f"Generated PDF using direct HTML string: {file_path}")
         except Exception as e:
             current_app.logger.warning(f"Direct HTML string PDF generation failed: {str(e)}")
@@ -333,7 +357,7 @@ def generate_violation_pdf(violation, html_content=None):
                 with tempfile.NamedTemporaryFile(suffix='.html', delete=False) as temp_html:
                     temp_html.write(html_content.encode('utf-8'))
                     temp_html_path = temp_html.name
-                HTML(filename=temp_html_path).write_pdf(file_path)
+                _render_pdf(file_path, filename=temp_html_path)
                 os.unlink(temp_html_path)
                 current_app.logger.info(f"Generated PDF using temporary file approach: {file_path}")
             except Exception as e2:
@@ -518,14 +542,18 @@ def scan_file(file_path):
             return True, "Virus scan skipped (ClamAV not available)"
         
         # Scan the file
-        scan_result = clam.scan_file(file_path)
+        scan_started = time.perf_counter()
+        with sentry_span('clamav.scan', os.path.basename(file_path)):
+            scan_result = clam.scan_file(file_path)
         
         # If scan_result is None, the file is clean
         if scan_result is None:
+            CLAMAV_SCAN.observe(time.perf_counter() - scan_started, mode='file', outcome='clean')
             current_app.logger.info(f"File is clean: {file_path}")
             return True, "File is clean"
         
         # If we have a result, the file is infected
+        CLAMAV_SCAN.observe(time.perf_counter() - scan_started, mode='file', outcome='infected')
         current_app.logger.warning(f"Infected file detected: {file_path}, {scan_result}")
         return False, f"Infected: {scan_result[file_path]}"
     
@@ -534,107 +562,375 @@ def scan_file(file_path):
         # Since we can't be sure, we'll err on the side of caution
         return False, f"Scan error: {str(e)}"
 
-def secure_handle_uploaded_file(file, violation_id, field_name, subdir='fields'):
+class UploadRejectedError(Exception):
+    """Raised when an upload fails content type validation or virus scanning"""
+    pass
+
+class ScanFailedError(UploadRejectedError):
+    """Raised when the virus scan could not finish (clamd error, timeout or stream size limit); the upload may be retried"""
+    pass
+
+def _scan_failure(error):
+    limit = current_app.config.get('CLAMD_STREAM_MAX_LENGTH')
+    return (f"Virus scan failed: {error}. Files over clamd's StreamMaxLength "
+            f"(CLAMD_STREAM_MAX_LENGTH={limit} bytes) are refused by clamd.")
+
+# Allowed MIME types for uploaded evidence
+ALLOWED_MIME_TYPES = {
+    'image/jpeg',
+    'image/png',
+    'application/pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'text/plain',
+}
+
+# Size of each read from the upload stream
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Number of leading bytes handed to libmagic (matches libmagic's own default read limit)
+MIME_SNIFF_BYTES = 1024 * 1024
+
+# Building a libmagic handle loads the whole magic database, so keep one per process.
+# libmagic handles are not thread-safe, hence the lock.
+_magic_handle = None
+_magic_lock = threading.Lock()
+
+# mkstemp creates files as 0600; stored uploads should get the usual umask-based mode
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def detect_mime_type(buffer, fallback=None):
     """
-    Securely handle an uploaded file with virus scanning and content type validation
+    Detect the MIME type of the leading bytes of a file using a shared libmagic handle
     
     Args:
-        file: The uploaded file object
-        violation_id: The violation ID
-        field_name: The field name for the file
-        subdir: Subdirectory within uploads (default: 'fields')
+        buffer: Leading bytes of the file
+        fallback: MIME type to use if python-magic is not installed
         
     Returns:
-        tuple: (success, file_path or error_message)
-    """
-    from werkzeug.utils import secure_filename
-    
-    # Allowed MIME types
-    ALLOWED_MIME_TYPES = {
-        'image/jpeg',
-        'image/png',
-        'application/pdf',
-        'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        'text/plain',
-    }
+        str: Detected MIME type
+    """
+    global _magic_handle
     try:
-        # Check if file exists
-        if not file or not file.filename:
-            return False, "No file provided"
+        import magic
+    except ImportError:
+        return fallback
+    
+    with _magic_lock:
+        if _magic_handle is None:
+            _magic_handle = magic.Magic(mime=True)
+        return _magic_handle.from_buffer(buffer)
+
+class ClamdStream:
+    """
+    Incremental INSTREAM session with the ClamAV daemon.
+    
+    Chunks are sent to clamd as they are read from the upload, so the file does not
+    need to be re-read from disk for scanning.
+    """
+    
+    def __init__(self, sock):
+        self.sock = sock
+    
+    @classmethod
+    def open(cls):
+        """
+        Connect to clamd via Unix socket, falling back to TCP
         
-        # Generate secure filename with UUID
-        original_filename = secure_filename(file.filename)
-        unique_id = str(uuid.uuid4())
-        unique_filename = f"{unique_id}_{original_filename}"
-        
-        # Create secure directory structure
-        secure_dir = os.path.join(
-            current_app.config['BASE_DIR'],
-            'saved_files',
-            'uploads',
-            subdir,
-            f'violation_{violation_id}'
-        )
-        os.makedirs(secure_dir, exist_ok=True)
+        Returns:
+            ClamdStream or None: Open session, or None if clamd is not reachable
+        """
+        timeout = current_app.config.get('CLAMD_TIMEOUT', 30)
+        socket_path = current_app.config.get('CLAMD_SOCKET', '/var/run/clamav/clamd.ctl')
         
-        # Generate full file path
-        file_path = os.path.join(secure_dir, unique_filename)
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            return cls._start(sock)
+        except Exception as e:
+            current_app.logger.warning(f"Unable to connect to ClamAV daemon via Unix socket: {str(e)}")
         
-        # Save the file temporarily for scanning and validation
-        file.save(file_path)
+        try:
+            sock = socket.create_connection(
+                (current_app.config.get('CLAMD_HOST', '127.0.0.1'), current_app.config.get('CLAMD_PORT', 3310)),
+                timeout=timeout
+            )
+            return cls._start(sock)
+        except Exception as e:
+            current_app.logger.warning(f"Unable to connect to ClamAV daemon via network: {str(e)}")
         
-        # Verify the file was saved successfully
-        if not os.path.exists(file_path):
-            return False, "Failed to save file"
+        return None
+    
+    @classmethod
+    def _start(cls, sock):
+        sock.sendall(b'zINSTREAM\0')
+        return cls(sock)
+    
+    def send(self, chunk):
+        """Send a chunk of file data to clamd"""
+        if chunk:
+            self.sock.sendall(struct.pack('!L', len(chunk)) + chunk)
+    
+    def finish(self):
+        """
+        Terminate the stream and read the verdict
         
-        if os.path.getsize(file_path) == 0:
-            os.remove(file_path)
-            return False, "Empty file"
+        Returns:
+            tuple: (is_clean, result_message)
+        """
+        started = time.perf_counter()
+        with sentry_span('clamav.scan', 'INSTREAM verdict'):
+            is_clean, message = self._read_verdict()
+        outcome = 'clean' if is_clean else 'infected' if message.startswith('Infected') else 'error'
+        CLAMAV_SCAN.observe(time.perf_counter() - started, mode='stream', outcome=outcome)
+        return is_clean, message
+    
+    def _read_verdict(self):
+        try:
+            self.sock.sendall(struct.pack('!L', 0))
+            reply = b''
+            while not reply.endswith(b'\0'):
+                data = self.sock.recv(4096)
+                if not data:
+                    break
+                reply += data
+        finally:
+            self.close()
         
-        # Content type validation
-        detected_type = None
+        result = reply.rstrip(b'\0').decode('utf-8', 'replace').strip()
+        if result.endswith('OK'):
+            return True, "File is clean"
+        if result.endswith('FOUND'):
+            return False, f"Infected: {result.split(':', 1)[-1].replace('FOUND', '').strip()}"
+        return False, f"Scan error: {result or 'no response from clamd'}"
+    
+    def close(self):
         try:
-            import magic
-            mime = magic.Magic(mime=True)
-            detected_type = mime.from_file(file_path)
-        except ImportError:
-            detected_type = file.mimetype
-        
-        if detected_type not in ALLOWED_MIME_TYPES:
-            os.remove(file_path)
-            return False, f"File type {detected_type} is not allowed."
-        
-        # Scan the file for viruses
-        is_clean, scan_result = scan_file(file_path)
-        
-        # If the file is not clean, delete it
-        if not is_clean:
-            os.remove(file_path)
-            return False, f"Virus detected: {scan_result}"
-        
-        # Return the relative path for database storage
-        relative_path = os.path.join(
-            'saved_files',
-            'uploads',
-            subdir,
-            f'violation_{violation_id}',
-            unique_filename
-        )
+            self.sock.close()
+        except Exception:
+            pass
+
+def stream_upload(stream, dest_dir, fallback_mimetype=None, scan=True):
+    """
+    Read an upload exactly once, hashing, sniffing, scanning and spooling it to disk.
+    
+    Each chunk is fed to SHA-256, the clamd INSTREAM session and a temporary file in
+    dest_dir. The MIME type is detected from the leading bytes as soon as enough have
+    been read, so disallowed files are rejected without reading the rest.
+    
+    Args:
+        stream: Readable binary file-like object
+        dest_dir: Directory for the temporary file (same filesystem as the final path)
+        fallback_mimetype: MIME type to use if python-magic is not installed
+        scan: Whether to virus scan the content while streaming
+        
+    Returns:
+        dict: temp_path, sha256, size, mime_type and scan_result
         
-        return True, relative_path
+    Raises:
+        UploadRejectedError: If the file is empty, not allowed or infected
+        ScanFailedError: If clamd failed or refused the stream
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=dest_dir, prefix='.upload-', suffix='.part')
+    os.fchmod(fd, 0o666 & ~_UMASK)
     
-    except Exception as e:
-        current_app.logger.error(f"Error handling uploaded file: {str(e)}")
-        # If an error occurs, try to clean up the file
+    sha256 = hashlib.sha256()
+    size = 0
+    head = b''
+    mime_type = None
+    scanner = None
+    scan_result = "Virus scan skipped"
+    
+    try:
+        if scan:
+            scanner = ClamdStream.open()
+            if not scanner:
+                current_app.logger.warning("ClamAV not available, skipping virus scan")
+                scan_result = "Virus scan skipped (ClamAV not available)"
+        
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                
+                size += len(chunk)
+                sha256.update(chunk)
+                
+                if mime_type is None:
+                    head += chunk
+                    if len(head) >= MIME_SNIFF_BYTES:
+                        mime_type = detect_mime_type(head[:MIME_SNIFF_BYTES], fallback_mimetype)
+                        head = b''
+                        if mime_type not in ALLOWED_MIME_TYPES:
+                            raise UploadRejectedError(f"File type {mime_type} is not allowed.")
+                
+                if scanner:
+                    try:
+                        scanner.send(chunk)
+                    except OSError as e:
+                        raise ScanFailedError(_scan_failure(e))
+                out.write(chunk)
+        
+        if size == 0:
+            raise UploadRejectedError("Empty file")
+        
+        if mime_type is None:
+            mime_type = detect_mime_type(head, fallback_mimetype)
+            if mime_type not in ALLOWED_MIME_TYPES:
+                raise UploadRejectedError(f"File type {mime_type} is not allowed.")
+        
+        if scanner:
+            try:
+                is_clean, scan_result = scanner.finish()
+            except OSError as e:
+                raise ScanFailedError(_scan_failure(e))
+            scanner = None
+            if not is_clean and not scan_result.startswith('Infected'):
+                raise ScanFailedError(_scan_failure(scan_result))
+            if not is_clean:
+                current_app.logger.warning(f"Rejected upload: {scan_result}")
+                raise UploadRejectedError(f"Virus detected: {scan_result}")
+        
+        return {
+            'temp_path': temp_path,
+            'sha256': sha256.hexdigest(),
+            'size': size,
+            'mime_type': mime_type,
+            'scan_result': scan_result
+        }
+    except Exception:
+        if scanner:
+            scanner.close()
         try:
-            if 'file_path' in locals() and os.path.exists(file_path):
-                os.remove(file_path)
-        except:
+            os.remove(temp_path)
+        except OSError:
             pass
-        return False, f"Error: {str(e)}"
+        raise
+
+def append_field_value_files(violation_id, field_definition_id, paths):
+    """
+    Append stored file paths to a violation's file field value
+    
+    The change is added to the current database session; the caller commits.
+    
+    Args:
+        violation_id: The violation ID
+        field_definition_id: ID of the file field definition
+        paths: Relative paths of the stored files
+    """
+    from .models import ViolationFieldValue
+    from . import db
+    
+    field_value = ViolationFieldValue.query.filter_by(
+        violation_id=violation_id,
+        field_definition_id=field_definition_id
+    ).first()
+    
+    if field_value:
+        # Append to existing files if any
+        existing_files = field_value.value.split(',') if field_value.value else []
+        # Remove empty strings that might have been in the split
+        existing_files = [f for f in existing_files if f.strip()]
+        field_value.value = ','.join(existing_files + list(paths))
+    else:
+        # Create new field value
+        db.session.add(ViolationFieldValue(
+            violation_id=violation_id,
+            field_definition_id=field_definition_id,
+            value=','.join(paths)
+        ))
+
+def send_protected_file(directory, filename, as_attachment=False, download_name=None):
+    """
+    Serve a file after the caller has done its permission checks
+    
+    With USE_X_ACCEL_REDIRECT enabled the response carries no body, only an
+    X-Accel-Redirect header pointing at nginx's internal location, so nginx streams
+    the file and the worker is freed immediately. Otherwise this behaves like
+    send_from_directory.
+    
+    Args:
+        directory: Directory containing the file
+        filename: File name (may include subdirectories) relative to directory
+        as_attachment: Send as a download instead of inline
+        download_name: File name to offer the browser for downloads
+        
+    Returns:
+        Response: Flask response object
+    """
+    from flask import send_from_directory, make_response, abort
+    from werkzeug.security import safe_join
+    from urllib.parse import quote
+    import mimetypes
+    
+    if not current_app.config.get('USE_X_ACCEL_REDIRECT'):
+        return send_from_directory(directory, filename, as_attachment=as_attachment, download_name=download_name)
+    
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    
+    # Only files below BASE_DIR are reachable through the internal location
+    relative_path = os.path.relpath(os.path.realpath(path), os.path.realpath(current_app.config['BASE_DIR']))
+    if relative_path.startswith('..'):
+        current_app.logger.warning(f"File outside BASE_DIR cannot be offloaded to nginx: {path}")
+        return send_from_directory(directory, filename, as_attachment=as_attachment, download_name=download_name)
+    
+    response = make_response('')
+    response.headers['X-Accel-Redirect'] = current_app.config['X_ACCEL_REDIRECT_PREFIX'] + quote(relative_path)
+    # nginx keeps these headers from the original response
+    response.headers['Content-Type'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if as_attachment:
+        name = download_name or os.path.basename(path)
+        try:
+            name.encode('ascii')
+            response.headers.set('Content-Disposition', 'attachment', filename=name)
+        except UnicodeEncodeError:
+            # Same RFC 2231 fallback as send_file
+            response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(name, safe='')}"
+    return response
 
 # Token generation for secure violation access
+
+# Built once per SECRET_KEY instead of on every link view
+_access_serializer = None  # (secret key, URLSafeTimedSerializer)
+
+# Verified secure-link tokens: sha256(max_age:token) -> [expires at (epoch seconds),
+# violation id from the token, resolved numeric violation id or None]. Entries
+# never outlive the token itself, so a cache hit is exactly as valid as a fresh
+# signature check.
+_access_token_cache = OrderedDict()
+_access_token_lock = threading.Lock()
+
+def _get_access_serializer():
+    global _access_serializer
+    secret_key = current_app.config['SECRET_KEY']
+    cached = _access_serializer
+    if cached is None or cached[0] != secret_key:
+        cached = (secret_key, URLSafeTimedSerializer(secret_key))
+        _access_serializer = cached
+        # Tokens verified under the old key must be checked again
+        with _access_token_lock:
+            _access_token_cache.clear()
+    return cached[1]
+
+def _access_token_key(token, max_age):
+    return hashlib.sha256(f"{max_age}:{token}".encode('utf-8')).hexdigest()
+
+def _cached_access_token(key):
+    with _access_token_lock:
+        entry = _access_token_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del _access_token_cache[key]
+            return None
+        _access_token_cache.move_to_end(key)
+        return entry
+
 def generate_secure_access_token(violation_id, expiration_hours=24):
     """
     Generate a signed, time-limited token for violation access
@@ -646,8 +942,7 @@ def generate_secure_access_token(violation_id, expiration_hours=24):
     Returns:
         str: Secure access token
     """
-    # Create serializer with app secret
-    serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
+    serializer = _get_access_serializer()
     
     # Create payload with violation ID and timestamp
     payload = {
@@ -663,6 +958,9 @@ def validate_secure_access_token(token, max_age=86400):
     """
     Validate a secure access token and extract violation ID
     
+    Tokens that verified before are answered from an in-process LRU until they
+    expire, without checking the signature again.
+    
     Args:
         token: Token to validate
         max_age: Maximum age in seconds (default 24 hours)
@@ -670,52 +968,86 @@ def validate_secure_access_token(token, max_age=86400):
     Returns:
         int/str or None: Violation ID if valid, None if invalid
     """
-    from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
-    from flask import current_app
+    from itsdangerous import BadSignature, SignatureExpired
     
-    # Create serializer with app secret
-    serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
+    serializer = _get_access_serializer()
+    key = _access_token_key(token, max_age)
+    entry = _cached_access_token(key)
+    if entry is not None:
+        return entry[1]
     
     try:
         # Load and validate token
-        data = serializer.loads(token, max_age=max_age)
-        
-        # Return the ID, checking if it's a UUID (str) or regular ID (int)
-        return data.get('violation_id')
+        data, signed_at = serializer.loads(token, max_age=max_age, return_timestamp=True)
     except (BadSignature, SignatureExpired):
         return None
     except Exception as e:
         current_app.logger.error(f"Error validating token: {str(e)}")
         return None
+    
+    # Return the ID, checking if it's a UUID (str) or regular ID (int)
+    violation_id = data.get('violation_id') if isinstance(data, dict) else None
+    if violation_id:
+        with _access_token_lock:
+            _access_token_cache[key] = [signed_at.timestamp() + max_age, violation_id, None]
+            _access_token_cache.move_to_end(key)
+            while len(_access_token_cache) > current_app.config.get('SECURE_TOKEN_CACHE_SIZE', 2048):
+                _access_token_cache.popitem(last=False)
+    return violation_id
 
-def log_violation_access(violation_id, token, request):
+def get_secure_violation(token, max_age=86400):
     """
-    Log access to a violation
+    Resolve a secure access token to its violation
+    
+    The numeric violation ID is cached with the verified token, so repeat views
+    of a link cost one primary key lookup.
     
     Args:
-        violation_id: ID of the violation
-        token: Access token used
-        request: Flask request object
+        token: Token from the secure link
+        max_age: Maximum age in seconds (default 24 hours)
         
     Returns:
-        ViolationAccess: Created log entry
+        tuple: (violation ID from the token or None if the token is invalid,
+                Violation or None if it does not exist)
     """
-    from .models import ViolationAccess
     from . import db
+    from .models import Violation
     
-    # Create log entry
-    log = ViolationAccess(
-        violation_id=violation_id,
-        ip_address=request.remote_addr,
-        user_agent=request.user_agent.string,
-        token=token,
-    )
+    violation_id = validate_secure_access_token(token, max_age)
+    if not violation_id:
+        return None, None
     
-    # Save to database
-    db.session.add(log)
-    db.session.commit()
+    key = _access_token_key(token, max_age)
+    entry = _cached_access_token(key)
+    resolved = entry[2] if entry is not None else None
+    if resolved is None:
+        if isinstance(violation_id, int) or str(violation_id).isdigit():
+            resolved = int(violation_id)
+        else:
+            # public_id has a unique index
+            resolved = db.session.query(Violation.id).filter_by(public_id=str(violation_id)).scalar()
+        if resolved is not None and entry is not None:
+            with _access_token_lock:
+                entry[2] = resolved
+    
+    violation = db.session.get(Violation, resolved) if resolved is not None else None
+    return violation_id, violation
+
+def log_violation_access(violation_id, token, request):
+    """
+    Log access to a violation
+    
+    The event is queued and written in a batch by a background thread (see
+    access_log), so the page view does not wait for the database.
+    
+    Args:
+        violation_id: ID of the violation
+        token: Access token used
+        request: Flask request object
+    """
+    from .access_log import record_access
     
-    return log
+    record_access(violation_id, request.remote_addr, request.user_agent.string, token)
 
 def send_secure_urls(violation):
     """Generate secure URLs for a violation
@@ -7,11 +7,15 @@ import json
 from sqlalchemy import text
 from werkzeug.utils import secure_filename
 import uuid
-from .utils import create_violation_html, generate_violation_pdf, send_violation_notification, get_cached_fields, clear_field_cache, secure_handle_uploaded_file, generate_secure_access_token, validate_secure_access_token, log_violation_access
+from .utils import create_violation_html, generate_violation_pdf, send_violation_notification, get_cached_fields, clear_field_cache, append_field_value_files, generate_secure_access_token, validate_secure_access_token, get_secure_violation, log_violation_access, send_protected_file
+from .identity import get_user
+from .evidence_store import release_violation_evidence, remove_evidence_files, stage_uploads, attach_upload, revert_upload
 import datetime
 from . import limiter
 from .jwt_auth import jwt_required_api
 from flask_jwt_extended import get_jwt, get_jwt_identity
+from .logging_pipeline import lazy_json
+from .idempotency import idempotent
 
 violation_bp = Blueprint('violations', __name__)
 
@@ -73,11 +77,12 @@ def api_list_active_fields():
 
 @violation_bp.route('/api/violations', methods=['POST'])
 @jwt_required_api
+@idempotent
 def api_create_violation():
     try:
         claims = get_jwt(); is_admin = claims.get('is_admin'); user_id = get_jwt_identity()
         data = request.json or {}
-        current_app.logger.info(f"Received violation data: {json.dumps(data)}")
+        current_app.logger.debug("Received violation data: %s", lazy_json(data))
         
         # Generate a reference number if not provided
         if not data.get('reference'):
@@ -168,7 +173,7 @@ def api_create_violation():
         
         # Process dynamic fields
         dynamic_fields = data.get('dynamic_fields', {})
-        current_app.logger.info(f"Processing dynamic fields: {json.dumps(dynamic_fields)}")
+        current_app.logger.debug("Processing dynamic fields: %s", lazy_json(dynamic_fields))
         
         # Track which fields were processed successfully
         processed_fields = []
@@ -276,7 +281,7 @@ def view_violation_html(vid):
     html_filename = os.path.basename(violation.html_path)
     
     # Serve the file
-    return send_from_directory(html_dir, html_filename)
+    return send_protected_file(html_dir, html_filename)
 
 @violation_bp.route('/violations/pdf/<int:vid>')
 @jwt_required_api
@@ -343,7 +348,7 @@ def download_violation_pdf(vid):
     pdf_filename = os.path.basename(violation.pdf_path)
     
     # Serve the file
-    return send_from_directory(
+    return send_protected_file(
         pdf_dir,
         pdf_filename,
         as_attachment=True,
@@ -352,6 +357,7 @@ def download_violation_pdf(vid):
 
 @violation_bp.route('/api/violations/<int:vid>/upload', methods=['POST'])
 @jwt_required_api
+@idempotent
 def api_upload_files(vid):
     """Handle file uploads for a violation with virus scanning"""
     try:
@@ -377,12 +383,15 @@ def api_upload_files(vid):
         if 'files' not in request.files:
             return jsonify({'error': 'No files in request'}), 400
         
-        # Process each file
+        # Validate names first, then stage (sniff, scan, spool) all files in parallel
         saved_files = []
-        file_results = []
         errors = []
         
-        for file in request.files.getlist('files'):
+        # Optional SHA-256 per file (same order as 'files'), lets known content skip the virus scan
+        sha256_hints = request.form.getlist('sha256')
+        
+        accepted = []
+        for index, file in enumerate(request.files.getlist('files')):
             if not file or not file.filename:
                 continue
                 
@@ -390,46 +399,37 @@ def api_upload_files(vid):
                 errors.append(f"File {file.filename} has an invalid file type")
                 continue
             
-            # Use the secure file handling function with virus scanning
-            success, result = secure_handle_uploaded_file(file, vid, field_name)
-            
+            expected_sha256 = sha256_hints[index] if index < len(sha256_hints) else None
+            accepted.append((file, expected_sha256))
+        
+        staged = stage_uploads([(file.stream, file.mimetype, expected_sha256) for file, expected_sha256 in accepted])
+        
+        uploads = []
+        for (file, _), (success, result) in zip(accepted, staged):
             if success:
-                # Add the relative path to saved files
-                saved_files.append(result)
+                uploads.append((file, result))
             else:
-                # Add the error message
                 errors.append(f"Error with {file.filename}: {result}")
         
-        if not saved_files and errors:
+        if not uploads and errors:
             return jsonify({'error': '; '.join(errors)}), 400
         
-        # Store the file paths in the database
+        # Attach every file and store the paths in a single transaction
         try:
-            field_value = ViolationFieldValue.query.filter_by(
-                violation_id=vid,
-                field_definition_id=field_def.id
-            ).first()
-            
-            if field_value:
-                # Append to existing files if any
-                existing_files = field_value.value.split(',') if field_value.value else []
-                # Remove empty strings that might have been in the split
-                existing_files = [f for f in existing_files if f.strip()]
-                field_value.value = ','.join(existing_files + saved_files)
-            else:
-                # Create new field value
-                db.session.add(ViolationFieldValue(
-                    violation_id=vid,
-                    field_definition_id=field_def.id,
-                    value=','.join(saved_files)
-                ))
-            
+            for file, upload in uploads:
+                unique_filename = f"{uuid.uuid4()}_{secure_filename(file.filename)}"
+                saved_files.append(attach_upload(upload, vid, unique_filename))
+            append_field_value_files(vid, field_def.id, saved_files)
             db.session.commit()
         except Exception as e:
             current_app.logger.error(f"Database error storing file paths: {str(e)}")
             db.session.rollback()
+            for file, upload in uploads:
+                revert_upload(upload)
             return jsonify({'error': f'Database error: {str(e)}'}), 500
         
+        current_app.logger.info(f"Stored {len(saved_files)} uploads for violation {vid}")
+        
         # Regenerate the HTML and PDF after adding files
         try:
             # Refresh the violation object from the database to ensure it's bound to the current session
@@ -491,10 +491,10 @@ def get_uploaded_file(filename):
         if 'saved_files' in path_parts:
             # New-style path
             base_dir = os.path.join(current_app.config['BASE_DIR'])
-            return send_from_directory(base_dir, filename)
+            return send_protected_file(base_dir, filename)
         else:
             # Old-style path (compatibility)
-            return send_from_directory(UPLOAD_FOLDER, filename)
+            return send_protected_file(UPLOAD_FOLDER, filename)
     except Exception as e:
         current_app.logger.error(f"Error serving uploaded file {filename}: {str(e)}")
         abort(500)  # Internal server error
@@ -539,8 +539,8 @@ def get_evidence_file(violation_id, filename):
         abort(403) # Forbidden
 
     # Construct the secure directory path based on the violation ID
-    # Ensure this path structure matches where secure_handle_uploaded_file saves files
-    # Check secure_handle_uploaded_file: os.path.join(BASE_DIR, 'saved_files', 'uploads', subdir, f'violation_{violation_id}')
+    # Ensure this path structure matches where evidence_store.attach_upload links files
+    # Check attach_upload: os.path.join('saved_files', 'uploads', subdir, f'violation_{violation_id}', filename)
     # The subdir used when saving evidence should be consistent here (e.g., 'evidence' or 'fields')
     # Assuming 'fields' as per the previous logic, but VERIFY this.
     directory = os.path.join(
@@ -562,7 +562,7 @@ def get_evidence_file(violation_id, filename):
              current_app.logger.error(f"File not found at path: {file_path}")
              abort(404)
 
-        return send_from_directory(directory, filename, as_attachment=False) # Set as_attachment=True to force download
+        return send_protected_file(directory, filename, as_attachment=False) # Set as_attachment=True to force download
     except FileNotFoundError:
         # This might be redundant if the check above works, but keep for safety
         current_app.logger.error(f"send_from_directory failed: File not found: {filename} in {directory}")
@@ -704,9 +704,8 @@ def api_list_violations():
             
             # Add creator email
             try:
-                from .models import User
                 if row.created_by:
-                    creator = User.query.get(row.created_by)
+                    creator = get_user(row.created_by)
                     if creator:
                         violation['created_by_email'] = creator.email
             except Exception as user_err:
@@ -741,8 +740,7 @@ def api_violation_detail(vid):
         return jsonify({'error': 'Forbidden'}), 403
     
     # Get user who created the violation
-    from .models import User
-    creator = User.query.get(v.created_by) if v.created_by else None
+    creator = get_user(v.created_by) if v.created_by else None
     creator_email = creator.email if creator else None
     
     # Get all field values for this violation
@@ -951,8 +949,13 @@ def api_delete_violation(vid):
     if not (is_admin or v.created_by == user_id):
         return jsonify({'error': 'Forbidden'}), 403
     ViolationFieldValue.query.filter_by(violation_id=v.id).delete()
+    from .upload_routes import delete_violation_upload_sessions
+    delete_violation_upload_sessions(v.id)
+    # Release evidence references; files are only removed once the delete is committed
+    evidence_files = release_violation_evidence(v.id)
     db.session.delete(v)
     db.session.commit()
+    remove_evidence_files(evidence_files)
     return jsonify({'success': True})
 
 @violation_bp.route('/api/violations/<int:vid>/fields', methods=['GET'])
@@ -1057,7 +1060,7 @@ def notify_about_reply(reply):
     # Get the creator
     creator = None
     if violation.created_by:
-        creator = User.query.get(violation.created_by)
+        creator = get_user(violation.created_by)
     
     # Get email recipients (creator + global notifications)
     recipients = []
@@ -1142,27 +1145,12 @@ This link is valid for 24 hours and your access will be logged for security purp
 @violation_bp.route('/violations/secure/<token>')
 def view_secure_violation(token):
     """Public route to securely view a violation with token authentication"""
-    # Validate the token and get violation ID
-    violation_id = validate_secure_access_token(token)
+    # Validate the token and resolve its violation (ID or public_id)
+    violation_id, violation = get_secure_violation(token)
     if not violation_id:
         current_app.logger.warning(f"Invalid or expired token attempted: {token}")
         abort(403)  # Forbidden
     
-    # Try to determine if violation_id is a regular ID or a UUID
-    violation = None
-    
-    # First try to parse as integer for regular ID
-    try:
-        if isinstance(violation_id, int) or violation_id.isdigit():
-            numeric_id = int(violation_id)
-            violation = Violation.query.get(numeric_id)
-        else:
-            # If not an integer, assume it's a UUID
-            violation = Violation.query.filter_by(public_id=violation_id).first()
-    except (ValueError, AttributeError):
-        # If parsing fails, try the UUID lookup
-        violation = Violation.query.filter_by(public_id=str(violation_id)).first()
-    
     if not violation:
         current_app.logger.warning(f"Violation not found for ID/public_id: {violation_id}")
         abort(404)  # Not found
@@ -1198,32 +1186,17 @@ def view_secure_violation(token):
     html_filename = os.path.basename(violation.html_path)
     
     # Serve the file
-    return send_from_directory(html_dir, html_filename)
+    return send_protected_file(html_dir, html_filename)
 
 @violation_bp.route('/violations/secure/<token>/pdf')
 def download_secure_violation_pdf(token):
     """Download a violation PDF with token authentication"""
-    # Validate the token and get violation ID
-    violation_id = validate_secure_access_token(token)
+    # Validate the token and resolve its violation (ID or public_id)
+    violation_id, violation = get_secure_violation(token)
     if not violation_id:
         current_app.logger.warning(f"Invalid or expired token attempted for PDF: {token}")
         abort(403)  # Forbidden
     
-    # Try to determine if violation_id is a regular ID or a UUID
-    violation = None
-    
-    # First try to parse as integer for regular ID
-    try:
-        if isinstance(violation_id, int) or violation_id.isdigit():
-            numeric_id = int(violation_id)
-            violation = Violation.query.get(numeric_id)
-        else:
-            # If not an integer, assume it's a UUID
-            violation = Violation.query.filter_by(public_id=violation_id).first()
-    except (ValueError, AttributeError):
-        # If parsing fails, try the UUID lookup
-        violation = Violation.query.filter_by(public_id=str(violation_id)).first()
-    
     if not violation:
         current_app.logger.warning(f"Violation not found for ID/public_id: {violation_id}")
         abort(404)  # Not found
@@ -1285,7 +1258,7 @@ def download_secure_violation_pdf(token):
     pdf_filename = os.path.basename(violation.pdf_path)
     
     # Serve the file
-    return send_from_directory(
+    return send_protected_file(
         pdf_dir,
         pdf_filename,
         as_attachment=True,
@@ -1343,8 +1316,7 @@ def api_violation_detail_public(public_id):
     claims = get_jwt(); is_admin = claims.get('is_admin'); user_id = get_jwt_identity()
     if not (is_admin or v.created_by == user_id):
         return jsonify({'error': 'Forbidden'}), 403
-    from .models import User
-    creator = User.query.get(v.created_by) if v.created_by else None
+    creator = get_user(v.created_by) if v.created_by else None
     creator_email = creator.email if creator else None
     field_values = ViolationFieldValue.query.filter_by(violation_id=v.id).all()
     dynamic_fields = {}
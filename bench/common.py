@@ -0,0 +1,126 @@
+"""
+Shared helpers for the benchmark scripts: app setup, timing and result files.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+def make_app(database_url=None):
+    """
+    Create the app for benchmarking
+
+    Background work that would compete with the measurements (maintenance thread,
+    rate limits) is switched off unless the environment already sets it.
+
+    Args:
+        database_url (str): Overrides DATABASE_URL, e.g. sqlite:////tmp/bench.db
+
+    Returns:
+        Flask: Application
+    """
+    if database_url:
+        os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('MAINTENANCE_ENABLED', 'false')
+    os.environ.setdefault('RATELIMIT_ENABLED', 'false')
+    os.environ.setdefault('RATELIMIT_STORAGE_URI', 'memory://')
+    from app import create_app
+    return create_app(os.environ.get('FLASK_ENV', 'default'))
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def summarize(durations):
+    """
+    Summary statistics for a list of durations in seconds
+
+    Returns:
+        dict: Count and min/mean/median/p95/p99/max in milliseconds
+    """
+    if not durations:
+        return {'count': 0}
+    ms = [d * 1000 for d in durations]
+    return {
+        'count': len(ms),
+        'min_ms': round(min(ms), 3),
+        'mean_ms': round(statistics.fmean(ms), 3),
+        'median_ms': round(statistics.median(ms), 3),
+        'p95_ms': round(percentile(ms, 0.95), 3),
+        'p99_ms': round(percentile(ms, 0.99), 3),
+        'max_ms': round(max(ms), 3),
+    }
+
+def measure(fn, runs, warmup=1):
+    """
+    Time repeated calls of fn
+
+    Args:
+        fn: Callable without arguments
+        runs (int): Measured calls
+        warmup (int): Unmeasured calls first
+
+    Returns:
+        dict: summarize() of the measured calls
+    """
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    return summarize(durations)
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_results(suite, parameters, results, output=None):
+    """
+    Write a result file that compare.py can diff against another commit's
+
+    Args:
+        suite (str): 'micro' or 'load'
+        parameters (dict): Settings the run used
+        results (dict): Benchmark name -> summary
+        output (str): File path (default bench/results/<suite>-<commit>-<time>.json)
+
+    Returns:
+        str: Path written
+    """
+    commit = _git_commit()
+    document = {
+        'suite': suite,
+        'commit': commit,
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': parameters,
+        'results': results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{suite}-{commit or 'nogit'}-{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=2)
+    return output
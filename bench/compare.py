@@ -0,0 +1,69 @@
+"""
+Compare two benchmark result files
+
+    python bench/compare.py bench/results/micro-abc123-....json bench/results/micro-def456-....json
+
+Prints each benchmark's median and p95 for both runs and the relative change.
+Exits with status 1 when a median got slower by more than --threshold percent,
+so it can gate CI.
+"""
+
+import sys
+import json
+import argparse
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def _change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+def compare(baseline, candidate, threshold):
+    """
+    Print a comparison table
+
+    Returns:
+        list: Names of benchmarks whose median regressed beyond threshold
+    """
+    regressions = []
+    print(f"{'benchmark':<28} {'median':>20} {'change':>8} {'p95':>20} {'change':>8}")
+    for name in sorted(set(baseline['results']) | set(candidate['results'])):
+        before = baseline['results'].get(name, {})
+        after = candidate['results'].get(name, {})
+        if 'median_ms' not in before or 'median_ms' not in after:
+            print(f"{name:<28} {'(not in both runs)':>20}")
+            continue
+        median_change = _change(before['median_ms'], after['median_ms'])
+        p95_change = _change(before['p95_ms'], after['p95_ms'])
+        print(f"{name:<28} {before['median_ms']:>9.2f} -> {after['median_ms']:>7.2f} "
+              f"{median_change if median_change is not None else 0:>+7.1f}% "
+              f"{before['p95_ms']:>9.2f} -> {after['p95_ms']:>7.2f} "
+              f"{p95_change if p95_change is not None else 0:>+7.1f}%")
+        if median_change is not None and median_change > threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10, help='Allowed median slowdown in percent')
+    args = parser.parse_args()
+
+    baseline, candidate = _load(args.baseline), _load(args.candidate)
+    if baseline.get('suite') != candidate.get('suite'):
+        raise SystemExit(f"Cannot compare a {baseline.get('suite')} run with a {candidate.get('suite')} run")
+    print(f"{baseline.get('commit')} ({baseline.get('created_at')}) -> {candidate.get('commit')} ({candidate.get('created_at')})")
+    if baseline.get('parameters') != candidate.get('parameters'):
+        print("Warning: the runs used different parameters")
+
+    regressions = compare(baseline, candidate, args.threshold)
+    if regressions:
+        print(f"Slower by more than {args.threshold}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
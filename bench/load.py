@@ -0,0 +1,179 @@
+"""
+HTTP load scenario
+
+Drives a running server (gunicorn or flask run) through the main user journey
+with --concurrency simulated users. Each iteration of a user:
+
+    login   POST /api/auth/login-jwt          (first iteration only)
+    list    GET  /api/violations?page=N
+    detail  GET  /api/violations/<id>
+    create  POST /api/violations
+    upload  POST /api/violations/<new id>/upload?field=bench_evidence
+    pdf     GET  /violations/pdf/<new id>
+
+    python bench/load.py --base-url http://127.0.0.1:5004 --email bench42-admin@example.com \\
+        --concurrency 8 --iterations 20
+
+Seed the server's database with bench/seed.py first (the upload step needs its
+bench_evidence field). Start the server with RATELIMIT_ENABLED=false, or the
+login and list limits will turn into 429s. Only the standard library is used so
+the client adds as little overhead as possible.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import summarize, write_results
+
+STEPS = ('login', 'list', 'detail', 'create', 'upload', 'pdf')
+
+class Recorder:
+    """Durations and errors per step, shared by all users"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {step: [] for step in STEPS}
+        self.errors = {step: {} for step in STEPS}
+
+    def add(self, step, duration, error=None):
+        with self.lock:
+            if error is None:
+                self.durations[step].append(duration)
+            else:
+                self.errors[step][error] = self.errors[step].get(error, 0) + 1
+
+class Client:
+    """One simulated user with its own cookie jar (the JWT is an HTTP-only cookie)"""
+
+    def __init__(self, base_url, timeout, recorder):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.recorder = recorder
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, step, method, path, body=None, headers=None):
+        """
+        Send one request and record its duration
+
+        Returns:
+            bytes: Response body, or None if the request failed
+        """
+        request = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                content = response.read()
+        except urllib.error.HTTPError as e:
+            e.read()
+            self.recorder.add(step, None, f"HTTP {e.code}")
+            return None
+        except (urllib.error.URLError, OSError) as e:
+            self.recorder.add(step, None, type(getattr(e, 'reason', e)).__name__)
+            return None
+        self.recorder.add(step, time.perf_counter() - started)
+        return content
+
+    def json(self, step, method, path, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else None
+        content = self.request(step, method, path, body, {'Content-Type': 'application/json'} if body else None)
+        if content is None:
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            return None
+
+    def upload(self, path, field, filename, content):
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+                f"Content-Type: text/plain\r\n\r\n").encode() + content + f"\r\n--{boundary}--\r\n".encode()
+        return self.request('upload', 'POST', path, body, {'Content-Type': f"multipart/form-data; boundary={boundary}"})
+
+def run_user(number, args, recorder, violation_ids):
+    rng = random.Random(args.seed + number)
+    client = Client(args.base_url, args.timeout, recorder)
+    if client.json('login', 'POST', '/api/auth/login-jwt', {'email': args.email, 'password': args.password}) is None:
+        return
+    evidence = (f"Bench evidence from user {number}\n" * 64).encode()
+    for iteration in range(args.iterations):
+        client.request('list', 'GET', f"/api/violations?page={rng.randint(1, args.list_pages)}&per_page=20")
+        if violation_ids:
+            client.request('detail', 'GET', f"/api/violations/{rng.choice(violation_ids)}")
+        if args.read_only:
+            continue
+        created = client.json('create', 'POST', '/api/violations', {
+            'category': 'Noise',
+            'building': 'North Tower',
+            'unit_number': f"{rng.randint(1, 25)}{rng.randint(1, 12):02d}",
+            'incident_date': time.strftime('%Y-%m-%d'),
+            'incident_time': '22:30',
+            'subject': f"Load test {number}-{iteration}",
+            'details': 'Loud music reported after quiet hours.',
+            'bench_location': 'Hallway',
+        })
+        if not created or 'id' not in created:
+            continue
+        if not args.skip_upload:
+            client.upload(f"/api/violations/{created['id']}/upload?field=bench_evidence", 'files',
+                          f"evidence-{number}-{iteration}.txt", evidence)
+        if not args.skip_pdf:
+            client.request('pdf', 'GET', f"/violations/pdf/{created['id']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:5004')
+    parser.add_argument('--email', default='bench42-admin@example.com')
+    parser.add_argument('--password', default='BenchPassw0rd!')
+    parser.add_argument('--concurrency', type=int, default=8, help='Simulated users running in parallel')
+    parser.add_argument('--iterations', type=int, default=20, help='Journeys per user')
+    parser.add_argument('--list-pages', type=int, default=10, help='Pick list pages from 1..N')
+    parser.add_argument('--read-only', action='store_true', help='Only login, list and detail')
+    parser.add_argument('--skip-upload', action='store_true')
+    parser.add_argument('--skip-pdf', action='store_true')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Result file (default bench/results/load-<commit>-<time>.json)')
+    args = parser.parse_args()
+
+    # Detail requests use ids from the first list page so they exist on any seeded database
+    recorder = Recorder()
+    probe = Client(args.base_url, args.timeout, Recorder())
+    if probe.json('login', 'POST', '/api/auth/login-jwt', {'email': args.email, 'password': args.password}) is None:
+        raise SystemExit(f"Could not log in to {args.base_url} as {args.email}")
+    listing = probe.json('list', 'GET', '/api/violations?page=1&per_page=100') or {}
+    violation_ids = [item['id'] for item in listing.get('violations', []) if 'id' in item]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(run_user, n, args, recorder, violation_ids) for n in range(args.concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for step in STEPS:
+        summary = summarize(recorder.durations[step])
+        summary['errors'] = recorder.errors[step]
+        results[step] = summary
+    completed = sum(len(durations) for durations in recorder.durations.values())
+    failed = sum(sum(errors.values()) for errors in recorder.errors.values())
+    results['total'] = {'requests': completed + failed, 'errors': failed, 'seconds': round(elapsed, 3),
+                        'requests_per_second': round(completed / elapsed, 2) if elapsed else None}
+
+    parameters = {name: value for name, value in vars(args).items() if name not in ('password', 'output')}
+    path = write_results('load', parameters, results, args.output)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {path}")
+
+if __name__ == '__main__':
+    main()
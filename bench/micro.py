@@ -0,0 +1,111 @@
+"""
+Micro-benchmarks
+
+Times the hot helpers in-process against a seeded database:
+
+- create_violation_html: field values, replies and template render, plus the file write
+- generate_violation_pdf: WeasyPrint render from the HTML (skipped when WeasyPrint is not installed)
+- get_cached_fields: cold (cache cleared each call) and warm
+- Violation.to_dict and UnitProfile.to_dict
+
+    python bench/micro.py --database-url sqlite:////tmp/bench.db --runs 50
+
+Files written by the HTML/PDF benchmarks are deleted afterwards.
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import make_app, measure, write_results
+
+def _remove(app, relative_paths):
+    for relative_path in relative_paths:
+        try:
+            os.remove(os.path.join(app.config['BASE_DIR'], relative_path))
+        except (OSError, TypeError):
+            pass
+
+def run(app, args):
+    from app import db
+    from app.models import Violation, UnitProfile
+    from app.utils import create_violation_html, generate_violation_pdf, get_cached_fields, clear_field_cache
+
+    rng = random.Random(args.seed)
+    violation_ids = [row.id for row in db.session.query(Violation.id).order_by(Violation.id).limit(args.sample)]
+    units = UnitProfile.query.limit(args.sample).all()
+    if not violation_ids:
+        raise SystemExit('No violations found; run bench/seed.py first')
+
+    def pick_violation():
+        return db.session.get(Violation, rng.choice(violation_ids))
+
+    results = {}
+    written = []
+
+    def html():
+        violation = pick_violation()
+        create_violation_html(violation)
+        written.append(violation.html_path)
+    results['create_violation_html'] = measure(html, args.runs, args.warmup)
+
+    if importlib.util.find_spec('weasyprint'):
+        violation = pick_violation()
+        _, html_content = create_violation_html(violation)
+        written.append(violation.html_path)
+
+        def pdf():
+            generate_violation_pdf(violation, html_content)
+            written.append(violation.pdf_path)
+        results['generate_violation_pdf'] = measure(pdf, max(1, args.runs // 5), args.warmup)
+    else:
+        results['generate_violation_pdf'] = {'skipped': 'weasyprint is not installed'}
+    _remove(app, written)
+
+    def fields_cold():
+        clear_field_cache()
+        get_cached_fields('all')
+    results['get_cached_fields_cold'] = measure(fields_cold, args.runs, args.warmup)
+    results['get_cached_fields_warm'] = measure(lambda: get_cached_fields('all'), args.runs * 10, args.warmup)
+
+    def violation_to_dict():
+        # Expire first so the relationship and column loads are part of the measurement
+        violation = pick_violation()
+        db.session.expire(violation)
+        violation.to_dict()
+    results['violation_to_dict'] = measure(violation_to_dict, args.runs, args.warmup)
+
+    if units:
+        def unit_to_dict():
+            unit = rng.choice(units)
+            db.session.expire(unit)
+            unit.to_dict()
+        results['unit_profile_to_dict'] = measure(unit_to_dict, args.runs, args.warmup)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Seeded database (default: DATABASE_URL / app config)')
+    parser.add_argument('--runs', type=int, default=50, help='Measured calls per benchmark')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--sample', type=int, default=500, help='Rows to pick violations and units from')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Result file (default bench/results/micro-<commit>-<time>.json)')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    with app.test_request_context('/'):
+        results = run(app, args)
+    path = write_results('micro', {'runs': args.runs, 'warmup': args.warmup, 'sample': args.sample,
+                                   'seed': args.seed, 'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0]},
+                         results, args.output)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {path}")
+
+if __name__ == '__main__':
+    main()
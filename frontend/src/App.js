@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useState, useRef } from 'react';
 import { BrowserRouter as Router, Routes, Route, Navigate, useNavigate, useLocation } from 'react-router-dom';
 import Login from './views/auth/Login';
 import Dashboard from './views/Dashboard';
@@ -20,10 +20,20 @@ import ObfuscatedRouter from './components/ObfuscatedRouter';
 import UnitCreatePage from './views/UnitCreatePage';
 import SentryTest from './components/debug/SentryTest';
 
+// Sent with each submission so a retried request is answered from the server's
+// stored response instead of creating the violation (or uploading) again.
+// Keys are kept while the form values stay the same (see NewViolationPage).
+const newIdempotencyKey = () => (window.crypto && window.crypto.randomUUID)
+  ? window.crypto.randomUUID()
+  : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
 function NewViolationPage() {
   const navigate = useNavigate();
   const [isSubmitting, setIsSubmitting] = useState(false);
   const [submitMessage, setSubmitMessage] = useState('Submitting...'); // For more detailed feedback
+  // Idempotency keys for this form attempt: a re-submit after a timeout reuses them,
+  // so the server replays the first response instead of creating a duplicate
+  const idempotencyKeys = useRef({ signature: null, create: null, upload: null });
   
   const handleSubmit = async (values) => {
     setIsSubmitting(true);
@@ -32,12 +42,22 @@ function NewViolationPage() {
     // 1. Separate files from other data
     const { attach_evidence, ...violationData } = values;
     const filesToUpload = attach_evidence || [];
+
+    const signature = JSON.stringify(violationData) + '|' +
+      filesToUpload.map((file) => `${file.name}:${file.size}:${file.lastModified}`).join(',');
+    if (idempotencyKeys.current.signature !== signature) {
+      // New or changed values: a new attempt
+      idempotencyKeys.current = { signature, create: newIdempotencyKey(), upload: newIdempotencyKey() };
+    }
+    const keys = idempotencyKeys.current;
     
     let violationId = null;
 
     try {
       // 2. Create the violation record (without files)
-      const createResponse = await API.post('/api/violations', violationData);
+      const createResponse = await API.post('/api/violations', violationData, {
+        headers: { 'Idempotency-Key': keys.create },
+      });
       
       if (!createResponse.data || !createResponse.data.id) {
         throw new Error('Failed to create violation record. No ID received.');
@@ -63,6 +83,7 @@ function NewViolationPage() {
           const uploadResponse = await API.post(`/api/violations/${violationId}/upload`, formData, {
             headers: {
               'Content-Type': 'multipart/form-data',
+              'Idempotency-Key': keys.upload,
             },
           });
           console.log('File upload response:', uploadResponse.data);
@@ -81,6 +102,7 @@ function NewViolationPage() {
       }
 
       // 4. Success - Navigate to the new violation detail page
+      idempotencyKeys.current = { signature: null, create: null, upload: null };
       setSubmitMessage('Success!');
       setIsSubmitting(false);
       navigate(`/violations/${violationId}`);
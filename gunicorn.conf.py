@@ -3,8 +3,19 @@ import multiprocessing
 import os
 
 # Worker Processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = 'sync'  # or 'gevent' if you install and need async workers
+# 'sync' serves one request per process. 'gevent' serves up to worker_connections
+# requests per process as greenlets, so slow SMTP, ClamAV scans and downloads no
+# longer pin a whole process (see docs/gevent_deployment.md and app/concurrency.py).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+if worker_class == 'gevent':
+    # One process per core is enough; concurrency comes from greenlets
+    workers = int(os.environ.get('WEB_CONCURRENCY') or multiprocessing.cpu_count())
+    worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS') or 100)
+else:
+    workers = int(os.environ.get('WEB_CONCURRENCY') or multiprocessing.cpu_count() * 2 + 1)
+
+# Workers split DB_CONNECTION_BUDGET between them (app/db_pool.py)
+os.environ['GUNICORN_WORKERS'] = str(workers)
 
 # Socket Binding
 # Use a Unix socket for communication with Nginx
@@ -44,6 +55,37 @@ raw_env = [
     # e.g., f"SECRET_KEY={os.environ.get('SECRET_KEY')}" - although systemd is better for secrets
 ]
 
+# Preloading imports the app once in the master; workers are forked from it and
+# share its memory copy-on-write, so they boot in milliseconds. gevent workers
+# monkey-patch after fork, which is too late for a preloaded app, so preloading
+# is off by default for them.
+preload_app = (os.environ.get('GUNICORN_PRELOAD') or ('false' if worker_class == 'gevent' else 'true')).lower() == 'true'
+if preload_app:
+    # The master must not query the database; post_fork loads the SMTP settings
+    os.environ['MAIL_SETTINGS_DEFERRED'] = 'true'
+
+def on_starting(server):
+    # Drop metrics files left by the previous run's workers (app/metrics.py)
+    metrics_dir = os.environ.get('METRICS_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'saved_files', 'metrics')
+    if os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(metrics_dir, name))
+
+def pre_fork(server, worker):
+    # The master must not hold pooled DB connections that workers would inherit
+    if server.cfg.preload_app:
+        from app.concurrency import release_before_fork
+        release_before_fork(server.app.wsgi())
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from app import load_mail_settings
+        from app.concurrency import reset_after_fork
+        app = server.app.wsgi()
+        reset_after_fork(app)
+        load_mail_settings(app)
+
 # Other settings
 keepalive = 5
 timeout = 120 # Increase if you have long-running requests 
\ No newline at end of file
@@ -131,6 +131,17 @@ CREATE TABLE `violation_access_logs` (
 -- Adding index on violation_id and token
 CREATE INDEX `idx_access_log_violation` ON `violation_access_logs` (`violation_id`);
 CREATE INDEX `idx_access_log_token` ON `violation_access_logs` (`token`);
+CREATE INDEX `ix_violation_access_logs_accessed_at` ON `violation_access_logs` (`accessed_at`);
+
+-- Daily view counts rolled up from violation_access_logs past retention
+DROP TABLE IF EXISTS `violation_access_daily`;
+CREATE TABLE `violation_access_daily` (
+  `violation_id` INT NOT NULL,
+  `day` DATE NOT NULL,
+  `access_count` INT NOT NULL,
+  PRIMARY KEY (`violation_id`, `day`),
+  FOREIGN KEY (`violation_id`) REFERENCES `violations` (`id`) ON UPDATE NO ACTION ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 DROP TABLE IF EXISTS `violations`;
 CREATE TABLE `violations` (
@@ -192,5 +203,6 @@ CREATE TABLE `violation_status_log` (
 
 -- Adding index on violation_id for faster status log lookup
 CREATE INDEX `idx_status_log_violation` ON `violation_status_log` (`violation_id`);
+CREATE INDEX `ix_violation_status_log_timestamp` ON `violation_status_log` (`timestamp`);
 
 SET FOREIGN_KEY_CHECKS=1;
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""Add violation_access_daily rollup table and retention indexes
+
+Revision ID: add_access_log_rollup
+Revises: add_user_sessions_expires_index
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_access_log_rollup'
+down_revision = 'add_user_sessions_expires_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('violation_access_daily',
+        sa.Column('violation_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('access_count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['violation_id'], ['violations.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('violation_id', 'day')
+    )
+    op.create_index(op.f('ix_violation_access_logs_accessed_at'), 'violation_access_logs', ['accessed_at'], unique=False)
+    op.create_index(op.f('ix_violation_status_log_timestamp'), 'violation_status_log', ['timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_violation_status_log_timestamp'), table_name='violation_status_log')
+    op.drop_index(op.f('ix_violation_access_logs_accessed_at'), table_name='violation_access_logs')
+    op.drop_table('violation_access_daily')
@@ -0,0 +1,53 @@
+"""Add content-addressed evidence store tables
+
+Revision ID: add_evidence_store
+Revises: 893169bd5579
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_evidence_store'
+down_revision = '893169bd5579'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # One row per stored blob, keyed by content hash
+    op.create_table(
+        'evidence_blobs',
+        sa.Column('sha256', sa.String(64), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('mime_type', sa.String(255), nullable=True),
+        sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('sha256')
+    )
+
+    # Per-violation references to blobs
+    op.create_table(
+        'evidence_references',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('blob_sha256', sa.String(64), nullable=False),
+        sa.Column('violation_id', sa.Integer(), nullable=False),
+        sa.Column('path', sa.String(512), nullable=False),
+        sa.Column('original_filename', sa.String(255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['blob_sha256'], ['evidence_blobs.sha256'], ),
+        sa.ForeignKeyConstraint(['violation_id'], ['violations.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('path')
+    )
+    op.create_index(op.f('ix_evidence_references_blob_sha256'), 'evidence_references', ['blob_sha256'], unique=False)
+    op.create_index(op.f('ix_evidence_references_violation_id'), 'evidence_references', ['violation_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_evidence_references_violation_id'), table_name='evidence_references')
+    op.drop_index(op.f('ix_evidence_references_blob_sha256'), table_name='evidence_references')
+    op.drop_table('evidence_references')
+    op.drop_table('evidence_blobs')
@@ -0,0 +1,45 @@
+"""Add resumable upload sessions table
+
+Revision ID: add_upload_sessions
+Revises: add_evidence_store
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_upload_sessions'
+down_revision = 'add_evidence_store'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'upload_sessions',
+        sa.Column('id', sa.String(36), nullable=False),
+        sa.Column('violation_id', sa.Integer(), nullable=False),
+        sa.Column('field_name', sa.String(64), nullable=False),
+        sa.Column('filename', sa.String(255), nullable=False),
+        sa.Column('total_size', sa.BigInteger(), nullable=False),
+        sa.Column('chunk_size', sa.Integer(), nullable=False),
+        sa.Column('sha256', sa.String(64), nullable=True),
+        sa.Column('status', sa.String(20), nullable=False, server_default='open'),
+        sa.Column('result_path', sa.String(512), nullable=True),
+        sa.Column('created_by', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['violation_id'], ['violations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['created_by'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_upload_sessions_violation_id'), 'upload_sessions', ['violation_id'], unique=False)
+    op.create_index(op.f('ix_upload_sessions_expires_at'), 'upload_sessions', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_upload_sessions_expires_at'), table_name='upload_sessions')
+    op.drop_index(op.f('ix_upload_sessions_violation_id'), table_name='upload_sessions')
+    op.drop_table('upload_sessions')
@@ -0,0 +1,24 @@
+"""Index user_sessions.expires_at for session cleanup
+
+Revision ID: add_user_sessions_expires_index
+Revises: add_upload_sessions
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_user_sessions_expires_index'
+down_revision = 'add_upload_sessions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_user_sessions_expires_at'), 'user_sessions', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_sessions_expires_at'), table_name='user_sessions')
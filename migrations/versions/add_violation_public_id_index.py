@@ -0,0 +1,48 @@
+"""Restore the unique index on violations.public_id
+
+Secure links that carry a public_id are resolved with a lookup on this column.
+The index was dropped by 893169bd5579; databases created from mariadb_schema.sql
+still have it and are left unchanged. A non-unique index on the column does not
+count and is replaced by the unique one.
+
+Revision ID: add_violation_public_id_index
+Revises: partition_access_logs
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_violation_public_id_index'
+down_revision = 'partition_access_logs'
+branch_labels = None
+depends_on = None
+
+
+def _public_id_indexes():
+    """Indexes on exactly public_id, as {name: unique}"""
+    inspector = sa.inspect(op.get_bind())
+    return {index['name']: bool(index['unique']) for index in inspector.get_indexes('violations')
+            if index['column_names'] == ['public_id']}
+
+
+def _has_unique_constraint():
+    inspector = sa.inspect(op.get_bind())
+    return any(constraint['column_names'] == ['public_id']
+               for constraint in inspector.get_unique_constraints('violations'))
+
+
+def upgrade():
+    indexes = _public_id_indexes()
+    if any(indexes.values()) or _has_unique_constraint():
+        return
+    for name in indexes:
+        op.drop_index(name, table_name='violations')
+    op.create_index('idx_violation_public_id', 'violations', ['public_id'], unique=True)
+
+
+def downgrade():
+    if 'idx_violation_public_id' in _public_id_indexes():
+        op.drop_index('idx_violation_public_id', table_name='violations')
@@ -0,0 +1,28 @@
+"""Partition violation_access_logs by month (no-op, see flask partition-access-logs)
+
+This revision used to rebuild the access log as monthly partitions when
+ACCESS_LOG_PARTITIONING=true. Being in the middle of the chain, enabling it later
+meant downgrading every revision after it. The rebuild now lives in
+`flask partition-access-logs` (app/log_retention.py), which can be run at any time
+and undone with --undo; the revision is kept so existing databases stay on the chain.
+
+Revision ID: partition_access_logs
+Revises: add_access_log_rollup
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = 'partition_access_logs'
+down_revision = 'add_access_log_rollup'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
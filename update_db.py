@@ -1,5 +1,5 @@
 from app import create_app, db
-import MySQLdb
+import pymysql as MySQLdb
 from flask import current_app
 import re
 
@@ -112,8 +112,7 @@ def update_requirements():
     
     # Check if dependencies are already in requirements.txt
     dependencies = {
-        'pymysql': 'pymysql>=1.0.2',
-        'mysqlclient': 'mysqlclient>=2.1.0'
+        'pymysql': 'pymysql>=1.0.2'
     }
     
     existing_deps = {line.split('==')[0].split('>=')[0].strip().lower() for line in content}
@@ -131,7 +130,7 @@ def install_dependencies():
     """Install required Python packages"""
     print("Installing required Python packages...")
     try:
-        subprocess.run([sys.executable, '-m', 'pip', 'install', 'pymysql', 'mysqlclient'], check=True)
+        subprocess.run([sys.executable, '-m', 'pip', 'install', 'pymysql'], check=True)
         print("Successfully installed dependencies")
         return True
     except subprocess.CalledProcessError as e: